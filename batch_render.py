@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import os
+
+# the raw video is written to stdout, so pygame's greeting should not be
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import multiprocessing
+import sys
+import time
+import numpy as np
+import pygame
+from mesh import load_mesh_from_obj
+from graphics_pipeline import GraphicsPipeline
+from camera import Camera
+from shading import Material, PixelShader
+from texture import load_texture_from_image
+from render import MODES
+
+FOV = np.deg2rad(60)
+# number of frames handed to a worker at a time
+CHUNK_SIZE = 4
+
+# the assets (meshes and their textures) to render, loaded once by the main process,
+# the forked workers share them (copy on write, and they are only read)
+ASSETS = []
+# the settings of the render (size, mode, ...) set along with the assets
+SETTINGS = {}
+# pipelines of each worker, one per asset (created on first use)
+PIPELINES = {}
+
+
+# loads the meshes (and the textures next to them, if any) to render
+# the meshes are flipped vertically (like main.py does), as the screen's y points down
+def load_assets(obj_files, settings):
+    ASSETS.clear()
+    for obj_file in obj_files:
+        mesh = load_mesh_from_obj(obj_file)
+        mesh.scale = np.array([1.0, -1.0, 1.0])
+        texture_file = os.path.splitext(obj_file)[0] + ".png"
+        if os.path.exists(texture_file):
+            mesh.texture = load_texture_from_image(texture_file)
+        # computed here (once), so the workers don't compute them each
+        mesh.bounding_box, mesh.bounding_sphere
+        ASSETS.append(mesh)
+    SETTINGS.clear()
+    SETTINGS.update(settings)
+
+
+# the camera's eye and target for the frame of the asset's turntable,
+# circling the mesh (at the given elevation) so that it fills the view
+def turntable_pose(mesh, frame, frames, elevation):
+    center, radius = mesh.bounding_sphere
+    center = (mesh.world_matrix @ np.array([*center, 1.0]))[:3]
+    radius = radius * np.abs(mesh.scale).max()
+    distance = radius / np.sin(FOV / 2)
+    angle = 2 * np.pi * frame / frames
+    direction = np.array(
+        [
+            np.cos(elevation) * np.sin(angle),
+            -np.sin(elevation),  # the screen's y points down
+            -np.cos(elevation) * np.cos(angle),
+        ]
+    )
+    return center + distance * direction, center
+
+
+# renders the frame of the asset's turntable (in a worker process)
+# returns the asset and frame numbers, and the image as rgb bytes (row by row)
+def render_frame(job):
+    asset, frame = job
+    width, height = SETTINGS["size"]
+    if asset not in PIPELINES:
+        mesh = ASSETS[asset]
+        _, radius = mesh.bounding_sphere
+        radius = radius * np.abs(mesh.scale).max()
+        distance = radius / np.sin(FOV / 2)
+        camera = Camera(
+            FOV,
+            width / height,
+            max(distance - radius, distance / 100),
+            distance + radius,
+            verbose=False,
+        )
+        surface = pygame.Surface((width, height))
+        shader = PixelShader(
+            light_direction=np.array([0, 1, 1]),
+            material=Material(
+                ambient=0.4, diffuse=0.4, specular=0.2, specular_exponent=10
+            ),
+        )
+        PIPELINES[asset] = GraphicsPipeline(
+            [mesh], camera, surface, shader=shader, rasterizer=SETTINGS["rasterizer"]
+        )
+
+    pipeline = PIPELINES[asset]
+    eye, target = turntable_pose(
+        pipeline.meshs[0], frame, SETTINGS["frames"], SETTINGS["elevation"]
+    )
+    pipeline.camera.look_at(eye=eye, target=target)
+    pipeline.update()
+    pipeline.screen.fill((0, 0, 0))
+    getattr(pipeline, SETTINGS["mode"])()
+    return asset, frame, pygame.image.tobytes(pipeline.screen, "RGB")
+
+
+# renders the turntables of the meshes (obj files) across a pool of processes
+# yields the asset and frame numbers and the image (rgb bytes) of every frame,
+# in order (all the frames of the first asset, then the second, ...)
+# processes: number of worker processes (all the cpus by default)
+def batch_render(
+    obj_files,
+    frames=36,
+    size=(256, 256),
+    mode="draw",
+    rasterizer="vectorized",
+    elevation=np.deg2rad(20),
+    processes=None,
+):
+    assert mode in MODES, f"unknown mode: {mode}"
+    settings = {
+        "frames": frames,
+        "size": size,
+        "mode": mode,
+        "rasterizer": rasterizer,
+        "elevation": elevation,
+    }
+    jobs = [
+        (asset, frame) for asset in range(len(obj_files)) for frame in range(frames)
+    ]
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        # the assets are loaded once, and inherited by the workers
+        load_assets(obj_files, settings)
+        pool = multiprocessing.get_context("fork").Pool(processes)
+    else:
+        # each worker has to load the assets on its own
+        pool = multiprocessing.Pool(processes, load_assets, (obj_files, settings))
+
+    with pool:
+        yield from pool.imap(render_frame, jobs, chunksize=CHUNK_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Renders turntables (the camera circling around) of the models across a pool of processes, to png images or to a raw video stream.",
+        prog="python3 batch_render.py",
+    )
+    parser.add_argument("obj_files", nargs="+", help="wavefront obj files to render")
+    parser.add_argument("--frames", type=int, default=36, help="frames per turntable")
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--mode", choices=MODES, default="draw")
+    parser.add_argument("--rasterizer", default="vectorized")
+    parser.add_argument(
+        "--elevation", type=float, default=20.0, help="camera elevation in degrees"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=None, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--output",
+        default="{name}_{frame:04d}.png",
+        help="image file name pattern (formatted with the model's name and the frame "
+        "number), or - to write the frames in order as raw rgb24 video to stdout",
+    )
+    args = parser.parse_args()
+
+    images = batch_render(
+        args.obj_files,
+        frames=args.frames,
+        size=(args.width, args.height),
+        mode=args.mode,
+        rasterizer=args.rasterizer,
+        elevation=np.deg2rad(args.elevation),
+        processes=args.processes,
+    )
+
+    total = len(args.obj_files) * args.frames
+    begin = time.perf_counter()
+    for rendered, (asset, frame, image) in enumerate(images, start=1):
+        if args.output == "-":
+            sys.stdout.buffer.write(image)
+        else:
+            name = os.path.splitext(os.path.basename(args.obj_files[asset]))[0]
+            surface = pygame.image.frombytes(image, (args.width, args.height), "RGB")
+            pygame.image.save(surface, args.output.format(name=name, frame=frame))
+        elapsed = time.perf_counter() - begin
+        remaining = elapsed / rendered * (total - rendered)
+        print(
+            f"{rendered}/{total} frames, {rendered / elapsed:.2f} fps, "
+            f"{remaining:.1f}s remaining",
+            file=sys.stderr,
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
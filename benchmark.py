@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pygame
+from mesh import Mesh, InstancedMesh, load_mesh_from_obj
+from graphics_pipeline import GraphicsPipeline, SHADING_MODES
+from camera import Camera
+from shading import Material, PixelShader
+from texture import Texture, FILTERINGS
+
+BENCHMARK_DIRECTORY = os.path.join(os.path.dirname(__file__), "benchmarks")
+# the models of the scenes (wherever the benchmark is run from)
+MODEL_DIRECTORY = os.path.join(os.path.dirname(__file__), "models")
+BASELINE_FILE = os.path.join(BENCHMARK_DIRECTORY, "baseline.json")
+# the golden images of each configuration are in a directory of their own
+GOLDEN_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "golden")
+
+# the pipeline's methods that are benchmarked, update first (the draws need it)
+METHODS = ["update", "draw", "draw_textured", "draw_depth", "draw_wireframe"]
+# a method is flagged as a regression when it is slower than the baseline by this much
+REGRESSION_THRESHOLD = 1.2
+# and slower by at least this many milliseconds (sub-millisecond timings vary by more
+# than the threshold between runs)
+REGRESSION_MIN_DIFFERENCE_MS = 1.0
+# the images may differ from the golden ones in at most these many pixels (as a fraction),
+# by at most this much (in any channel), to allow for floating point differences
+GOLDEN_MAX_DIFFERENT_PIXELS = 0.001
+GOLDEN_MAX_DIFFERENCE = 8
+# the pipeline options that change the images drawn (the others only change how fast
+# they are drawn, so their images are validated against the same golden images)
+IMAGE_OPTIONS = [
+    "rasterizer",
+    "sort_triangles",
+    "shading",
+    "filtering",
+    "perspective_correct",
+]
+
+
+# a texture of squares alternating between two colors (instead of an image file,
+# so that the benchmark doesn't depend on any)
+def checkerboard_texture(size=64, squares=8, filtering="nearest"):
+    x, y = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    checks = ((x * squares // size + y * squares // size) % 2).astype(bool)
+    texture = np.where(checks[:, :, np.newaxis], [230, 200, 80], [40, 90, 160])
+    return Texture(texture.astype(np.uint8), filtering)
+
+
+# a sphere of radius 1 centered at the origin, made of the given number of
+# segments (around the y axis) and rings (from pole to pole), ie, 2 x segments x rings
+# faces (some of which are degenerate at the poles), texture mapped by longitude/latitude
+def uv_sphere(segments, rings) -> Mesh:
+    u, v = np.meshgrid(
+        np.linspace(0, 1, segments + 1), np.linspace(0, 1, rings + 1), indexing="ij"
+    )
+    longitude, latitude = 2 * np.pi * u, np.pi * (v - 0.5)
+    vertices = np.stack(
+        [
+            np.cos(latitude) * np.cos(longitude),
+            np.sin(latitude),
+            np.cos(latitude) * np.sin(longitude),
+            np.ones_like(u),
+        ]
+    ).reshape(4, -1)
+
+    # the two triangles of each quad of the grid, with the vertices indexed [u, v]
+    index = np.arange((segments + 1) * (rings + 1)).reshape(segments + 1, rings + 1)
+    a, b = index[:-1, :-1].ravel(), index[1:, :-1].ravel()
+    c, d = index[1:, 1:].ravel(), index[:-1, 1:].ravel()
+    faces = np.concatenate([np.stack([a, b, c], 1), np.stack([a, c, d], 1)])
+    texture_coordinates = np.stack([u.ravel(), v.ravel()])
+    return Mesh(vertices, faces, texture_coordinates, faces.copy())
+
+
+# the benchmarked scenes, each is the meshes and the camera's eye and target
+def cube_scene():
+    mesh = load_mesh_from_obj(os.path.join(MODEL_DIRECTORY, "cube.obj"))
+    mesh.position = np.array([0.3, 0.2, 2.0])
+    mesh.rotation = np.array([0.5, 0.6, 0.1])
+    return [mesh], [0.0, 0.0, 0.0], [0.0, 0.0, 1.0]
+
+
+def cottage_scene():
+    mesh = load_mesh_from_obj(os.path.join(MODEL_DIRECTORY, "cottage.obj"))
+    mesh.scale = np.array([0.1, -0.1, 0.1])
+    mesh.position = np.array([0.0, 0.0, 10.0])
+    return [mesh], [-2.0, -1.5, 5.0], [0.0, -0.5, 10.0]
+
+
+def sphere_scene(segments, rings):
+    def scene():
+        mesh = uv_sphere(segments, rings)
+        mesh.position = np.array([0.0, 0.0, 3.0])
+        mesh.rotation = np.array([0.3, 0.5, 0.0])
+        return [mesh], [0.0, 0.0, 0.0], [0.0, 0.0, 1.0]
+
+    return scene
+
+
+# spheres one behind another, where most of the pixels drawn are drawn over
+def overdraw_scene():
+    meshs = []
+    for i in reversed(range(8)):
+        mesh = uv_sphere(32, 32)
+        mesh.position = np.array([0.1 * i, 0.0, 3.0 + 0.8 * i])
+        meshs.append(mesh)
+    return meshs, [0.0, 0.0, 0.0], [0.0, 0.0, 1.0]
+
+
+# the same sphere placed many times (see InstancedMesh), some outside the view
+def instanced_scene(instances=400):
+    rng = np.random.default_rng(0)
+    positions = np.column_stack(
+        [
+            rng.uniform(-15, 15, instances),
+            rng.uniform(-3, 3, instances),
+            rng.uniform(2, 40, instances),
+        ]
+    )
+    rotations = rng.uniform(0, 2 * np.pi, (instances, 3))
+    scales = rng.uniform(0.3, 1.2, (instances, 3))
+    mesh = InstancedMesh(uv_sphere(8, 8), positions, rotations, scales)
+    return [mesh], [0.0, 0.0, 0.0], [0.0, 0.0, 1.0]
+
+
+SCENES = {
+    "cube": cube_scene,
+    "cottage": cottage_scene,
+    "sphere_2k": sphere_scene(32, 32),
+    "sphere_8k": sphere_scene(64, 64),
+    "sphere_32k": sphere_scene(128, 128),
+    "overdraw": overdraw_scene,
+    "instanced": instanced_scene,
+}
+
+
+# the pipeline drawing the scene onto an off screen surface of the given size
+def create_pipeline(scene, width, height, filtering="nearest", **pipeline_options):
+    meshs, eye, target = SCENES[scene]()
+    for mesh in meshs:
+        if isinstance(mesh, InstancedMesh):
+            mesh = mesh.mesh
+        mesh.texture = checkerboard_texture(filtering=filtering)
+        if mesh.texture.mipmapped:
+            mesh.texture.mip_levels
+    camera = Camera(np.deg2rad(60), width / height, 0.1, 50.0, verbose=False)
+    camera.look_at(eye=np.array(eye), target=np.array(target))
+    shader = PixelShader(
+        light_direction=np.array([0, 1, 1]),
+        material=Material(ambient=0.4, diffuse=0.4, specular=0.2, specular_exponent=10),
+    )
+    surface = pygame.Surface((width, height))
+    return GraphicsPipeline(meshs, camera, surface, shader=shader, **pipeline_options)
+
+
+# runs each of the methods (repeat times) on the scene, and keeps the fastest run
+# returns the results of each method (time, time of each stage, the triangles and pixels
+# per second through the pipeline) and the image drawn by each of the draw methods
+def benchmark_scene(scene, width, height, repeat=3, **pipeline_options):
+    pipeline = create_pipeline(scene, width, height, **pipeline_options)
+    results, images = {}, {}
+    try:
+        for method in METHODS:
+            best = None
+            for _ in range(repeat):
+                # every run computes the frame from scratch (instead of reusing the last)
+                pipeline.invalidate()
+                if method != "update":
+                    # the draws are timed on their own (update starts a new frame)
+                    pipeline.stats.new_frame()
+                start = time.perf_counter()
+                getattr(pipeline, method)()
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, pipeline.stats.as_dict())
+
+            elapsed, stats = best
+            result = {
+                "ms": elapsed * 1000,
+                "stages_ms": {
+                    key[: -len("_ms")]: value
+                    for key, value in stats.items()
+                    if key.endswith("_ms") and key != "total_ms"
+                },
+            }
+            if method == "update":
+                # the faces going into the pipeline
+                result["triangles"] = stats["faces"]
+            else:
+                # the triangles drawn (ie, after culling and clipping)
+                result["triangles"] = sum(len(b) for b in pipeline.faces_to_draw)
+            result["triangles_per_s"] = result["triangles"] / elapsed
+            if "pixels_drawn" in stats:
+                result["pixels"] = stats["pixels_drawn"]
+                result["pixels_per_s"] = stats["pixels_drawn"] / elapsed
+            if method != "update":
+                images[method] = pygame.surfarray.array3d(pipeline.screen)
+            results[method] = result
+    finally:
+        pipeline.close()
+    return results, images
+
+
+# number of pixels in which the images differ beyond the tolerance
+def count_different_pixels(image, golden):
+    difference = np.abs(image.astype(int) - golden.astype(int)).max(axis=2)
+    return int(np.count_nonzero(difference > GOLDEN_MAX_DIFFERENCE))
+
+
+# the size and the options (those not the defaults) the scenes are drawn with,
+# eg, "256x256" or "800x600_rasterizer-fixed_sort-triangles", the timings and the images
+# are compared only with those (of the baseline and the golden ones) of the same key
+def configuration_key(width, height, options, defaults):
+    key = f"{width}x{height}"
+    for name, value in options.items():
+        if value != defaults[name]:
+            name = name.replace("_", "-")
+            key += f"_{name}" if value is True else f"_{name}-{value}"
+    return key
+
+
+def golden_file(configuration, scene, method):
+    return os.path.join(GOLDEN_DIRECTORY, configuration, f"{scene}_{method}.png")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the stages of the graphics pipeline on fixed scenes (headless), compares the timings against a baseline and the images against golden ones.",
+        prog="python3 benchmark.py",
+    )
+    parser.add_argument(
+        "scenes", nargs="*", default=list(SCENES), help="scenes to benchmark"
+    )
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rasterizer", default="vectorized")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sort-triangles", action="store_true")
+    parser.add_argument("--depth-prepass", action="store_true")
+    parser.add_argument("--deferred", action="store_true")
+    parser.add_argument("--shading", choices=SHADING_MODES, default="flat")
+    parser.add_argument("--filtering", choices=FILTERINGS, default="nearest")
+    parser.add_argument("--perspective-correct", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the timings as the baseline (instead of comparing with it)",
+    )
+    parser.add_argument(
+        "--save-golden",
+        action="store_true",
+        help="store the images as the golden ones (instead of validating them)",
+    )
+    parser.add_argument("--output", help="json file to write the results to")
+    args = parser.parse_args()
+
+    options = {
+        "rasterizer": args.rasterizer,
+        "workers": args.workers,
+        "sort_triangles": args.sort_triangles,
+        "depth_prepass": args.depth_prepass,
+        "deferred": args.deferred,
+        "shading": args.shading,
+        "filtering": args.filtering,
+        "perspective_correct": args.perspective_correct,
+    }
+    defaults = {name: parser.get_default(name) for name in options}
+    timing_key = configuration_key(args.width, args.height, options, defaults)
+    image_options = {name: options[name] for name in IMAGE_OPTIONS}
+    image_key = configuration_key(args.width, args.height, image_options, defaults)
+    print(f"configuration: {timing_key} (golden images: {image_key})")
+
+    # the baseline has the timings of each configuration
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    configuration_baseline = baseline.get(timing_key, {})
+
+    all_results, failures = {}, []
+    for scene in args.scenes:
+        assert scene in SCENES, f"unknown scene: {scene}"
+        results, images = benchmark_scene(
+            scene, args.width, args.height, repeat=args.repeat, **options
+        )
+        all_results[scene] = results
+
+        for method, result in results.items():
+            line = f"{scene:12} {method:15} {result['ms']:9.2f} ms"
+            line += f" {result['triangles_per_s']:12.0f} triangles/s"
+            if "pixels_per_s" in result:
+                line += f" {result['pixels_per_s']:12.0f} pixels/s"
+            baseline_ms = configuration_baseline.get(scene, {}).get(method, {})
+            baseline_ms = baseline_ms.get("ms")
+            if baseline_ms is not None and not args.save_baseline:
+                ratio = result["ms"] / baseline_ms
+                line += f"  x{ratio:.2f} of baseline"
+                difference_ms = result["ms"] - baseline_ms
+                if (
+                    ratio > REGRESSION_THRESHOLD
+                    and difference_ms >= REGRESSION_MIN_DIFFERENCE_MS
+                ):
+                    line += " REGRESSION"
+                    failures.append(f"{scene} {method} is {ratio:.2f}x slower")
+            print(line)
+            stages = ", ".join(
+                f"{stage} {ms:.2f}" for stage, ms in result["stages_ms"].items()
+            )
+            print(f"{'':28} stages (ms): {stages}")
+
+        for method, image in images.items():
+            filename = golden_file(image_key, scene, method)
+            if args.save_golden:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                pygame.image.save(pygame.surfarray.make_surface(image), filename)
+                continue
+            if not os.path.exists(filename):
+                failures.append(
+                    f"{scene} {method} has no golden image (see --save-golden)"
+                )
+                continue
+            golden = pygame.surfarray.array3d(pygame.image.load(filename))
+            if golden.shape != image.shape:
+                failures.append(f"{scene} {method} image size differs from golden")
+                continue
+            different = count_different_pixels(image, golden)
+            if different > GOLDEN_MAX_DIFFERENT_PIXELS * args.width * args.height:
+                failures.append(
+                    f"{scene} {method} image differs from golden in {different} pixels"
+                )
+
+    if args.save_baseline:
+        # the other scenes (and the other configurations) keep their baseline
+        baseline[timing_key] = {**configuration_baseline, **all_results}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(all_results, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import numpy as np
+from culling import box_corners
+
+# maximum number of faces in a leaf node of the bounding volume hierarchy
+LEAF_SIZE = 32
+
+
+# bounding volume hierarchy over the faces of a mesh (in model space)
+# each node is an axis aligned box enclosing a contiguous range of face_order,
+# so the faces of a node (and of all its descendants) are face_order[start : start + count]
+# the nodes are stored as arrays, the children of node i (if any) are
+# first_child[i] and first_child[i] + 1
+class FaceBVH:
+    def __init__(self, model_vertices, vertex_indices, leaf_size=LEAF_SIZE):
+        # bounding box and centroid of each face
+        corners = model_vertices[:3, vertex_indices]  # (3 x F x 3)
+        face_min = corners.min(axis=2).T
+        face_max = corners.max(axis=2).T
+        centroids = corners.mean(axis=2).T
+
+        self.face_order = np.arange(len(vertex_indices))
+        box_min, box_max, first_child, start, count = [], [], [], [], []
+
+        def add_node(node_start, node_count):
+            box_min.append(None)
+            box_max.append(None)
+            first_child.append(-1)
+            start.append(node_start)
+            count.append(node_count)
+            return len(start) - 1
+
+        # build top down, splitting each node at the median of the face centroids
+        # along the longest axis of the centroids' extent
+        stack = [add_node(0, len(vertex_indices))]
+        while stack:
+            node = stack.pop()
+            faces = self.face_order[start[node] : start[node] + count[node]]
+            box_min[node] = face_min[faces].min(axis=0, initial=np.inf)
+            box_max[node] = face_max[faces].max(axis=0, initial=-np.inf)
+            if len(faces) <= leaf_size:
+                continue
+
+            extent = np.ptp(centroids[faces], axis=0)
+            axis = np.argmax(extent)
+            faces[:] = faces[np.argsort(centroids[faces, axis], kind="stable")]
+            half = len(faces) // 2
+            first_child[node] = add_node(start[node], half)
+            add_node(start[node] + half, len(faces) - half)
+            stack.extend([first_child[node], first_child[node] + 1])
+
+        self.box_min = np.array(box_min)
+        self.box_max = np.array(box_max)
+        self.first_child = np.array(first_child)
+        self.start = np.array(start)
+        self.count = np.array(count)
+
+    def __len__(self):
+        return len(self.start)
+
+    # the faces which may be inside the planes (ie, not in a node completely outside
+    # any of the planes), the planes are expected to be in model space (see frustum_planes)
+    # the faces are ordered (coarsely) front to back, by the distance of their nodes
+    # from the camera (position in model space)
+    # returns the faces and the number of nodes visited
+    def visible_faces(self, planes, camera_position):
+        frontier = np.array([0])
+        accepted = []
+        nodes_visited = 0
+        while len(frontier):
+            nodes_visited += len(frontier)
+            corners = box_corners(self.box_min[frontier], self.box_max[frontier])
+            distances = corners @ planes.T  # (N x 8 x P)
+            outside = np.any(np.all(distances < 0, axis=1), axis=1)
+            inside = np.all(distances >= 0, axis=(1, 2))
+
+            # nodes completely inside all the planes, and the leaves which
+            # are partially inside, are accepted as a whole
+            leaf = self.first_child[frontier] < 0
+            accepted.append(frontier[~outside & (inside | leaf)])
+
+            # the other partially inside nodes are refined by testing their children
+            refine = frontier[~outside & ~inside & ~leaf]
+            frontier = np.concatenate(
+                [self.first_child[refine], self.first_child[refine] + 1]
+            )
+
+        accepted = np.concatenate(accepted)
+        centers = (self.box_min[accepted] + self.box_max[accepted]) / 2
+        order = np.argsort(np.linalg.norm(centers - camera_position, axis=1))
+        faces = [
+            self.face_order[self.start[node] : self.start[node] + self.count[node]]
+            for node in accepted[order]
+        ]
+        faces = np.concatenate(faces) if faces else np.zeros(0, dtype=int)
+        return faces, nodes_visited
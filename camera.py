@@ -1,4 +1,5 @@
 from transformations import *
+import itertools
 import numpy as np
 import pygame
 
@@ -11,13 +12,23 @@ UP = np.array([0.0, 1.0, 0.0])
 # and forwards and up vectors from being parallel
 MAX_PITCH = np.deg2rad(75.0)
 
+# the keys of the cameras (see Camera.token), unique for the life of the program
+# (unlike id(), which a new camera may reuse once the old one is freed)
+CAMERA_KEYS = itertools.count()
+
 
 class Camera:
-    def __init__(self, fov, aspect_ratio, near, far):
+    def __init__(self, fov, aspect_ratio, near, far, verbose=True):
+        # whether to print the camera's orientation whenever it changes
+        self.verbose = verbose
         self.fov = fov
         self.aspect_ratio = aspect_ratio
         self.near = near
         self.far = far
+        # incremented whenever the camera moves (see look_at), so that the graphics
+        # pipeline can tell when the view has changed (see GraphicsPipeline.update)
+        self.key = next(CAMERA_KEYS)
+        self.version = 0
         # initialising the camera's position and orientation
         # the camera is looking down the positive z-axis
         # and centered at the origin
@@ -27,6 +38,12 @@ class Camera:
             up=UP,
         )
 
+    # identifies the camera and its view, for the results kept by the graphics
+    # pipeline (see GraphicsPipeline.scene_state)
+    @property
+    def token(self):
+        return (self.key, self.version)
+
     def look_at(self, eye, forward=None, up=UP, target=None):
         # using the right-handed coordinate system
         # eye: the position of the camera
@@ -38,9 +55,11 @@ class Camera:
         self.forward = normalize(forward if forward is not None else target - eye)
         self.right = normalize(np.cross(up, self.forward))
         self.up = np.cross(self.forward, self.right)
-        print(f"forward: {self.forward}, right: {self.right}, up: {self.up}")
-        print(f"position: {self.position}")
-        print(f"view_matrix: {self.view_matrix}")
+        self.version += 1
+        if self.verbose:
+            print(f"forward: {self.forward}, right: {self.right}, up: {self.up}")
+            print(f"position: {self.position}")
+            print(f"view_matrix: {self.view_matrix}")
 
     @property
     def view_matrix(self):
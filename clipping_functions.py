@@ -1,3 +1,6 @@
+import numpy as np
+from kernels import JIT_AVAILABLE, clip_triangles_against_plane_kernel
+
 # functions for each of the clipping planes
 # six functions for each of the six clipping planes
 # and one function for clipping at w = 0, (ie, the vertices behind the camera)
@@ -87,3 +90,182 @@ def z_equals_0():
     get_intersection = lambda cv1, cv2: cv1[2] / (cv1[2] - cv2[2])
 
     return check_inside, get_intersection
+
+
+# the same clipping planes, described by the coefficients of the signed distance
+# of a clip vertex from the plane, ie, distance = dot(coefficients, cv)
+# the vertex is inside if the distance is >= 0 (or > 0, if the plane is strict)
+# and the intersection is at t = d0 / (d0 - d1), same as the get_intersection functions above
+# these are used for clipping many triangles at once (see clip_triangles)
+W_EQUALS_0 = (np.array([0.0, 0.0, 0.0, 1.0]), True)  # w > 0
+W_EQUALS_X = (np.array([-1.0, 0.0, 0.0, 1.0]), False)  # x <= w
+W_EQUALS_NEG_X = (np.array([1.0, 0.0, 0.0, 1.0]), False)  # x >= -w
+W_EQUALS_Y = (np.array([0.0, -1.0, 0.0, 1.0]), False)  # y <= w
+W_EQUALS_NEG_Y = (np.array([0.0, 1.0, 0.0, 1.0]), False)  # y >= -w
+W_EQUALS_Z = (np.array([0.0, 0.0, -1.0, 1.0]), False)  # z <= w
+W_EQUALS_NEG_Z = (np.array([0.0, 0.0, 1.0, 1.0]), False)  # z >= -w
+Z_EQUALS_0 = (np.array([0.0, 0.0, 1.0, 0.0]), False)  # z >= 0
+
+
+# whether the vertices are inside the planes, given their distances from the planes
+def inside_planes(distances, strict):
+    return np.where(strict, distances > 0, distances >= 0)
+
+
+# for each of the ways the vertices of a triangle can be partially inside a plane,
+# keyed by the outcode (4 * inside[0] + 2 * inside[1] + inside[2]),
+# the polygon obtained after clipping, as a list of points where
+# ("v", i) is the i-th vertex and ("e", i) the intersection with the edge (i, i + 1)
+# (ie, exactly the points Face.clip produces for a single triangle)
+def clipped_polygon(inside):
+    polygon = []
+    for i in range(3):
+        if inside[i]:
+            polygon.append(("v", i))
+        if inside[i] != inside[(i + 1) % 3]:
+            polygon.append(("e", i))
+    return polygon
+
+
+OUTCODE_WEIGHTS = np.array([4, 2, 1])
+CLIPPED_POLYGONS = {
+    int(np.dot(inside, OUTCODE_WEIGHTS)): clipped_polygon(inside)
+    for inside in np.ndindex(2, 2, 2)
+    if 0 < sum(inside) < 3
+}
+
+
+# the points of the clipped polygon, for each of the selected triangles
+def polygon_points(polygon, selected, vertices, edge_vertices):
+    return [
+        (vertices if kind == "v" else edge_vertices)[selected, :, i]
+        for kind, i in polygon
+    ]
+
+
+# clips the triangles against a single plane
+# returns the clipped triangles, their attributes and the index of the triangle
+# (in the input) that each of the clipped triangles came from
+def clip_triangles_against_plane(clip_vertices, attributes, plane):
+    coefficients, strict = plane
+    distances = coefficients @ clip_vertices  # (N x 3)
+    codes = inside_planes(distances, strict) @ OUTCODE_WEIGHTS
+
+    # intersections of each edge (i, i + 1) with the plane
+    # v = v0 + t * (v1 - v0), where t = d0 / (d0 - d1)
+    # (edges which don't cross the plane give invalid values, but they are never used)
+    next_distances = np.roll(distances, -1, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (distances / (distances - next_distances))[:, np.newaxis, :]
+        edge_vertices = clip_vertices + t * (
+            np.roll(clip_vertices, -1, axis=2) - clip_vertices
+        )
+        edge_attributes = None
+        if attributes is not None:
+            edge_attributes = attributes + t * (
+                np.roll(attributes, -1, axis=2) - attributes
+            )
+
+    # triangles which are completely inside the plane are passed as is
+    # (and the ones completely outside are dropped)
+    selected = np.flatnonzero(codes == 7)
+    parents = [selected]
+    children = [np.zeros(len(selected), dtype=int)]
+    new_vertices = [clip_vertices[selected]]
+    new_attributes = [attributes[selected]] if attributes is not None else None
+
+    for code, polygon in CLIPPED_POLYGONS.items():
+        selected = np.flatnonzero(codes == code)
+        if len(selected) == 0:
+            continue
+
+        vertex_points = polygon_points(polygon, selected, clip_vertices, edge_vertices)
+        if attributes is not None:
+            attribute_points = polygon_points(
+                polygon, selected, attributes, edge_attributes
+            )
+
+        # a four sided polygon is split into two triangles
+        # triangle1: p0, p1, p2
+        # triangle2: p0, p2, p3
+        triangles = [(0, 1, 2)] if len(polygon) == 3 else [(0, 1, 2), (0, 2, 3)]
+        for child, triangle in enumerate(triangles):
+            parents.append(selected)
+            children.append(np.full(len(selected), child))
+            new_vertices.append(np.stack([vertex_points[i] for i in triangle], axis=2))
+            if attributes is not None:
+                new_attributes.append(
+                    np.stack([attribute_points[i] for i in triangle], axis=2)
+                )
+
+    # keep the clipped triangles in the same order as the input triangles
+    parents = np.concatenate(parents)
+    order = np.lexsort((np.concatenate(children), parents))
+    clip_vertices = np.concatenate(new_vertices)[order]
+    if attributes is not None:
+        attributes = np.concatenate(new_attributes)[order]
+    return clip_vertices, attributes, parents[order]
+
+
+# clips many triangles against the clipping planes at once (ie, batched sutherland-hodgman)
+# clip_vertices: clip vertices of the triangles (N x 4 x 3)
+# attributes: per vertex attributes interpolated along with the vertices, like
+# texture coordinates (N x K x 3), or None
+# planes: list of planes (see W_EQUALS_0, ...) to clip against, in order
+# returns the clipped triangles (M x 4 x 3), their attributes (M x K x 3) and the index
+# of the triangle (in the input) that each of the clipped triangles came from (M),
+# the clipped triangles are in the same order as the input triangles
+# jit: whether to clip with the jit compiled kernel (see kernels.py, the same results),
+# by default if numba is installed
+def clip_triangles(clip_vertices, attributes, planes, jit=JIT_AVAILABLE):
+    if jit:
+        return clip_triangles_jit(clip_vertices, attributes, planes)
+
+    coefficients = np.array([coefficients for coefficients, _ in planes])
+    strict = np.array([strict for _, strict in planes])[:, np.newaxis]
+
+    # outcodes, whether each vertex is inside each of the planes (N x P x 3)
+    inside = inside_planes(coefficients @ clip_vertices, strict)
+
+    # trivially accept the triangles with all the vertices inside all the planes
+    # and trivially reject the triangles with all the vertices outside any one plane
+    # only the remaining triangles (which straddle some plane) need to be clipped
+    all_inside = inside.all(axis=(1, 2))
+    all_outside = (~inside).all(axis=2).any(axis=1)
+    accepted = np.flatnonzero(all_inside)
+    straddling = np.flatnonzero(~all_inside & ~all_outside)
+
+    indices = straddling
+    new_vertices = clip_vertices[straddling]
+    new_attributes = attributes[straddling] if attributes is not None else None
+    for plane in planes:
+        new_vertices, new_attributes, parents = clip_triangles_against_plane(
+            new_vertices, new_attributes, plane
+        )
+        indices = indices[parents]
+
+    # merge back the trivially accepted and the clipped triangles (keeping the order)
+    indices = np.concatenate([accepted, indices])
+    order = np.argsort(indices, kind="stable")
+    clip_vertices = np.concatenate([clip_vertices[accepted], new_vertices])[order]
+    if attributes is not None:
+        attributes = np.concatenate([attributes[accepted], new_attributes])[order]
+    return clip_vertices, attributes, indices[order]
+
+
+# clip_triangles by the jit compiled kernel, triangle by triangle against each plane
+# (all of them, the kernel needs no trivial accept or reject)
+def clip_triangles_jit(clip_vertices, attributes, planes):
+    indices = np.arange(len(clip_vertices))
+    clip_vertices = np.ascontiguousarray(clip_vertices, dtype=np.float64)
+    new_attributes = np.empty((len(clip_vertices), 0, 3))
+    if attributes is not None:
+        new_attributes = np.ascontiguousarray(attributes, dtype=np.float64)
+    for coefficients, strict in planes:
+        clip_vertices, new_attributes, parents = clip_triangles_against_plane_kernel(
+            clip_vertices, new_attributes, coefficients.astype(np.float64), strict
+        )
+        indices = indices[parents]
+    if attributes is None:
+        new_attributes = None
+    return clip_vertices, new_attributes, indices
@@ -0,0 +1,47 @@
+import numpy as np
+
+# tests for whether (the bounding volumes of) objects are outside the view frustum,
+# so that they can be skipped before transforming any of their vertices
+
+
+# planes of the view frustum, given the matrix transforming the points to clip space
+# (eg, camera_matrix @ world_matrix) and the clipping planes (see clipping_functions)
+# a point p is inside a plane if dot(plane, p) >= 0, where p = (x, y, z, 1)
+def frustum_planes(clip_matrix, clipping_planes):
+    coefficients = np.array([coefficients for coefficients, _ in clipping_planes])
+    return coefficients @ clip_matrix
+
+
+# whether the sphere is completely outside any of the planes (ie, can be culled)
+# the planes are expected to be in the same space as the sphere
+def sphere_outside_planes(center, radius, planes):
+    normal_lengths = np.linalg.norm(planes[:, :3], axis=1)
+    distances = planes @ np.array([*center, 1.0])
+    return bool(np.any(distances < -radius * normal_lengths))
+
+
+# same as sphere_outside_planes, for many spheres at once (centers N x 3, radii N)
+# returns whether each of the spheres is completely outside any of the planes
+def spheres_outside_planes(centers, radii, planes):
+    normal_lengths = np.linalg.norm(planes[:, :3], axis=1)
+    distances = centers @ planes[:, :3].T + planes[:, 3]  # (N x P)
+    return np.any(distances < -radii[:, np.newaxis] * normal_lengths, axis=1)
+
+
+# the corners of the axis aligned boxes (N x 8 x 4), given their min and max corners (N x 3)
+def box_corners(box_min, box_max):
+    corners = np.empty((len(box_min), 8, 4))
+    for i, (x, y, z) in enumerate(np.ndindex(2, 2, 2)):
+        corners[:, i, 0] = np.where(x, box_max[:, 0], box_min[:, 0])
+        corners[:, i, 1] = np.where(y, box_max[:, 1], box_min[:, 1])
+        corners[:, i, 2] = np.where(z, box_max[:, 2], box_min[:, 2])
+    corners[:, :, 3] = 1.0
+    return corners
+
+
+# whether each of the axis aligned boxes (given their min and max corners, N x 3)
+# is completely outside any one of the planes, ie, all its corners are outside it
+# the planes are expected to be in the same space as the boxes
+def boxes_outside_planes(box_min, box_max, planes):
+    distances = box_corners(box_min, box_max) @ planes.T  # (N x 8 x P)
+    return np.any(np.all(distances < 0, axis=1), axis=1)
@@ -0,0 +1,362 @@
+import heapq
+import numpy as np
+from mesh import Mesh
+from transformations import normalize_vectors
+
+# weight of the quadrics keeping the open (boundary) edges of the mesh in place
+BOUNDARY_WEIGHT = 1000.0
+# collapsed vertices are placed at the optimal position only if it is well defined,
+# ie, the quadric's determinant is not too small (relative to its largest entry)
+MIN_RELATIVE_DETERMINANT = 1e-6
+# the normals of collapsed vertices are merged only if they are alike, ie, the cosine
+# of the angle between them is at least this much (else the edge between them is kept)
+MIN_NORMAL_SIMILARITY = np.cos(np.deg2rad(60))
+
+
+# mesh simplification by repeatedly collapsing the edge with the least quadric error
+# reference: Garland, Heckbert - Surface Simplification Using Quadric Error Metrics (1997)
+
+
+# the error quadric (4 x 4) of each face's plane, ie, the squared distance
+# of a point (x, y, z, 1) from the plane is p^T Q p (F x 4 x 4)
+def face_quadrics(vertices, vertex_indices):
+    v0, v1, v2 = (vertices[vertex_indices[:, i]] for i in range(3))
+    normals = normalize_vectors(np.cross(v1 - v0, v2 - v0))
+    planes = np.column_stack([normals, -np.sum(normals * v0, axis=1)])
+    return planes[:, :, np.newaxis] * planes[:, np.newaxis, :]
+
+
+# the error quadric of each vertex, sum of the quadrics of its faces,
+# and of the planes perpendicular to its faces along the boundary edges
+def vertex_quadrics(vertices, vertex_indices):
+    quadrics = np.zeros((len(vertices), 4, 4))
+    quadrics_of_faces = face_quadrics(vertices, vertex_indices)
+    for i in range(3):
+        np.add.at(quadrics, vertex_indices[:, i], quadrics_of_faces)
+
+    # boundary edges are the edges used by a single face
+    edges = np.stack([vertex_indices, np.roll(vertex_indices, -1, axis=1)], axis=2)
+    edges = edges.reshape(-1, 2)
+    _, inverse, counts = np.unique(
+        np.sort(edges, axis=1), axis=0, return_inverse=True, return_counts=True
+    )
+    boundary = counts[inverse.ravel()] == 1
+    if np.any(boundary):
+        a, b = edges[boundary].T
+        faces = np.flatnonzero(boundary) // 3
+        v0, v1, v2 = (vertices[vertex_indices[faces, i]] for i in range(3))
+        face_normals = np.cross(v1 - v0, v2 - v0)
+        normals = normalize_vectors(np.cross(vertices[b] - vertices[a], face_normals))
+        planes = np.column_stack([normals, -np.sum(normals * vertices[a], axis=1)])
+        boundary_quadrics = planes[:, :, np.newaxis] * planes[:, np.newaxis, :]
+        np.add.at(quadrics, a, BOUNDARY_WEIGHT * boundary_quadrics)
+        np.add.at(quadrics, b, BOUNDARY_WEIGHT * boundary_quadrics)
+    return quadrics
+
+
+# the error and the position of the merged vertex when collapsing each of the edges (a, b)
+# the position is the one minimizing the error, if it is well defined,
+# else the best of the end points and the mid point of the edge
+def collapse_costs(quadrics, vertices, a, b):
+    quadric = quadrics[a] + quadrics[b]
+    candidates = np.stack(
+        [vertices[a], vertices[b], (vertices[a] + vertices[b]) / 2], axis=1
+    )
+
+    optimal = candidates[:, 2].copy()
+    determinant = np.abs(np.linalg.det(quadric[:, :3, :3]))
+    largest = np.abs(quadric[:, :3, :3]).max(axis=(1, 2))
+    solvable = determinant > MIN_RELATIVE_DETERMINANT * largest**3
+    if np.any(solvable):
+        optimal[solvable] = np.linalg.solve(
+            quadric[solvable, :3, :3], -quadric[solvable, :3, 3:]
+        )[:, :, 0]
+    candidates = np.concatenate([optimal[:, np.newaxis], candidates], axis=1)
+
+    points = np.concatenate([candidates, np.ones((len(a), 4, 1))], axis=2)
+    errors = np.einsum("eci,eij,ecj->ec", points, quadric, points)
+    best = np.argmin(errors, axis=1)
+    edges = np.arange(len(a))
+    return errors[edges, best], candidates[edges, best]
+
+
+# (unnormalized) normals of the triangles given their corners (N x 3 x 3)
+# written out, as np.cross is slow for the few triangles of each collapse
+def triangle_normals(corners):
+    e1 = corners[:, 1] - corners[:, 0]
+    e2 = corners[:, 2] - corners[:, 0]
+    return np.column_stack(
+        [
+            e1[:, 1] * e2[:, 2] - e1[:, 2] * e2[:, 1],
+            e1[:, 2] * e2[:, 0] - e1[:, 0] * e2[:, 2],
+            e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0],
+        ]
+    )
+
+
+# merges the normals at the corners of vertex b into those of vertex a (collapsing the
+# edge (a, b), before b's faces are given to a), each normal of b is merged into the most
+# similar normal of a (their average, weighted by the normals merged into each), unless
+# they are too different (a hard edge, or a corner), then b's normal is kept at a
+# normals (N x 3), weights (N) are updated in place, and corner_normals (F x 3 lists)
+# of b's corners are made the merged normals
+def merge_normals(normals, weights, faces, corner_normals, vertex_faces, a, b):
+    def corners(vertex):
+        return [
+            (face, i)
+            for face in vertex_faces[vertex]
+            for i in range(3)
+            if faces[face][i] == vertex
+        ]
+
+    normals_a = sorted({corner_normals[face][i] for face, i in corners(a)})
+    merged = {}
+    for normal in sorted({corner_normals[face][i] for face, i in corners(b)}):
+        similarity = normals[normals_a] @ normals[normal]
+        best = np.argmax(similarity)
+        if similarity[best] < MIN_NORMAL_SIMILARITY:
+            continue
+        target = normals_a[best]
+        average = weights[target] * normals[target] + weights[normal] * normals[normal]
+        normals[target] = average / np.linalg.norm(average)
+        weights[target] += weights[normal]
+        merged[normal] = target
+    for face, i in corners(b):
+        normal = corner_normals[face][i]
+        corner_normals[face][i] = merged.get(normal, normal)
+
+
+# simplifies the mesh to (about) the target number of faces
+# the faces keep their original texture coordinates and colors
+# (texture coordinates are not adjusted for the moved vertices, so textures may stretch)
+# the normals of the mesh (if it has any) are carried through the collapses, so that
+# the simplified mesh is lit like the mesh (see merge_normals), the meshes without
+# normals have them averaged from the simplified faces instead (see Mesh.vertex_normals)
+def decimate(mesh, target_faces) -> Mesh:
+    vertices = mesh.model_vertices[:3].T.copy()
+    quadrics = vertex_quadrics(vertices, mesh.vertex_indices)
+    # the faces are updated one collapse at a time, which is faster on python lists
+    faces = mesh.vertex_indices.tolist()
+    num_faces = len(faces)
+
+    # the normal at each corner of the faces (if the mesh has normals), one normal for
+    # each (vertex, normal) pair of the corners, so that merging the normals of a vertex
+    # changes no other vertex's, weights are the number of normals merged into each
+    if mesh.normal_indices is not None:
+        normals, normal_indices = mesh.vertex_normals
+        pairs = np.stack([mesh.vertex_indices, normal_indices], axis=2).reshape(-1, 2)
+        pairs, corner_normals = np.unique(pairs, axis=0, return_inverse=True)
+        normals = normals[pairs[:, 1]]
+        weights = np.ones(len(normals))
+        corner_normals = corner_normals.reshape(-1, 3).tolist()
+
+    alive = np.ones(num_faces, dtype=bool)
+    removed = [False] * len(vertices)
+    # version of each vertex, bumped whenever it changes (invalidating its edges' costs)
+    version = [0] * len(vertices)
+    vertex_faces = [set() for _ in range(len(vertices))]
+    for face, vertex_indices in enumerate(faces):
+        for vertex in vertex_indices:
+            vertex_faces[vertex].add(face)
+
+    def neighbors(vertex):
+        return {v for face in vertex_faces[vertex] for v in faces[face]} - {vertex}
+
+    def push_edges(a, others):
+        others = np.array(sorted(others), dtype=int)
+        costs, positions = collapse_costs(
+            quadrics, vertices, np.full(len(others), a), others
+        )
+        for cost, b, position in zip(costs.tolist(), others.tolist(), positions):
+            heapq.heappush(heap, (cost, a, b, version[a], version[b], position))
+
+    # all the edges of the mesh, ordered by their collapse cost
+    edges = np.stack(
+        [mesh.vertex_indices, np.roll(mesh.vertex_indices, -1, axis=1)], axis=2
+    ).reshape(-1, 2)
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    costs, positions = collapse_costs(quadrics, vertices, edges[:, 0], edges[:, 1])
+    heap = [
+        (cost, a, b, 0, 0, position)
+        for cost, (a, b), position in zip(costs.tolist(), edges.tolist(), positions)
+    ]
+    heapq.heapify(heap)
+
+    while num_faces > target_faces and heap:
+        _, a, b, version_a, version_b, position = heapq.heappop(heap)
+        if removed[a] or removed[b]:
+            continue
+        if version[a] != version_a or version[b] != version_b:
+            continue  # outdated cost, the edge has been pushed again
+
+        shared = vertex_faces[a] & vertex_faces[b]  # faces removed by the collapse
+        changed = (vertex_faces[a] | vertex_faces[b]) - shared
+        if not shared:
+            continue
+
+        # collapsing should keep the mesh manifold, ie, the only common neighbors
+        # of a and b should be the opposite vertices of the faces being removed
+        opposite = {v for face in shared for v in faces[face]} - {a, b}
+        if neighbors(a) & neighbors(b) != opposite:
+            continue
+
+        # collapsing should not flip any of the remaining faces
+        changed_faces = np.array([faces[face] for face in changed], dtype=int)
+        changed_faces = changed_faces.reshape(-1, 3)
+        corners = vertices[changed_faces]
+        new_corners = corners.copy()
+        new_corners[(changed_faces == a) | (changed_faces == b)] = position
+        old_normals = triangle_normals(corners)
+        new_normals = triangle_normals(new_corners)
+        if np.any(np.sum(old_normals * new_normals, axis=1) <= 0):
+            continue
+
+        # merge b into a
+        if mesh.normal_indices is not None:
+            merge_normals(normals, weights, faces, corner_normals, vertex_faces, a, b)
+        vertices[a] = position
+        quadrics[a] += quadrics[b]
+        removed[b] = True
+        for face in shared:
+            alive[face] = False
+            num_faces -= 1
+            for vertex in faces[face]:
+                vertex_faces[vertex].discard(face)
+        for face in vertex_faces[b]:
+            faces[face] = [a if vertex == b else vertex for vertex in faces[face]]
+            vertex_faces[a].add(face)
+        vertex_faces[b] = set()
+
+        version[a] += 1
+        push_edges(a, neighbors(a))
+
+    # keep only the used vertices
+    faces = np.array(faces, dtype=int).reshape(-1, 3)[alive]
+    used, vertex_indices = np.unique(faces, return_inverse=True)
+    model_vertices = np.vstack([vertices[used].T, np.ones(len(used))])
+    texture_indices = None
+    if mesh.texture_indices is not None:
+        texture_indices = mesh.texture_indices[alive]
+    model_normals, normal_indices = None, None
+    if mesh.normal_indices is not None:
+        corner_normals = np.array(corner_normals, dtype=int).reshape(-1, 3)[alive]
+        used, normal_indices = np.unique(corner_normals, return_inverse=True)
+        model_normals = normals[used].T
+        normal_indices = normal_indices.reshape(-1, 3)
+
+    lod = Mesh(
+        model_vertices=model_vertices,
+        vertex_indices=vertex_indices.reshape(-1, 3),
+        model_texture_coordinates=mesh.model_texture_coordinates,
+        texture_indices=texture_indices,
+        model_normals=model_normals,
+        normal_indices=normal_indices,
+    )
+    lod.colors = mesh.colors[alive]
+    return lod
+
+
+# generates the levels of detail of the mesh, each with (about) ratio times
+# the faces of the previous level, returns the list of levels (finest first)
+# excluding the mesh itself (ie, ready to be assigned to mesh.lods)
+def generate_lods(mesh, levels=3, ratio=0.5, min_faces=12):
+    lods = []
+    for _ in range(levels):
+        target_faces = int(len(mesh.vertex_indices) * ratio)
+        if target_faces < min_faces:
+            break
+        mesh = decimate(mesh, target_faces)
+        lods.append(mesh)
+    return lods
+
+
+if __name__ == "__main__":
+    # test the mesh decimation
+    from mesh import load_mesh_from_obj
+
+    mesh = load_mesh_from_obj("models/cottage.obj")
+    for level, lod in enumerate([mesh, *generate_lods(mesh)]):
+        print(f"level {level}: {len(lod.vertex_indices)} faces")
+
+    # a cube of flat faces (each a grid of quads, sharing the vertices along the cube's
+    # edges, wound clockwise like the models) with the normal of its face at each corner,
+    # keeps its hard edges
+    steps = np.linspace(-1.0, 1.0, 5)
+    u, v = (grid.ravel() for grid in np.meshgrid(steps, steps, indexing="ij"))
+    index = np.arange(len(steps) ** 2).reshape(len(steps), len(steps))
+    a, b = index[:-1, :-1].ravel(), index[1:, :-1].ravel()
+    c, d = index[1:, 1:].ravel(), index[:-1, 1:].ravel()
+    quads = np.concatenate([np.stack([a, b, c], 1), np.stack([a, c, d], 1)])
+    positions, faces, face_normals = [], [], []
+    for normal in np.vstack([np.eye(3), -np.eye(3)]):
+        axis = np.argmax(np.abs(normal))
+        points = np.zeros((len(u), 3))
+        points[:, axis] = normal[axis]
+        points[:, (axis + 1) % 3], points[:, (axis + 2) % 3] = u, v
+        faces.append(
+            len(positions) * len(u) + (quads[:, ::-1] if normal[axis] > 0 else quads)
+        )
+        positions.append(points)
+        face_normals.append(normal)
+    positions, vertex_indices = np.unique(
+        np.vstack(positions), axis=0, return_inverse=True
+    )
+    vertex_indices = vertex_indices.ravel()[np.concatenate(faces)]
+    cube = Mesh(
+        np.vstack([positions.T, np.ones(len(positions))]),
+        vertex_indices,
+        model_normals=np.array(face_normals).T,
+        normal_indices=np.repeat(np.arange(6), len(quads))[:, np.newaxis].repeat(3, 1),
+    )
+    for level, lod in enumerate(generate_lods(cube, min_faces=24), 1):
+        normals, normal_indices = lod.vertex_normals
+        v0, v1, v2 = (
+            lod.model_vertices[:3, lod.vertex_indices[:, i]].T for i in range(3)
+        )
+        flat = normalize_vectors(np.cross(v2 - v0, v1 - v0))
+        similarity = np.sum(normals[normal_indices] * flat[:, np.newaxis], axis=2)
+        print(f"cube level {level}: {len(lod.vertex_indices)} faces")
+        assert np.all(similarity > 0.999), "the cube's hard edges were smoothed"
+
+    # a smooth sphere (with a normal at each vertex) is lit about the same by its levels
+    # of detail, nearer than by the normals averaged from their faces
+    import pygame
+    from benchmark import uv_sphere
+    from camera import Camera
+    from graphics_pipeline import GraphicsPipeline
+    from shading import PixelShader
+
+    sphere = uv_sphere(24, 16)
+    sphere = Mesh(
+        sphere.model_vertices,
+        sphere.vertex_indices,
+        model_normals=sphere.model_vertices[:3].copy(),
+        normal_indices=sphere.vertex_indices.copy(),
+    )
+
+    def draw(mesh):
+        mesh.position = np.array([0.0, 0.0, 3.0])
+        mesh.rotation = np.array([0.3, 0.5, 0.0])
+        pipeline = GraphicsPipeline(
+            [mesh],
+            Camera(np.deg2rad(60), 1.0, 0.1, 50.0, verbose=False),
+            pygame.Surface((128, 128)),
+            shader=PixelShader(light_direction=np.array([0, 1, 1])),
+            shading="gouraud",
+            rasterizer="vectorized",
+        )
+        pipeline.update()
+        pipeline.draw()
+        pipeline.close()
+        return pygame.surfarray.array3d(pipeline.screen).astype(int)
+
+    image = draw(sphere)
+    for level, lod in enumerate(generate_lods(sphere), 1):
+        carried = np.abs(draw(lod) - image).mean()
+        averaged = np.abs(draw(Mesh(lod.model_vertices, lod.vertex_indices)) - image)
+        averaged = averaged.mean()
+        print(
+            f"sphere level {level}: mean difference {carried:.2f} "
+            f"(with averaged normals {averaged:.2f})"
+        )
+        assert carried < averaged, "the sphere's normals were not carried"
@@ -0,0 +1,121 @@
+import weakref
+from functools import cached_property
+from multiprocessing import shared_memory
+import numpy as np
+import pygame
+
+
+# copies the colors (W x H x 3, or broadcastable to it) onto the surface, in place
+# through a view of the surface's pixels (blit_array would first map them to a new array)
+def copy_to_surface(screen: pygame.Surface, colors):
+    if screen.get_bytesize() < 3:
+        # pixels3d needs 24 or 32 bit pixels
+        colors = np.broadcast_to(colors, (*screen.get_size(), 3))
+        pygame.surfarray.blit_array(screen, colors)
+        return
+    pixels = pygame.surfarray.pixels3d(screen)
+    pixels[...] = colors
+    del pixels  # unlocks the surface
+
+
+def release(memory, unlink):
+    for block in memory:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+# display buffer (colors) and z buffer (depths) of the rendered frame,
+# allocated once for a screen size, and cleared in place for every frame
+# the buffers are indexed [x, y], like pygame's surfarray
+# shared: whether to allocate the buffers in shared memory, so that other processes
+# (like the tiled renderer's workers) can attach to them (see attach) and draw into them
+class FrameBuffer:
+    def __init__(self, width, height, shared=False, names=None):
+        self.size = (width, height)
+        # shared memory blocks of the display and z buffers, if any
+        self.memory = ()
+        # whether the shared memory was created here (and is to be unlinked on close)
+        self.owner = names is None
+        display_memory, depth_memory = None, None
+        if shared or names is not None:
+            display_name, depth_name = names or (None, None)
+            self.memory = (
+                shared_memory.SharedMemory(
+                    name=display_name, create=self.owner, size=width * height * 3
+                ),
+                shared_memory.SharedMemory(
+                    name=depth_name, create=self.owner, size=width * height * 4
+                ),
+            )
+            display_memory, depth_memory = (block.buf for block in self.memory)
+        # release the shared memory even if close is never called
+        self.finalizer = weakref.finalize(self, release, self.memory, self.owner)
+
+        self.display_buffer = np.ndarray(
+            (width, height, 3), dtype=np.uint8, buffer=display_memory
+        )
+        self.z_buffer = np.ndarray(
+            (width, height), dtype=np.float32, buffer=depth_memory
+        )
+        # the visible triangle at each pixel, drawn by the depth pre-pass
+        # (see GraphicsPipeline.draw_textured, -1 where there is no triangle)
+        self.id_buffer = np.empty((width, height), dtype=np.int32)
+        if self.owner:
+            self.clear()
+
+    # texture coordinates at each pixel, drawn by the geometry pass of deferred shading
+    # (see GraphicsPipeline.draw_textured), allocated on first use
+    # only the pixels with a triangle (in the id buffer) are meaningful
+    # (kept in double precision, so the texels sampled match those of the forward path)
+    @cached_property
+    def uv_buffer(self):
+        width, height = self.size
+        return np.zeros((width, height, 2))
+
+    # barycentric weights of the visible triangle at each pixel, drawn by the geometry
+    # pass of deferred shading (for interpolating the vertex normals, ...)
+    @cached_property
+    def weights_buffer(self):
+        width, height = self.size
+        return np.zeros((width, height, 3))
+
+    # 1 / w (interpolated linearly on the screen) at each pixel, drawn by the geometry
+    # pass of deferred shading when perspective correct (for the textures' levels of
+    # detail, see rasterizer.pixel_level_of_detail)
+    @cached_property
+    def inverse_w_buffer(self):
+        width, height = self.size
+        return np.zeros((width, height))
+
+    # the frame buffer (with the given names) created by another process
+    @classmethod
+    def attach(cls, width, height, names):
+        return cls(width, height, names=names)
+
+    # names of the shared memory blocks (None if not shared), for attaching to them
+    @property
+    def names(self):
+        if not self.memory:
+            return None
+        return tuple(block.name for block in self.memory)
+
+    def clear(self, color=(0, 0, 0)):
+        self.display_buffer[...] = color
+        self.z_buffer.fill(1.0)
+        self.id_buffer.fill(-1)
+
+    # copies the display buffer onto the surface
+    def blit(self, screen: pygame.Surface):
+        copy_to_surface(screen, self.display_buffer)
+
+    # copies the z buffer onto the surface, as a gray scale image (nearer is brighter)
+    def blit_depth(self, screen: pygame.Surface):
+        depth = ((1 - self.z_buffer) * 255).astype(np.uint8)
+        copy_to_surface(screen, depth[:, :, np.newaxis])
+
+    def close(self):
+        # the views of the shared memory are to be dropped, before it can be released
+        self.display_buffer, self.z_buffer = None, None
+        self.finalizer()
+        self.memory = ()
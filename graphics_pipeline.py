@@ -1,28 +1,427 @@
 import pygame
-from transformations import viewport, normalize
+from functools import cached_property
+from transformations import viewport, normalize_vectors
 import numpy as np
-from rasterizer import draw_triangle, draw_textured_triangle
+from rasterizer import (
+    RASTERIZERS,
+    TEXTURED_RASTERIZERS,
+    draw_triangle_id_vectorized,
+    draw_triangle_gbuffer_vectorized,
+    shade_textured_triangle_vectorized,
+    interpolate_light,
+    pixel_level_of_detail,
+    texture_lod_derivatives,
+)
 import clipping_functions
+from tiled_rasterizer import TiledRenderer
+from framebuffer import FrameBuffer
+from stats import PipelineStats
+from culling import (
+    frustum_planes,
+    sphere_outside_planes,
+    spheres_outside_planes,
+    boxes_outside_planes,
+)
+from mesh import InstancedMesh
 
 CLIPPING_PLANES = [
-    clipping_functions.w_equals_0(),
-    clipping_functions.w_equals_x(),
-    clipping_functions.w_equals_neg_x(),
-    clipping_functions.w_equals_y(),
-    clipping_functions.w_equals_neg_y(),
-    clipping_functions.z_equals_0(),
-    clipping_functions.w_equals_z(),
+    clipping_functions.W_EQUALS_0,
+    clipping_functions.W_EQUALS_X,
+    clipping_functions.W_EQUALS_NEG_X,
+    clipping_functions.W_EQUALS_Y,
+    clipping_functions.W_EQUALS_NEG_Y,
+    clipping_functions.Z_EQUALS_0,
+    clipping_functions.W_EQUALS_Z,
 ]
 
+# the ways of lighting the triangles, flat (once for each face), gouraud (at the vertices,
+# interpolated across the triangles) and phong (at each pixel, from the interpolated
+# vertex normals, with deferred shading only)
+SHADING_MODES = ["flat", "gouraud", "phong"]
+
+
+# the triangles of a mesh that are to be drawn (ie, survived culling and clipping)
+# stored as arrays with one entry per triangle, so each stage processes them all at once
+class FaceBatch:
+    def __init__(
+        self,
+        mesh,
+        face_indices,
+        clip_vertices,
+        texture_coordinates,
+        light_intensity,
+        colors,
+        lod=0,
+        normals=None,
+        centers=None,
+        vertex_normals=None,
+        vertex_positions=None,
+        textured=None,
+    ):
+        self.mesh = mesh
+        # level of detail of the mesh that was drawn (see Mesh.lods)
+        self.lod = lod
+        # index of the face (of the drawn level of detail) each triangle belongs to (N)
+        self.face_indices = face_indices
+        # homogeneous coordinates after perspective transformation (N x 4 x 3)
+        self.clip_vertices = clip_vertices
+        # texture coordinates (N x 2 x 3), None if the mesh has no texture coordinates
+        self.texture_coordinates = texture_coordinates
+        # whether each triangle has texture coordinates (N), the triangles of the faces
+        # without (see Mesh.textured_faces) are drawn untextured, None if all have
+        self.textured = textured
+        # ambient, diffuse, specular intensities of each triangle (N x 3),
+        # or (with gouraud shading) at each vertex of each triangle (N x 3 x 3)
+        self.light_intensity = light_intensity
+        # color of each triangle (N x 3)
+        self.colors = colors
+        # normal (N x 3) and center (N x 3) of the face of each triangle, in world space
+        # (for lighting the triangles later, see GraphicsPipeline.shade_gbuffer)
+        self.normals = normals
+        self.centers = centers
+        # normal and position at each vertex of each triangle (N x 3 x 3), in world space
+        # (with phong shading only, for lighting the pixels, see shade_gbuffer)
+        self.vertex_normals = vertex_normals
+        self.vertex_positions = vertex_positions
+        # screen coordinates after viewport transformation (N x 3 x 3), and 1 / w
+        # of each vertex (N x 4 x 3) when interpolating perspective correct
+        self.screen_vertices = None
+
+    def __len__(self):
+        return len(self.face_indices)
+
+    # the batch of only the given triangles (indices, or a mask), in the given order
+    def subset(self, triangles):
+        batch = FaceBatch(
+            self.mesh,
+            face_indices=self.face_indices[triangles],
+            clip_vertices=self.clip_vertices[triangles],
+            texture_coordinates=(
+                self.texture_coordinates[triangles]
+                if self.texture_coordinates is not None
+                else None
+            ),
+            light_intensity=self.light_intensity[triangles],
+            colors=self.colors[triangles],
+            lod=self.lod,
+            normals=self.normals[triangles] if self.normals is not None else None,
+            centers=self.centers[triangles] if self.centers is not None else None,
+            vertex_normals=(
+                self.vertex_normals[triangles]
+                if self.vertex_normals is not None
+                else None
+            ),
+            vertex_positions=(
+                self.vertex_positions[triangles]
+                if self.vertex_positions is not None
+                else None
+            ),
+            textured=self.textured[triangles] if self.textured is not None else None,
+        )
+        if self.screen_vertices is not None:
+            batch.screen_vertices = self.screen_vertices[triangles]
+        return batch
+
+    # the texture coordinates of the triangle (2 x 3), None if it has none
+    def triangle_texture_coordinates(self, i):
+        if self.texture_coordinates is None:
+            return None
+        if self.textured is not None and not self.textured[i]:
+            return None
+        return self.texture_coordinates[i]
+
+
+# the world space results of the geometry of a mesh (at some level of detail),
+# which depend only on the mesh's transformation, so they are computed once
+# and reused for as long as the mesh doesn't move (see GraphicsPipeline.update)
+# world_matrix: the mesh's transformation (4 x 4), or the transformations of the
+# instances of an instanced mesh (I x 4 x 4), whose faces are then numbered
+# one instance after another (I x F faces)
+class WorldGeometry:
+    def __init__(self, geometry, world_matrix, version):
+        self.geometry = geometry
+        self.world_matrix = world_matrix
+        # the mesh's version (see Mesh.version) the results are for
+        self.version = version
+        if world_matrix.ndim == 2:
+            # model space to world space
+            self.vertices = world_matrix @ geometry.model_vertices
+            # indices of each face's vertices in the vertices (F x 3)
+            self.vertex_indices = geometry.vertex_indices
+        else:
+            # all the instances at once, (I x 4 x 4) @ (4 x V), with the vertices
+            # of the instances one after another
+            vertices = world_matrix @ geometry.model_vertices
+            instances, _, num_vertices = vertices.shape
+            self.vertices = vertices.transpose(1, 0, 2).reshape(4, -1)
+            offsets = num_vertices * np.arange(instances)
+            self.vertex_indices = (
+                geometry.vertex_indices + offsets[:, np.newaxis, np.newaxis]
+            ).reshape(-1, 3)
+        # (F x 3 x 3), the vertices of each face (as columns)
+        self.face_vertices = self.vertices[:3, self.vertex_indices].transpose(1, 0, 2)
+        v0, v1, v2 = (
+            self.face_vertices[:, :, 0],
+            self.face_vertices[:, :, 1],
+            self.face_vertices[:, :, 2],
+        )
+        # normal (F x 3) and center (F x 3) of each face
+        self.normals = normalize_vectors(np.cross(v2 - v0, v1 - v0))
+        self.centers = self.face_vertices.mean(axis=2)
+
+    def __len__(self):
+        return len(self.vertex_indices)
+
+    # the faces of the geometry the given faces are (the same face of each instance)
+    def geometry_faces(self, face_indices):
+        return face_indices % len(self.geometry.vertex_indices)
+
+    # the normals at the vertices of the given faces (N x 3 x 3, a column per vertex),
+    # for smooth shading
+    def corner_normals(self, face_indices):
+        _, normal_indices = self.geometry.vertex_normals
+        instances = face_indices // len(self.geometry.vertex_indices)
+        normals = self.vertex_normals[
+            instances[:, np.newaxis], normal_indices[self.geometry_faces(face_indices)]
+        ]
+        return normals.transpose(0, 2, 1)
+
+    # the geometry's vertex normals (see Mesh.vertex_normals) in world space,
+    # of each instance (I x N x 3, a single instance for a mesh)
+    @cached_property
+    def vertex_normals(self):
+        normals, _ = self.geometry.vertex_normals
+        linear = self.world_matrix.reshape(-1, 4, 4)[:, :3, :3]
+        # normals are transformed by the inverse transpose, and flipped (like the faces'
+        # normals) when the transformation mirrors the mesh
+        signs = np.sign(np.linalg.det(linear))[:, np.newaxis, np.newaxis]
+        # (the normals as rows, so by the inverse instead of the inverse transpose)
+        return normalize_vectors(normals @ (np.linalg.inv(linear) * signs))
+
 
 class GraphicsPipeline:
-    def __init__(self, meshs, camera, screen: pygame.Surface, shader=None):
+    def __init__(
+        self,
+        meshs,
+        camera,
+        screen: pygame.Surface,
+        shader=None,
+        rasterizer="scanline",
+        lod_triangle_pixels=None,
+        frustum_culling=True,
+        bvh_culling=False,
+        workers=None,
+        record_stats=False,
+        sort_triangles=False,
+        depth_prepass=False,
+        deferred=False,
+        shading="flat",
+        incremental=False,
+        perspective_correct=False,
+    ):
         self.meshs = meshs
         self.camera = camera
         self.screen = screen
         self.shader = shader
+        # rasterization engine used for drawing the triangles (see rasterizer.RASTERIZERS)
+        assert rasterizer in RASTERIZERS, f"unknown rasterizer: {rasterizer}"
+        self.draw_triangle = RASTERIZERS[rasterizer]
+        self.draw_textured_triangle = TEXTURED_RASTERIZERS[rasterizer]
+        # when set, the triangles are rasterized in tiles by these many worker processes
+        # (see tiled_rasterizer.py), else they are rasterized here one after another
+        self.tiled_renderer = None
+        if workers is not None:
+            self.tiled_renderer = TiledRenderer(rasterizer, workers)
+        # whether to sort the triangles front to back (nearest first), so that
+        # fewer of the pixels drawn are drawn over again by nearer triangles
+        # (the pixels of an edge shared by triangles at the same depth are drawn by
+        # whichever is drawn first, so the images differ slightly from unsorted ones)
+        self.sort_triangles = sort_triangles
+        # whether draw_textured first finds the visible triangle at each pixel
+        # (drawing only the depths), and then shades each visible pixel just once
+        assert (
+            not depth_prepass or rasterizer == "vectorized"
+        ), "depth pre-pass needs the vectorized rasterizer"
+        assert (
+            not depth_prepass or workers is None
+        ), "depth pre-pass is not supported by the tiled renderer"
+        self.depth_prepass = depth_prepass
+        # whether draw and draw_textured only draw the visible triangle and the texture
+        # coordinates at each pixel (the g-buffer), and then texture (or color) and
+        # light all the pixels at once (deferred shading)
+        assert (
+            not deferred or rasterizer == "vectorized"
+        ), "deferred shading needs the vectorized rasterizer"
+        assert (
+            not deferred or workers is None
+        ), "deferred shading is not supported by the tiled renderer"
+        self.deferred = deferred
+        # how the triangles are lit (see SHADING_MODES), the smooth modes use
+        # the meshes' vertex normals (see Mesh.vertex_normals)
+        assert shading in SHADING_MODES, f"unknown shading: {shading}"
+        assert (
+            shading == "flat" or rasterizer == "vectorized"
+        ), "smooth shading needs the vectorized rasterizer"
+        assert shading != "phong" or deferred, "phong shading needs deferred shading"
+        self.shading = shading
+        # whether the texture coordinates, colors and light intensities are interpolated
+        # perspective correct (by the screen vertices' 1 / w, see rasterizer.attribute_weights)
+        # instead of linearly on the screen
+        assert (
+            not perspective_correct or rasterizer == "vectorized"
+        ), "perspective correct interpolation needs the vectorized rasterizer"
+        self.perspective_correct = perspective_correct
+        # whether update (and the draws) reuse their last results while the camera
+        # and the meshes don't move, and the world space results of each mesh while
+        # it doesn't move (see update), else everything is computed for every frame
+        # only moving the camera and the meshes (by their setters) is noticed, any other
+        # change (textures, colors, lighting, editing the arrays in place, ...) is drawn
+        # only after calling invalidate, so this is for scenes which just move around
+        self.incremental = incremental
+        # the world space results of the meshes' geometries (see WorldGeometry)
+        self.world_geometries = {}
+        # what the faces to draw were computed for (see scene_state)
+        self.state = None
+        # number of times the faces to draw were computed
+        self.updates = 0
+        # the draw method and the update the frame buffer holds the frame of
+        self.last_frame = None
+        # display and z buffers, allocated on the first draw (see clear_frame_buffer)
+        self.frame_buffer = None
+        # when set, the level of detail of each mesh (see Mesh.lods) is chosen so that
+        # its triangles cover about these many pixels, else the mesh itself is drawn
+        self.lod_triangle_pixels = lod_triangle_pixels
+        # whether to skip the meshes which are completely outside the view frustum
+        self.frustum_culling = frustum_culling
+        # whether to also cull the faces of each mesh in clusters, by traversing
+        # the mesh's bounding volume hierarchy (built here, once for each mesh)
+        self.bvh_culling = bvh_culling
+        if bvh_culling:
+            # (the instanced meshes are not culled in clusters)
+            for mesh in meshs:
+                if isinstance(mesh, InstancedMesh):
+                    continue
+                for geometry in [mesh, *mesh.lods]:
+                    geometry.bvh
+        # time spent in each stage, and the triangles (and pixels) out of each stage
+        # of the current frame (and of all the frames, when recording them)
+        self.stats = PipelineStats(record=record_stats)
+
+    # the transformations of the instances (I x 4 x 4) whose bounding spheres are
+    # (at least partly) inside the view frustum (all of them without frustum culling)
+    def visible_instances(self, instanced_mesh, camera_matrix):
+        world_matrices = instanced_mesh.world_matrices
+        self.stats.count("instances", len(world_matrices))
+        if not self.frustum_culling:
+            return world_matrices
+
+        center, radius = instanced_mesh.mesh.bounding_sphere
+        centers = world_matrices[:, :3] @ np.array([*center, 1.0])
+        radii = radius * np.abs(instanced_mesh.scales).max(axis=1)
+        outside = spheres_outside_planes(
+            centers, radii, frustum_planes(camera_matrix, CLIPPING_PLANES)
+        )
+        self.stats.count("instances_culled", np.count_nonzero(outside))
+        return world_matrices[~outside]
+
+    # the faces of the mesh's geometry which may be inside the view frustum
+    # found by traversing its bounding volume hierarchy, ordered (coarsely) front to back
+    def bvh_visible_faces(self, geometry, world_matrix, camera_matrix):
+        planes = frustum_planes(camera_matrix @ world_matrix, CLIPPING_PLANES)
+        camera_position = np.linalg.inv(world_matrix) @ [*self.camera.position, 1.0]
+        faces, nodes_visited = geometry.bvh.visible_faces(planes, camera_position[:3])
+        self.stats.count("bvh_nodes_visited", nodes_visited)
+        self.stats.count("bvh_faces_culled", len(geometry.vertex_indices) - len(faces))
+        return faces
+
+    # whether the mesh is completely outside the view frustum (ie, nothing to draw)
+    # tested against the mesh's bounding sphere (in world space), and if that
+    # is inconclusive, against the mesh's bounding box (in model space)
+    def outside_frustum(self, mesh, world_matrix, camera_matrix):
+        center, radius = mesh.bounding_sphere
+        center = (world_matrix @ np.array([*center, 1.0]))[:3]
+        radius = radius * np.abs(mesh.scale).max()
+        if sphere_outside_planes(
+            center, radius, frustum_planes(camera_matrix, CLIPPING_PLANES)
+        ):
+            return True
+
+        box_min, box_max = mesh.bounding_box
+        planes = frustum_planes(camera_matrix @ world_matrix, CLIPPING_PLANES)
+        return bool(
+            boxes_outside_planes(box_min[np.newaxis], box_max[np.newaxis], planes)[0]
+        )
+
+    # chooses the level of detail of the mesh to draw (0 is the mesh itself,
+    # i is mesh.lods[i - 1]) based on the projected size of the mesh on the screen
+    def select_lod(self, mesh, world_matrix):
+        if self.lod_triangle_pixels is None or not mesh.lods:
+            return 0
+
+        center, radius = mesh.bounding_sphere
+        center = (world_matrix @ np.array([*center, 1.0]))[:3]
+        radius = radius * np.abs(mesh.scale).max()
+        distance = np.linalg.norm(center - self.camera.position)
+        if distance <= radius:
+            return 0  # camera is inside the mesh's bounding sphere
+
+        # radius of the bounding sphere on the screen (in pixels)
+        _, height = self.screen.get_size()
+        focal_length = self.camera.projection_matrix[1, 1]
+        projected_radius = radius / distance * focal_length * height / 2
+        # number of faces needed for the triangles to be of the given size
+        wanted_faces = np.pi * projected_radius**2 / self.lod_triangle_pixels
 
+        # coarsest level with at least the wanted number of faces
+        levels = [mesh, *mesh.lods]
+        for lod in reversed(range(len(levels))):
+            if len(levels[lod].vertex_indices) >= wanted_faces:
+                return lod
+        return 0
+
+    # what the faces to draw depend on, the camera, the screen's size and the meshes
+    # (and their transformations)
+    def scene_state(self):
+        camera = self.camera
+        return (
+            camera.token,
+            camera.fov,
+            camera.aspect_ratio,
+            camera.near,
+            camera.far,
+            self.screen.get_size(),
+            tuple(mesh.token for mesh in self.meshs),
+        )
+
+    # the world space results of the mesh's geometry, computed again only
+    # if the mesh has moved since they were last computed (when incremental)
+    def world_geometry(self, mesh, geometry, world_matrix):
+        world = self.world_geometries.get(geometry.key)
+        if world is None or world.version != mesh.version or not self.incremental:
+            world = WorldGeometry(geometry, world_matrix, mesh.version)
+            self.world_geometries[geometry.key] = world
+            self.stats.count("meshes_transformed", 1)
+        return world
+
+    # drops all the results kept by update and the draws, so that the next frame
+    # is computed from scratch, needed after changing anything that isn't tracked
+    # (see scene_state), like the lighting, the meshes' colors, textures or materials
+    def invalidate(self):
+        self.world_geometries.clear()
+        self.state = None
+        self.last_frame = None
+
+    # the faces to draw are computed again only if the camera, the screen's size
+    # or the meshes have changed since the last update (when incremental)
     def update(self):
+        state = self.scene_state()
+        if self.incremental and state == self.state:
+            self.stats.new_frame()
+            self.stats.count("updates_skipped", 1)
+            return
+        self.state = state
+        self.updates += 1
+
         # transform vertices from model space to screen space
         # ie, the vertex shader step
         view_matrix = self.camera.view_matrix
@@ -31,124 +430,655 @@ class GraphicsPipeline:
         viewport_matrix = viewport(*self.screen.get_size())
         camera_position = self.camera.position
 
-        self.faces_to_draw = []  # we'll computes faces to draw
+        self.faces_to_draw = []  # we'll computes faces to draw (a batch per mesh)
+        self.stats.new_frame()
+        stats = self.stats
 
         for mesh in self.meshs:
-            front_faces = []  # faces that are facing the camera
+            stats.count("meshes", 1)
+            instanced = isinstance(mesh, InstancedMesh)
+            with stats.time("culling"):
+                if instanced:
+                    # the instances in the view frustum, drawn all at once
+                    # (at full detail, and without the bounding volume hierarchy)
+                    world_matrix = self.visible_instances(mesh, camera_matrix)
+                    if len(world_matrix) == 0:
+                        stats.count("meshes_culled", 1)
+                        continue
+                    # the shared mesh (its geometry, texture and material) is drawn
+                    mesh = mesh.mesh
+                    geometry, lod = mesh, 0
+                    faces = np.arange(len(world_matrix) * len(geometry.vertex_indices))
+                    stats.count("faces", len(faces))
+                else:
+                    world_matrix = mesh.world_matrix
+                    if self.frustum_culling and self.outside_frustum(
+                        mesh, world_matrix, camera_matrix
+                    ):
+                        stats.count("meshes_culled", 1)
+                        continue
 
-            world_matrix = mesh.world_matrix
-            model_vertices = mesh.model_vertices
+                    # the geometry of the chosen level of detail
+                    lod = self.select_lod(mesh, world_matrix)
+                    geometry = mesh if lod == 0 else mesh.lods[lod - 1]
+                    stats.count("faces", len(geometry.vertex_indices))
 
-            # model space to world space
-            world_vertices = world_matrix @ model_vertices
+                    # the faces to process, all of them unless culled in clusters
+                    if self.bvh_culling:
+                        faces = self.bvh_visible_faces(
+                            geometry, world_matrix, camera_matrix
+                        )
+                    else:
+                        faces = np.arange(len(geometry.vertex_indices))
 
-            # world space to clip space
-            clip_vertices = camera_matrix @ world_vertices
+            with stats.time("vertex_transform"):
+                # model space to world space
+                if instanced:
+                    # the visible instances change with the camera, and keeping all
+                    # the instances' world vertices would grow with the instances,
+                    # so they are computed for every frame
+                    world = WorldGeometry(geometry, world_matrix, None)
+                else:
+                    world = self.world_geometry(mesh, geometry, world_matrix)
+                vertex_indices = world.vertex_indices[faces]
+
+                # world space to clip space
+                clip_vertices = camera_matrix @ world.vertices
 
             # backface culling
-            # here we'll be culling in world space
-            for face in mesh.faces:
-                face.world_vertices = world_vertices[:, face.vertex_indices]
-                world_normal = face.world_normal
-                camera_to_face = normalize(face.world_vertices[:3, 0] - camera_position)
+            # here we'll be culling in world space, for all the faces at once
+            with stats.time("backface_culling"):
+                # (F x 3 x 3), the vertices of each face (as columns), and their normals
+                face_vertices, world_normals = world.face_vertices, world.normals
+                face_centers = world.centers
+                if self.bvh_culling:
+                    face_vertices, world_normals = (
+                        face_vertices[faces],
+                        world_normals[faces],
+                    )
+                    face_centers = face_centers[faces]
+                camera_to_faces = normalize_vectors(
+                    face_vertices[:, :, 0] - camera_position
+                )
 
                 # if face normal and camera_to_face are in the same direction
                 # then the face is facing away from the camera
-                if np.dot(world_normal, camera_to_face) >= 0:
-                    continue
+                front = np.sum(world_normals * camera_to_faces, axis=-1) < 0
+                face_indices = faces[front]
+                stats.count("front_faces", len(face_indices))
 
+            with stats.time("lighting"):
+                face_centers = face_centers[front]
                 if self.shader is not None:
-                    face_center = face.world_vertices[:3].mean(axis=1)
                     # store the face's light intensity for later use
                     # will be combined with the texture color to get the final color at the pixel
-                    face.light_intensity = self.shader.light_intensity(
-                        world_normal, face_center, camera_position
+                    light_intensity = self.shader.light_intensities(
+                        world_normals[front],
+                        face_centers,
+                        camera_position,
+                        mesh.material,
                     )
+                else:
+                    light_intensity = np.tile([1.0, 0.0, 0.0], (len(face_indices), 1))
+
+                # the attributes at the vertices of the faces (N x K x 3) for smooth
+                # shading, interpolated across the triangles (and clipped with them)
+                smooth_attributes = {}
+                if self.shading != "flat":
+                    vertex_normals = world.corner_normals(face_indices)
+                    vertex_positions = face_vertices[front]
+                    if self.shading == "phong":
+                        smooth_attributes["vertex_normals"] = vertex_normals
+                        smooth_attributes["vertex_positions"] = vertex_positions
+                    elif self.shader is not None:
+                        # the light intensities at all the vertices at once
+                        vertex_light_intensity = self.shader.light_intensities(
+                            vertex_normals.transpose(0, 2, 1).reshape(-1, 3),
+                            vertex_positions.transpose(0, 2, 1).reshape(-1, 3),
+                            camera_position,
+                            mesh.material,
+                        )
+                        smooth_attributes["light_intensity"] = (
+                            vertex_light_intensity.reshape(-1, 3, 3).transpose(0, 2, 1)
+                        )
+
+            with stats.time("clipping"):
+                # (N x 4 x 3), the clip vertices of each front face
+                face_clip_vertices = clip_vertices[:, vertex_indices[front]].transpose(
+                    1, 0, 2
+                )
+                texture_coordinates, textured = None, None
+                if geometry.texture_indices is not None:
+                    texture_indices = geometry.texture_indices[
+                        world.geometry_faces(face_indices)
+                    ]
+                    textured = np.all(texture_indices >= 0, axis=1)
+                    if np.all(textured):
+                        textured = None
+                    texture_coordinates = geometry.model_texture_coordinates[
+                        :, texture_indices
+                    ].transpose(1, 0, 2)
 
-                face.clip_vertices = clip_vertices[:, face.vertex_indices]
-                front_faces.append(face)
+                # the attributes are clipped along with the vertices, all together
+                attributes = {"texture_coordinates": texture_coordinates}
+                attributes.update(smooth_attributes)
+                attributes = {
+                    name: values
+                    for name, values in attributes.items()
+                    if values is not None
+                }
+                stacked_attributes = None
+                if attributes:
+                    stacked_attributes = np.concatenate(list(attributes.values()), 1)
 
-            for face in front_faces:
                 # implement clipping against each of the clipping planes
-                faces = [face]
-                for check_inside, get_intersection in CLIPPING_PLANES:
-                    new_faces = []
-                    for face in faces:
-                        new_faces.extend(face.clip(check_inside, get_intersection))
-                    faces = new_faces
-
-                # apply perspective division and viewport transformation,
-                # for each face obtained after clipping
-                for cface in faces:
-                    # perspective division
-                    cface.image_vertices = cface.clip_vertices / cface.clip_vertices[3]
-                    # viewport transformation
-                    cface.screen_vertices = (viewport_matrix @ cface.image_vertices)[:3]
-
-                self.faces_to_draw.extend(faces)
+                # for all the front faces at once
+                clipped_vertices, clipped_attributes, clipped_indices = (
+                    clipping_functions.clip_triangles(
+                        face_clip_vertices, stacked_attributes, CLIPPING_PLANES
+                    )
+                )
+                stats.count("clipped_triangles", len(clipped_indices))
+
+                clipped = {}
+                if attributes:
+                    rows = np.cumsum(
+                        [values.shape[1] for values in attributes.values()]
+                    )
+                    clipped = dict(
+                        zip(attributes, np.split(clipped_attributes, rows[:-1], axis=1))
+                    )
+
+            batch = FaceBatch(
+                mesh,
+                face_indices=world.geometry_faces(face_indices[clipped_indices]),
+                clip_vertices=clipped_vertices,
+                texture_coordinates=clipped.get("texture_coordinates"),
+                light_intensity=clipped.get(
+                    "light_intensity", light_intensity[clipped_indices]
+                ),
+                colors=geometry.colors[
+                    world.geometry_faces(face_indices[clipped_indices])
+                ],
+                lod=lod,
+                normals=world_normals[front][clipped_indices],
+                centers=face_centers[clipped_indices],
+                vertex_normals=clipped.get("vertex_normals"),
+                vertex_positions=clipped.get("vertex_positions"),
+                textured=textured[clipped_indices] if textured is not None else None,
+            )
+
+            # apply perspective division and viewport transformation,
+            # for all the triangles obtained after clipping
+            with stats.time("viewport"):
+                # perspective division
+                image_vertices = batch.clip_vertices / batch.clip_vertices[:, 3:4]
+                # viewport transformation
+                batch.screen_vertices = (viewport_matrix @ image_vertices)[:, :3]
+                if self.perspective_correct:
+                    # 1 / w of each vertex, as the 4th row of the screen vertices
+                    batch.screen_vertices = np.concatenate(
+                        [batch.screen_vertices, 1 / batch.clip_vertices[:, 3:4]], axis=1
+                    )
+
+            if self.sort_triangles:
+                with stats.time("sorting"):
+                    # by the depth of the nearest vertex of each triangle
+                    depths = batch.screen_vertices[:, 2].min(axis=1)
+                    batch = batch.subset(np.argsort(depths, kind="stable"))
+
+            self.faces_to_draw.append(batch)
+
+        if self.sort_triangles:
+            # the meshes by the depth of their nearest triangle
+            self.faces_to_draw.sort(
+                key=lambda batch: (
+                    batch.screen_vertices[0, 2].min() if len(batch) else np.inf
+                )
+            )
 
     def draw_wireframe(self):
-        self.screen.fill((255, 255, 255))
-        for face in self.faces_to_draw:
-            if face.screen_vertices is None:
-                continue
-            color = (0, 0, 0)
-            points = face.screen_vertices[:2].T
-            pygame.draw.polygon(self.screen, color, points, 1)
+        with self.stats.time("rasterization"):
+            self.screen.fill((255, 255, 255))
+            for batch in self.faces_to_draw:
+                for screen_vertices in batch.screen_vertices:
+                    color = (0, 0, 0)
+                    points = screen_vertices[:2].T
+                    pygame.draw.polygon(self.screen, color, points, 1)
+
+    # draws the stats of the current frame onto the screen (after drawing the frame)
+    def draw_stats(self):
+        self.stats.draw_overlay(self.screen)
+
+    # the frame buffer for the screen's current size, cleared for drawing a new frame
+    # (allocated again only when the screen's size changes)
+    def clear_frame_buffer(self):
+        size = self.screen.get_size()
+        if self.frame_buffer is None or self.frame_buffer.size != size:
+            if self.frame_buffer is not None:
+                self.frame_buffer.close()
+            # the tiled renderer's workers draw into the frame buffer, so it is shared
+            self.frame_buffer = FrameBuffer(
+                *size, shared=self.tiled_renderer is not None
+            )
+        else:
+            self.frame_buffer.clear()
+        return self.frame_buffer
+
+    # blits the last frame drawn again, instead of drawing it, if the frame buffer holds
+    # the frame drawn by the same method, and nothing has changed since (see update)
+    # returns whether it did, else the frame is to be drawn (see frame_drawn)
+    def reuse_last_frame(self, method):
+        if (
+            not self.incremental
+            or (method, self.updates) != self.last_frame
+            or self.frame_buffer is None
+            or self.frame_buffer.size != self.screen.get_size()
+        ):
+            # the frame buffer is drawn over from now on
+            self.last_frame = None
+            return False
+
+        with self.stats.time("blit"):
+            if method == "draw_depth":
+                self.frame_buffer.blit_depth(self.screen)
+            else:
+                self.frame_buffer.blit(self.screen)
+        self.stats.count("frames_reused", 1)
+        return True
+
+    # notes that the frame buffer holds the frame drawn by the method (once it is
+    # completely drawn, so a draw that failed midway is never reused)
+    def frame_drawn(self, method):
+        self.last_frame = (method, self.updates)
+
+    # counts the pixels drawn (and rejected by the depth test), summing the results
+    # of the rasterizer (or of the tiled renderer) for each triangle
+    def count_pixels(self, results):
+        results = np.reshape(results, (-1, 2)).sum(axis=0)
+        self.stats.count("pixels_drawn", results[0])
+        self.stats.count("depth_rejected", results[1])
 
     def draw(self):
         # draws the mesh's screen vertices onto the screen
         # ie, the rasterization step
-        width, height = self.screen.get_size()
+        if self.reuse_last_frame("draw"):
+            return
+        frame_buffer = self.clear_frame_buffer()
 
-        # z buffer for hidden surface removal
-        z_buffer = np.full((width, height), 1.0, dtype=np.float32)
-        # display buffer to store the final image to be displayed
-        display_buffer = np.zeros((width, height, 3), dtype=np.uint8)
+        if self.deferred:
+            self.draw_deferred(frame_buffer, textured=False)
+        else:
+            self.draw_forward(frame_buffer)
+        self.frame_drawn("draw")
 
-        for face in self.faces_to_draw:
-            if face.screen_vertices is None:
-                continue
-            color = self.shader.get_color(*face.light_intensity, face.color)
-            # draw the triangle onto the display buffer,
-            # looking up the z buffer for hidden surface removal
-            draw_triangle(face.screen_vertices, display_buffer, z_buffer, color)
+    # draws the triangles one after another (or in tiles), filled with their colors
+    # (with gouraud shading, lit at each pixel, like draw_textured and shade_gbuffer do)
+    def draw_forward(self, frame_buffer):
+        with self.stats.time("rasterization"):
+            if self.shading == "flat":
+                # color of each triangle, after applying the lighting
+                colors = [
+                    self.shader.get_color(
+                        *batch.light_intensity.T[..., np.newaxis], batch.colors
+                    )
+                    for batch in self.faces_to_draw
+                ]
+                shader = None
+            else:
+                # the triangles are lit by the rasterizer, from the vertices' intensities
+                colors = [batch.colors for batch in self.faces_to_draw]
+                shader = self.shader
+
+            if self.tiled_renderer is not None:
+                results = self.tiled_renderer.render(
+                    frame_buffer,
+                    self.faces_to_draw,
+                    textured=False,
+                    shader=shader,
+                    colors=colors,
+                )
+            elif shader is not None:
+                results = [
+                    self.draw_triangle(
+                        batch.screen_vertices[i],
+                        frame_buffer.display_buffer,
+                        frame_buffer.z_buffer,
+                        batch_colors[i],
+                        batch.light_intensity[i],
+                        shader,
+                    )
+                    for batch, batch_colors in zip(self.faces_to_draw, colors)
+                    for i in range(len(batch))
+                ]
+            else:
+                results = [
+                    # draw the triangle onto the display buffer,
+                    # looking up the z buffer for hidden surface removal
+                    self.draw_triangle(
+                        screen_vertices,
+                        frame_buffer.display_buffer,
+                        frame_buffer.z_buffer,
+                        color,
+                    )
+                    for batch, batch_colors in zip(self.faces_to_draw, colors)
+                    for screen_vertices, color in zip(
+                        batch.screen_vertices, batch_colors
+                    )
+                ]
+            self.count_pixels(results)
 
         # blit the display buffer onto the screen
-        pygame.surfarray.blit_array(self.screen, display_buffer)
+        with self.stats.time("blit"):
+            frame_buffer.blit(self.screen)
 
     def draw_textured(self):
-        width, height = self.screen.get_size()
-        z_buffer = np.full((width, height), 1.0, dtype=np.float32)
-        display_buffer = np.zeros((width, height, 3), dtype=np.uint8)
+        if self.reuse_last_frame("draw_textured"):
+            return
+        frame_buffer = self.clear_frame_buffer()
+
+        if self.deferred:
+            self.draw_deferred(frame_buffer, textured=True)
+        elif self.depth_prepass:
+            self.draw_textured_with_depth_prepass(frame_buffer)
+        else:
+            self.draw_textured_forward(frame_buffer)
+        self.frame_drawn("draw_textured")
+
+    # draws the textured triangles one after another (or in tiles)
+    def draw_textured_forward(self, frame_buffer):
+        with self.stats.time("rasterization"):
+            if self.tiled_renderer is not None:
+                results = self.tiled_renderer.render(
+                    frame_buffer, self.faces_to_draw, textured=True, shader=self.shader
+                )
+            else:
+                results = [
+                    self.draw_textured_triangle(
+                        batch.screen_vertices[i],
+                        batch.triangle_texture_coordinates(i),
+                        frame_buffer.display_buffer,
+                        frame_buffer.z_buffer,
+                        batch.mesh.texture,
+                        batch.light_intensity[i],
+                        self.shader,
+                    )
+                    for batch in self.faces_to_draw
+                    for i in range(len(batch))
+                ]
+            self.count_pixels(results)
+
+        with self.stats.time("blit"):
+            frame_buffer.blit(self.screen)
+
+    # draws the visible triangle at each pixel into the id buffer (and the depths),
+    # then shades only the pixels of the visible triangles, so that the pixels drawn over
+    # by nearer triangles are never textured or lit, and the occluded triangles are skipped
+    # (the image is the same as the one drawn without the pre-pass)
+    def draw_textured_with_depth_prepass(self, frame_buffer):
+        id_buffer = frame_buffer.id_buffer
+        # the triangles of all the batches are numbered one after another
+        offsets = np.cumsum([0] + [len(batch) for batch in self.faces_to_draw])
+
+        with self.stats.time("depth_prepass"):
+            results = [
+                draw_triangle_id_vectorized(
+                    screen_vertices, offset + i, id_buffer, frame_buffer.z_buffer
+                )
+                for batch, offset in zip(self.faces_to_draw, offsets.tolist())
+                for i, screen_vertices in enumerate(batch.screen_vertices)
+            ]
+            self.count_pixels(results)
+
+        with self.stats.time("rasterization"):
+            # the triangles visible at some pixel
+            visible = np.unique(id_buffer)
+            visible = visible[visible >= 0]
+            shaded = 0
+            for b, batch in enumerate(self.faces_to_draw):
+                triangles = visible[
+                    (visible >= offsets[b]) & (visible < offsets[b + 1])
+                ]
+                for triangle_id in triangles.tolist():
+                    i = triangle_id - offsets[b]
+                    shaded += shade_textured_triangle_vectorized(
+                        batch.screen_vertices[i],
+                        triangle_id,
+                        id_buffer,
+                        batch.triangle_texture_coordinates(i),
+                        frame_buffer.display_buffer,
+                        batch.mesh.texture,
+                        batch.light_intensity[i],
+                        self.shader,
+                    )
+            self.stats.count("pixels_shaded", shaded)
+            self.stats.count("triangles_shaded", len(visible))
+
+        with self.stats.time("blit"):
+            frame_buffer.blit(self.screen)
+
+    # deferred shading, first draws the visible triangle, its depth and texture coordinates
+    # at each pixel (the g-buffer), then textures (or colors) and lights all the pixels
+    # at once (the image is the same as the one drawn by the forward path)
+    def draw_deferred(self, frame_buffer, textured):
+        # the triangles of all the batches are numbered one after another
+        offsets = np.cumsum([0] + [len(batch) for batch in self.faces_to_draw])
+        # smooth shading interpolates the vertices' attributes at each pixel
+        weights_buffer = None
+        if self.shading != "flat":
+            weights_buffer = frame_buffer.weights_buffer
+        # the textures' levels of detail are of each pixel, when perspective correct
+        inverse_w_buffer = None
+        if textured and self.perspective_correct:
+            inverse_w_buffer = frame_buffer.inverse_w_buffer
+
+        with self.stats.time("geometry_pass"):
+            results = [
+                draw_triangle_gbuffer_vectorized(
+                    batch.screen_vertices[i],
+                    batch.triangle_texture_coordinates(i) if textured else None,
+                    offset + i,
+                    frame_buffer.id_buffer,
+                    frame_buffer.z_buffer,
+                    frame_buffer.uv_buffer,
+                    weights_buffer,
+                    inverse_w_buffer,
+                )
+                for batch, offset in zip(self.faces_to_draw, offsets.tolist())
+                for i in range(len(batch))
+            ]
+            self.count_pixels(results)
+
+        with self.stats.time("shading_pass"):
+            self.shade_gbuffer(frame_buffer, offsets, textured)
+
+        with self.stats.time("blit"):
+            frame_buffer.blit(self.screen)
 
-        for face in self.faces_to_draw:
-            if face.screen_vertices is None:
+    # textures (or colors) and lights all the pixels of the g-buffer (see draw_deferred)
+    # the pixels of each batch at once, lit with the batch's material
+    def shade_gbuffer(self, frame_buffer, offsets, textured):
+        covered = frame_buffer.id_buffer >= 0
+        triangles = frame_buffer.id_buffer[covered]  # triangle of each pixel
+        u, v = frame_buffer.uv_buffer[covered].T
+        weights = None
+        if self.shading != "flat":
+            weights = frame_buffer.weights_buffer[covered]
+        inverse_w = None
+        if textured and self.perspective_correct:
+            inverse_w = frame_buffer.inverse_w_buffer[covered]
+        batches = np.searchsorted(offsets, triangles, side="right") - 1
+
+        # like the forward path, the triangles without a texture are drawn white (unlit)
+        colors = np.full((len(triangles), 3), 255)
+        for b, batch in enumerate(self.faces_to_draw):
+            pixels = np.flatnonzero(batches == b)
+            if len(pixels) == 0:
+                continue
+            # the triangle of each pixel, in the batch
+            batch_triangles = triangles[pixels] - offsets[b]
+            if not textured:
+                colors[pixels] = batch.colors[batch_triangles]
+            elif batch.texture_coordinates is None or batch.mesh.texture is None:
                 continue
+            else:
+                if batch.textured is not None:
+                    # the pixels of the triangles without texture coordinates
+                    # are left white (unlit)
+                    textured_pixels = batch.textured[batch_triangles]
+                    pixels = pixels[textured_pixels]
+                    batch_triangles = batch_triangles[textured_pixels]
+                texture = batch.mesh.texture
+                lod = 0.0
+                if texture.mipmapped:
+                    # the level of detail of each triangle (or, when perspective
+                    # correct, of each pixel), the same as the forward path's
+                    # (see rasterizer.sample_triangle_texture)
+                    derivatives = texture_lod_derivatives(
+                        batch.screen_vertices, batch.texture_coordinates
+                    )
+                    if inverse_w is None:
+                        lod = texture.level_of_detail(derivatives)[batch_triangles]
+                    else:
+                        lod = pixel_level_of_detail(
+                            texture,
+                            derivatives[batch_triangles],
+                            u[pixels],
+                            v[pixels],
+                            inverse_w[pixels],
+                        )
+                colors[pixels] = texture.sample_many(u[pixels], v[pixels], lod)
+
+            if self.shader is not None:
+                light_intensity = self.pixel_light_intensities(
+                    batch,
+                    batch_triangles,
+                    weights[pixels] if weights is not None else None,
+                )
+                colors[pixels] = self.shader.get_color(
+                    *light_intensity.T[:, :, np.newaxis], colors[pixels]
+                )
+
+        frame_buffer.display_buffer[covered] = colors
+        self.stats.count("pixels_shaded", len(triangles))
 
-            draw_textured_triangle(
-                face.screen_vertices,
-                face.texture_coordinates,
-                display_buffer,
-                z_buffer,
-                face.mesh.texture,
-                face.light_intensity,
-                self.shader,
+    # the light intensities (P x 3) at the pixels of the batch's triangles (P)
+    # weights: the barycentric weights at the pixels (P x 3), for smooth shading
+    def pixel_light_intensities(self, batch, triangles, weights):
+        if self.shading == "gouraud":
+            # as the forward path interpolates them (see rasterizer.interpolate_light)
+            light_intensity = np.moveaxis(batch.light_intensity[triangles], 0, -1)
+            return interpolate_light(light_intensity, weights.T)[:, :, 0].T
+
+        if self.shading == "phong":
+            normals = normalize_vectors(
+                np.einsum("pkc,pc->pk", batch.vertex_normals[triangles], weights)
+            )
+            positions = np.einsum(
+                "pkc,pc->pk", batch.vertex_positions[triangles], weights
+            )
+            return self.shader.light_intensities(
+                normals, positions, self.camera.position, batch.mesh.material
             )
 
-        pygame.surfarray.blit_array(self.screen, display_buffer)
+        # flat, light only the visible triangles, and look up each pixel's triangle
+        visible, pixel_triangles = np.unique(triangles, return_inverse=True)
+        return self.shader.light_intensities(
+            batch.normals[visible],
+            batch.centers[visible],
+            self.camera.position,
+            batch.mesh.material,
+        )[pixel_triangles.ravel()]
 
     def draw_depth(self):
-        width, height = self.screen.get_size()
-        z_buffer = np.full((width, height), 1.0, dtype=np.float32)
-        display_buffer = np.zeros((width, height, 3), dtype=np.uint8)
+        if self.reuse_last_frame("draw_depth"):
+            return
+        frame_buffer = self.clear_frame_buffer()
 
-        for face in self.faces_to_draw:
-            if face.screen_vertices is None:
-                continue
-            color = (255, 255, 255)
-            draw_triangle(face.screen_vertices, display_buffer, z_buffer, color)
+        with self.stats.time("rasterization"):
+            if self.tiled_renderer is not None:
+                colors = [np.full((len(batch), 3), 255) for batch in self.faces_to_draw]
+                results = self.tiled_renderer.render(
+                    frame_buffer, self.faces_to_draw, textured=False, colors=colors
+                )
+            else:
+                color = (255, 255, 255)
+                results = [
+                    self.draw_triangle(
+                        screen_vertices,
+                        frame_buffer.display_buffer,
+                        frame_buffer.z_buffer,
+                        color,
+                    )
+                    for batch in self.faces_to_draw
+                    for screen_vertices in batch.screen_vertices
+                ]
+            self.count_pixels(results)
+
+        with self.stats.time("blit"):
+            frame_buffer.blit_depth(self.screen)
+        self.frame_drawn("draw_depth")
+
+    # releases the frame buffer, and the worker processes of the tiled renderer (if any)
+    def close(self):
+        if self.tiled_renderer is not None:
+            self.tiled_renderer.close()
+        if self.frame_buffer is not None:
+            self.frame_buffer.close()
+            self.frame_buffer = None
+
+
+# checks that deferred shading draws the same images as the forward path (lighting the
+# pixels, and sampling the mipmaps at the levels of detail, the same way),
+# on some of the benchmark's scenes
+if __name__ == "__main__":
+    import pygame
+    from benchmark import create_pipeline
+    from mesh import Mesh
+
+    size = 128
+    for scene in ["cube", "cottage", "sphere_2k", "overdraw", "instanced"]:
+        for options in [
+            dict(shading="flat"),
+            dict(shading="gouraud"),
+            dict(shading="gouraud", perspective_correct=True),
+            dict(filtering="trilinear"),
+            dict(filtering="trilinear", perspective_correct=True),
+        ]:
+            for method in ["draw", "draw_textured"]:
+                images = []
+                for deferred in [False, True]:
+                    pipeline = create_pipeline(
+                        scene,
+                        size,
+                        size,
+                        rasterizer="vectorized",
+                        deferred=deferred,
+                        **options,
+                    )
+                    pipeline.update()
+                    getattr(pipeline, method)()
+                    images.append(pygame.surfarray.array3d(pipeline.screen))
+                    pipeline.close()
+                different = np.count_nonzero((images[0] != images[1]).any(axis=2))
+                print(f"{scene} {method} {options}: {different} pixels differ")
+                assert different == 0, f"{scene}: deferred image differs from forward"
 
-        z_buffer = (1 - z_buffer) * 255
-        display_buffer = np.stack([z_buffer] * 3, axis=-1).astype(np.uint8)
-        pygame.surfarray.blit_array(self.screen, display_buffer)
+    # replacing a mesh (or the camera) by a new one is noticed by an incremental
+    # pipeline, even when the new one is at the same address as the freed old one
+    pipeline = create_pipeline("cube", size, size, incremental=True)
+    pipeline.update()
+    for _ in range(3):
+        state = pipeline.state
+        old = pipeline.meshs[0]
+        mesh = Mesh(old.model_vertices, old.vertex_indices)
+        mesh.position, mesh.rotation, mesh.scale = old.position, old.rotation, old.scale
+        pipeline.meshs = [mesh]
+        del old, mesh
+        pipeline.update()
+        assert pipeline.state != state, "a replaced mesh was taken for the old one"
+    updates = pipeline.updates
+    pipeline.update()
+    assert pipeline.updates == updates, "an unchanged scene was computed again"
+    pipeline.close()
+    print("replaced meshes are noticed by the incremental pipeline")
@@ -0,0 +1,301 @@
+import numpy as np
+
+# the innermost loops of the scanline rasterizers and of clipping, as plain loops over
+# numbers and arrays, which numba (when installed) compiles to native code
+# the project needs only numpy (see requirements.txt), without numba these stay plain
+# python (slow), and the rasterizers and clipping use their numpy versions instead
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# whether the kernels are compiled (see rasterizer.RASTERIZERS, clip_triangles)
+JIT_AVAILABLE = numba is not None
+
+
+# compiles the function with numba, if installed, else leaves it as is
+# the compiled code is cached on disk (in __pycache__), so that only the first run
+# (and the first run after the kernels change) pays for compiling them
+def jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+# same as np.linspace(start, stop, num), value for value
+@jit
+def linspace(start, stop, num):
+    values = np.empty(num)
+    step = (stop - start) / (num - 1) if num > 1 else 0.0
+    for i in range(num):
+        values[i] = i * step + start
+    if num > 1:
+        values[num - 1] = stop
+    return values
+
+
+# rasterizer.draw_triangle, with the vertices (3 x 3) already sorted by y
+# and the color as the display buffer's type
+@jit
+def draw_triangle_kernel(vertices, display_buffer, z_buffer, color):
+    width, height = z_buffer.shape
+    x0, x1, x2 = int(vertices[0, 0]), int(vertices[0, 1]), int(vertices[0, 2])
+    y0, y1, y2 = int(vertices[1, 0]), int(vertices[1, 1]), int(vertices[1, 2])
+    z0, z1, z2 = vertices[2, 0], vertices[2, 1], vertices[2, 2]
+
+    x01 = linspace(x0, x1, y1 - y0 + 1)
+    x02 = linspace(x0, x2, y2 - y0 + 1)
+    x12 = linspace(x1, x2, y2 - y1 + 1)
+    z01 = linspace(z0, z1, y1 - y0 + 1)
+    z02 = linspace(z0, z2, y2 - y0 + 1)
+    z12 = linspace(z1, z2, y2 - y1 + 1)
+
+    drawn, rejected = 0, 0
+    for y in range(y0, y2 + 1):
+        if y < y1:
+            x3, x4 = int(x01[y - y0]), int(x02[y - y0])
+            z3, z4 = z01[y - y0], z02[y - y0]
+        else:
+            x3, x4 = int(x12[y - y1]), int(x02[y - y0])
+            z3, z4 = z12[y - y1], z02[y - y0]
+        if x3 > x4:
+            x3, x4 = x4, x3
+            z3, z4 = z4, z3
+
+        z34 = linspace(z3, z4, x4 - x3 + 1)
+        for x in range(x3, x4 + 1):
+            z = z34[x - x3]
+            if 0 <= x < width and 0 <= y < height:
+                if z < z_buffer[x, y]:
+                    z_buffer[x, y] = z
+                    for c in range(3):
+                        display_buffer[x, y, c] = color[c]
+                    drawn += 1
+                else:
+                    rejected += 1
+    return drawn, rejected
+
+
+# rasterizer.draw_textured_triangle, with the vertices (3 x 3) and the texture
+# coordinates (2 x 3) already sorted by y, sampling the nearest texel of the texture
+# (W x H x 3), lit (when lit) as PixelShader.get_color does, ie, each channel
+# is color * scale + offset (scale: ambient + diffuse, offset: light color * specular)
+@jit
+def draw_textured_triangle_kernel(
+    vertices, texture_coordinates, display_buffer, z_buffer, texture, lit, scale, offset
+):
+    width, height = z_buffer.shape
+    texture_width, texture_height = texture.shape[0], texture.shape[1]
+    x0, x1, x2 = int(vertices[0, 0]), int(vertices[0, 1]), int(vertices[0, 2])
+    y0, y1, y2 = int(vertices[1, 0]), int(vertices[1, 1]), int(vertices[1, 2])
+    z0, z1, z2 = vertices[2, 0], vertices[2, 1], vertices[2, 2]
+    u0, u1, u2 = (
+        texture_coordinates[0, 0],
+        texture_coordinates[0, 1],
+        texture_coordinates[0, 2],
+    )
+    v0, v1, v2 = (
+        texture_coordinates[1, 0],
+        texture_coordinates[1, 1],
+        texture_coordinates[1, 2],
+    )
+
+    x01 = linspace(x0, x1, y1 - y0 + 1)
+    x02 = linspace(x0, x2, y2 - y0 + 1)
+    x12 = linspace(x1, x2, y2 - y1 + 1)
+    z01 = linspace(z0, z1, y1 - y0 + 1)
+    z02 = linspace(z0, z2, y2 - y0 + 1)
+    z12 = linspace(z1, z2, y2 - y1 + 1)
+    u01 = linspace(u0, u1, y1 - y0 + 1)
+    u02 = linspace(u0, u2, y2 - y0 + 1)
+    u12 = linspace(u1, u2, y2 - y1 + 1)
+    v01 = linspace(v0, v1, y1 - y0 + 1)
+    v02 = linspace(v0, v2, y2 - y0 + 1)
+    v12 = linspace(v1, v2, y2 - y1 + 1)
+
+    drawn, rejected = 0, 0
+    for y in range(y0, y2 + 1):
+        if y < y1:
+            x3, x4 = int(x01[y - y0]), int(x02[y - y0])
+            z3, z4 = z01[y - y0], z02[y - y0]
+            u3, u4 = u01[y - y0], u02[y - y0]
+            v3, v4 = v01[y - y0], v02[y - y0]
+        else:
+            x3, x4 = int(x12[y - y1]), int(x02[y - y0])
+            z3, z4 = z12[y - y1], z02[y - y0]
+            u3, u4 = u12[y - y1], u02[y - y0]
+            v3, v4 = v12[y - y1], v02[y - y0]
+        if x3 > x4:
+            x3, x4 = x4, x3
+            z3, z4 = z4, z3
+            u3, u4 = u4, u3
+            v3, v4 = v4, v3
+
+        z34 = linspace(z3, z4, x4 - x3 + 1)
+        u34 = linspace(u3, u4, x4 - x3 + 1)
+        v34 = linspace(v3, v4, x4 - x3 + 1)
+        for x in range(x3, x4 + 1):
+            z = z34[x - x3]
+            if 0 <= x < width and 0 <= y < height:
+                if z < z_buffer[x, y]:
+                    z_buffer[x, y] = z
+                    # the nearest texel (see Texture.sample)
+                    tx = min(
+                        max(int(u34[x - x3] * texture_width), 0), texture_width - 1
+                    )
+                    ty = min(
+                        max(int(v34[x - x3] * texture_height), 0), texture_height - 1
+                    )
+                    for c in range(3):
+                        if lit:
+                            value = texture[tx, ty, c] * scale + offset[c]
+                            display_buffer[x, y, c] = int(min(max(value, 0.0), 255.0))
+                        else:
+                            display_buffer[x, y, c] = texture[tx, ty, c]
+                    drawn += 1
+                else:
+                    rejected += 1
+    return drawn, rejected
+
+
+# clipping_functions.clip_triangles_against_plane, for the triangles (N x 4 x 3)
+# and their attributes (N x K x 3, K may be 0) against a single plane
+# (coefficients 4, strict), triangle by triangle (in order, so no sorting is needed)
+@jit
+def clip_triangles_against_plane_kernel(
+    clip_vertices, attributes, coefficients, strict
+):
+    n, k = len(clip_vertices), attributes.shape[1]
+    distances = np.zeros((n, 3))
+    inside = np.empty((n, 3), dtype=np.bool_)
+    # the number of triangles each triangle is clipped into (0, 1 or 2)
+    total = 0
+    for i in range(n):
+        count = 0
+        for j in range(3):
+            for c in range(4):
+                distances[i, j] += coefficients[c] * clip_vertices[i, c, j]
+            inside[i, j] = distances[i, j] > 0 if strict else distances[i, j] >= 0
+            if inside[i, j]:
+                count += 1
+        total += 0 if count == 0 else (1 if count != 2 else 2)
+
+    new_vertices = np.empty((total, 4, 3))
+    new_attributes = np.empty((total, k, 3))
+    parents = np.empty(total, dtype=np.int64)
+    # the points of the clipped polygon (see clipping_functions.clipped_polygon),
+    # the clip vertex followed by the attributes of each point
+    points = np.empty((4, 4 + k))
+    m = 0
+    for i in range(n):
+        size = 0
+        for j in range(3):
+            following = (j + 1) % 3
+            if inside[i, j]:
+                for c in range(4):
+                    points[size, c] = clip_vertices[i, c, j]
+                for c in range(k):
+                    points[size, 4 + c] = attributes[i, c, j]
+                size += 1
+            if inside[i, j] != inside[i, following]:
+                d0, d1 = distances[i, j], distances[i, following]
+                t = d0 / (d0 - d1)
+                for c in range(4):
+                    a, b = clip_vertices[i, c, j], clip_vertices[i, c, following]
+                    points[size, c] = a + t * (b - a)
+                for c in range(k):
+                    a, b = attributes[i, c, j], attributes[i, c, following]
+                    points[size, 4 + c] = a + t * (b - a)
+                size += 1
+
+        # the triangle (p0, p1, p2), and (p0, p2, p3) of a four sided polygon
+        for triangle in range(size - 2):
+            for corner in range(3):
+                point = 0 if corner == 0 else triangle + corner
+                for c in range(4):
+                    new_vertices[m, c, corner] = points[point, c]
+                for c in range(k):
+                    new_attributes[m, c, corner] = points[point, 4 + c]
+            parents[m] = i
+            m += 1
+    return new_vertices, new_attributes, parents
+
+
+# checks that the kernels draw and clip exactly the same as the numpy versions,
+# on random triangles (partly off the screen, and crossing the clipping planes)
+if __name__ == "__main__":
+    import time
+    from rasterizer import (
+        draw_triangle,
+        draw_textured_triangle,
+        draw_triangle_jit,
+        draw_textured_triangle_jit,
+    )
+    from clipping_functions import clip_triangles
+    from graphics_pipeline import CLIPPING_PLANES
+    from shading import PixelShader
+    from texture import random_texture
+
+    print("numba:", "compiled kernels" if JIT_AVAILABLE else "not installed")
+    rng = np.random.default_rng(0)
+    size, count = 64, 200
+    vertices = np.concatenate(
+        [rng.uniform(-8, size + 8, (count, 2, 3)), rng.uniform(0, 1, (count, 1, 3))],
+        axis=1,
+    )
+    texture_coordinates = rng.uniform(-0.2, 1.2, (count, 2, 3))
+    light_intensities = rng.uniform(0, 0.5, (count, 3))
+    colors = rng.integers(0, 255, (count, 3))
+    texture = random_texture(16, 16)
+    shader = PixelShader(light_direction=np.array([0, 1, 1]))
+
+    # the arguments (after the vertices) of each triangle, for each rasterizer
+    draws = {
+        (draw_triangle, draw_triangle_jit): lambda i, display, z: (
+            display,
+            z,
+            colors[i],
+        ),
+        (draw_textured_triangle, draw_textured_triangle_jit): lambda i, display, z: (
+            texture_coordinates[i],
+            display,
+            z,
+            texture,
+            light_intensities[i],
+            shader,
+        ),
+    }
+    for functions, arguments in draws.items():
+        outputs = []
+        for function in functions:
+            display_buffer = np.zeros((size, size, 3), dtype=np.uint8)
+            z_buffer = np.ones((size, size), dtype=np.float32)
+            begin = time.perf_counter()
+            counts = [
+                function(vertices[i], *arguments(i, display_buffer, z_buffer))
+                for i in range(count)
+            ]
+            elapsed = time.perf_counter() - begin
+            print(f"{function.__name__}: {elapsed * 1000:.1f} ms")
+            outputs.append((display_buffer, z_buffer, counts))
+        (display, z, counts), (display_jit, z_jit, counts_jit) = outputs
+        name = functions[0].__name__
+        assert np.array_equal(display, display_jit), f"{name}: colors differ"
+        assert np.array_equal(z, z_jit), f"{name}: depths differ"
+        assert counts == counts_jit, f"{name}: pixel counts differ"
+
+    clip_vertices = rng.uniform(-2, 2, (count, 4, 3))
+    attributes = rng.uniform(0, 1, (count, 2, 3))
+    for clip_attributes in [attributes, None]:
+        clipped = clip_triangles(
+            clip_vertices, clip_attributes, CLIPPING_PLANES, jit=False
+        )
+        clipped_jit = clip_triangles(
+            clip_vertices, clip_attributes, CLIPPING_PLANES, jit=True
+        )
+        for array, array_jit in zip(clipped, clipped_jit):
+            if array is None:
+                assert array_jit is None, "clipped attributes differ"
+            else:
+                assert np.array_equal(array, array_jit), "clipped triangles differ"
+    print(f"identical results, {len(clipped[0])} triangles after clipping")
@@ -2,15 +2,27 @@ from mesh import load_mesh_from_obj
 from graphics_pipeline import GraphicsPipeline
 from game import Game, WIDTH, HEIGHT
 from camera import Camera
-from shading import PixelShader, init_lighting
+from shading import (
+    Material,
+    PixelShader,
+    LightingShader,
+    DirectionalLight,
+    PointLight,
+)
 from texture import load_texture_from_image
 import numpy as np
 
-
 FOV = np.deg2rad(60)
+# whether to draw the time spent in each stage of the pipeline onto the screen
+SHOW_STATS = False
 
-# initialize the lighting
-init_lighting(ambient=0.4, diffuse=0.4, specular=0.2, specular_exponent=10)
+# how the meshes reflect the light (see shading.Material)
+MATERIAL = Material(ambient=0.4, diffuse=0.4, specular=0.2, specular_exponent=10)
+# the lights of the scene (see shading.LightingShader), eg,
+# [DirectionalLight([0, 1, 1]), PointLight([0, -2, 8], intensity=2, attenuation=0.1)]
+# when empty, the scene is lit by a single light shining in LIGHT_DIRECTION
+LIGHTS = []
+LIGHT_DIRECTION = np.array([0, 1, 1])
 
 if __name__ == "__main__":
     # load the mesh
@@ -25,14 +37,27 @@ if __name__ == "__main__":
 
     # create the camera, shader, game, and graphics pipeline
     camera = Camera(FOV, WIDTH / HEIGHT, 1, 50.0)
-    shader = PixelShader(light_direction=np.array([0, 1, 1]))
+    if LIGHTS:
+        shader = LightingShader(LIGHTS, material=MATERIAL)
+    else:
+        shader = PixelShader(light_direction=LIGHT_DIRECTION, material=MATERIAL)
     game = Game()
-    graphics_pipeline = GraphicsPipeline([mesh], camera, game.screen, shader=shader)
+    # (the scene only moves, so the frames are drawn again only when the camera moves)
+    graphics_pipeline = GraphicsPipeline(
+        [mesh],
+        camera,
+        game.screen,
+        shader=shader,
+        rasterizer="vectorized",
+        incremental=True,
+    )
 
     # add update and draw functions
     game.add_update_func(camera.update)
     game.add_update_func(lambda _: graphics_pipeline.update())
     game.add_draw_func(graphics_pipeline.draw_textured)
+    if SHOW_STATS:
+        game.add_draw_func(graphics_pipeline.draw_stats)
 
     # run the game loop
     game.run()
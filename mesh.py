@@ -1,14 +1,34 @@
+import os
+import itertools
 import numpy as np
-from transformations import translate, rotate, scale, normalize
+from transformations import (
+    translate,
+    rotate,
+    scale,
+    normalize,
+    normalize_vectors,
+    transformation_matrices,
+)
 from copy import copy
+from functools import cached_property
+from bvh import FaceBVH
 
+# the keys of the meshes and instanced meshes (see Mesh.token), unique for the life
+# of the program (unlike id(), which a new mesh may reuse once the old one is freed)
+MESH_KEYS = itertools.count()
 
+
+# a view of a single face of a mesh (the face's data is stored in the mesh's arrays)
+# kept for compatibility, the graphics pipeline works on the mesh's arrays directly
 class Face:
-    def __init__(self, model_vertices, texture_coordinates=None, vertex_indices=None):
-        # storing the indices of the vertices wrt the mesh's vertices array
-        self.vertex_indices = vertex_indices
-        self.model_vertices = model_vertices
-        self.texture_coordinates = texture_coordinates
+    def __init__(self, mesh, index):
+        # store reference to mesh (for accessing the texture, and other properties)
+        self.mesh = mesh
+        # index of the face wrt the mesh's faces
+        self.index = index
+        # overrides the mesh's texture coordinates for this face (eg, after clipping)
+        self._texture_coordinates = None
+
         # world coordinates after model transformation
         self.world_vertices = None
         # coordinates after camera transformation (wrt camera)
@@ -20,11 +40,37 @@ class Face:
         # screen coordinates after viewport transformation
         self.screen_vertices = None
 
-        # setting up some default color
-        self.color = (255, 255, 255)
+    # storing the indices of the vertices wrt the mesh's vertices array
+    @property
+    def vertex_indices(self):
+        return self.mesh.vertex_indices[self.index]
 
-        # store reference to mesh (for accessing the texture, and other properties)
-        self.mesh = None
+    @property
+    def model_vertices(self):
+        return self.mesh.model_vertices[:, self.vertex_indices]
+
+    @property
+    def texture_coordinates(self):
+        if self._texture_coordinates is not None:
+            return self._texture_coordinates
+        if self.mesh.texture_indices is None:
+            return None
+        texture_indices = self.mesh.texture_indices[self.index]
+        if np.any(texture_indices < 0):
+            return None  # the face has no texture coordinates (drawn untextured)
+        return self.mesh.model_texture_coordinates[:, texture_indices]
+
+    @texture_coordinates.setter
+    def texture_coordinates(self, texture_coordinates):
+        self._texture_coordinates = texture_coordinates
+
+    @property
+    def color(self):
+        return self.mesh.colors[self.index]
+
+    @color.setter
+    def color(self, color):
+        self.mesh.colors[self.index] = color
 
     @property
     def world_normal(self):
@@ -37,146 +83,517 @@ class Face:
 
     # clips the face against the specified face in the clip space
     def clip(self, check_inside, get_intersection):
-        # check if the vertex is inside the plane or not for each vertex
-        inside = [check_inside(vertex) for vertex in self.clip_vertices.T]
-        num_inside = sum(inside)  # number of vertices inside the plane
-        if num_inside == 0:
-            return []  # face is completely outside the plane
-        if num_inside == 3:
+        clipped = clip_triangle(
+            self.clip_vertices,
+            self.texture_coordinates,
+            check_inside,
+            get_intersection,
+        )
+        if len(clipped) == 1 and clipped[0][0] is self.clip_vertices:
             return [self]  # face is completely inside the plane
 
-        # face is partially inside the plane (ie, clipped by the plane)
-        cv, tc = self.clip_vertices, self.texture_coordinates
-
-        # compute the new vertices and texture coordinates
-        clipped_v = []  # clipped vertices (ie, vertices are all inside the plane)
-        clipped_tc = []  # clipped texture coordinates
-        for i in range(3):
-            if inside[i]:
-                clipped_v.append(cv[:, i])
-                if tc is not None:
-                    clipped_tc.append(tc[:, i])
-            if inside[i] != inside[(i + 1) % 3]:
-                t = get_intersection(cv[:, i], cv[:, (i + 1) % 3])
-                # v = v0 + t * (v1 - v0)
-                clipped_v.append(cv[:, i] + t * (cv[:, (i + 1) % 3] - cv[:, i]))
-                if tc is not None:
-                    # tc = tc0 + t * (tc1 - tc0)
-                    clipped_tc.append(tc[:, i] + t * (tc[:, (i + 1) % 3] - tc[:, i]))
-
-        # only one vertex is inside the plane
-        # face is formed by the two clipped vertices and the vertex inside the plane
-        if num_inside == 1:
+        faces = []
+        for clip_vertices, texture_coordinates in clipped:
             face = copy(self)
-            face.clip_vertices = np.column_stack(clipped_v)
+            face.clip_vertices = clip_vertices
+            face.texture_coordinates = texture_coordinates
+            faces.append(face)
+        return faces
+
+
+# clips the triangle (given by its clip vertices and texture coordinates)
+# against the specified plane in the clip space
+# returns a list of (clip vertices, texture coordinates) of the triangles inside the plane
+def clip_triangle(clip_vertices, texture_coordinates, check_inside, get_intersection):
+    cv, tc = clip_vertices, texture_coordinates
+    # check if the vertex is inside the plane or not for each vertex
+    inside = [check_inside(vertex) for vertex in cv.T]
+    num_inside = sum(inside)  # number of vertices inside the plane
+    if num_inside == 0:
+        return []  # triangle is completely outside the plane
+    if num_inside == 3:
+        return [(cv, tc)]  # triangle is completely inside the plane
+
+    # triangle is partially inside the plane (ie, clipped by the plane)
+    # compute the new vertices and texture coordinates
+    clipped_v = []  # clipped vertices (ie, vertices are all inside the plane)
+    clipped_tc = []  # clipped texture coordinates
+    for i in range(3):
+        if inside[i]:
+            clipped_v.append(cv[:, i])
             if tc is not None:
-                face.texture_coordinates = np.column_stack(clipped_tc)
-            return [face]
-
-        # two vertices are inside the plane (a four sided polygon is formed)
-        # we split the polygon into two triangles
-        # face1: v0, v1, v2
-        # face2: v0, v2, v3
-        if num_inside == 2:
-            face1, face2 = copy(self), copy(self)
-            v0, v1, v2, v3 = clipped_v
-            face1.clip_vertices = np.column_stack([v0, v1, v2])
-            face2.clip_vertices = np.column_stack([v0, v2, v3])
+                clipped_tc.append(tc[:, i])
+        if inside[i] != inside[(i + 1) % 3]:
+            t = get_intersection(cv[:, i], cv[:, (i + 1) % 3])
+            # v = v0 + t * (v1 - v0)
+            clipped_v.append(cv[:, i] + t * (cv[:, (i + 1) % 3] - cv[:, i]))
             if tc is not None:
-                tc0, tc1, tc2, tc3 = clipped_tc
-                face1.texture_coordinates = np.column_stack([tc0, tc1, tc2])
-                face2.texture_coordinates = np.column_stack([tc0, tc2, tc3])
-            return [face1, face2]
+                # tc = tc0 + t * (tc1 - tc0)
+                clipped_tc.append(tc[:, i] + t * (tc[:, (i + 1) % 3] - tc[:, i]))
+
+    # only one vertex is inside the plane
+    # triangle is formed by the two clipped vertices and the vertex inside the plane
+    if num_inside == 1:
+        return [
+            (
+                np.column_stack(clipped_v),
+                np.column_stack(clipped_tc) if tc is not None else None,
+            )
+        ]
+
+    # two vertices are inside the plane (a four sided polygon is formed)
+    # we split the polygon into two triangles
+    # triangle1: v0, v1, v2
+    # triangle2: v0, v2, v3
+    v0, v1, v2, v3 = clipped_v
+    triangle1 = np.column_stack([v0, v1, v2])
+    triangle2 = np.column_stack([v0, v2, v3])
+    if tc is None:
+        return [(triangle1, None), (triangle2, None)]
+    tc0, tc1, tc2, tc3 = clipped_tc
+    return [
+        (triangle1, np.column_stack([tc0, tc1, tc2])),
+        (triangle2, np.column_stack([tc0, tc2, tc3])),
+    ]
 
 
 class Mesh:
-    def __init__(self, model_vertices, faces):
+    def __init__(
+        self,
+        model_vertices,
+        vertex_indices,
+        model_texture_coordinates=None,
+        texture_indices=None,
+        model_normals=None,
+        normal_indices=None,
+    ):
         # storing all the vertices of the model together
         # to speed up the calculations involving matrix multiplications
         # each column of the matrix is a vertex in homogeneous coordinates (x, y, z, w)
         self.model_vertices = model_vertices
-        self.faces = faces
+        # the faces (triangles) are stored as arrays, so that all the faces
+        # can be processed at once in the graphics pipeline
+        # indices of each face's vertices in model_vertices (F x 3)
+        self.vertex_indices = vertex_indices
+        # all the texture coordinates of the model, each column is (u, v)
+        # and the indices of each face's texture coordinates in them (F x 3)
+        # with -1 for the corners without, the faces with any such corner are drawn
+        # untextured (see textured_faces), both are None if no face has any
+        self.model_texture_coordinates = model_texture_coordinates
+        self.texture_indices = texture_indices
+        # all the vertex normals of the model (from the obj file), each column is a normal
+        # and the indices of each face's normals in them (F x 3), with -1 for the corners
+        # without, both are None if no face has any (see vertex_normals)
+        self.model_normals = model_normals
+        self.normal_indices = normal_indices
+        # color of each face (F x 3), setting up some default color
+        self.colors = np.full((len(vertex_indices), 3), 255, dtype=np.uint8)
         self.texture = None
+        # material of the mesh (see shading.Material), None for the shader's one
+        self.material = None
+        # simplified versions of the mesh, from finer to coarser (see decimation.py)
+        # drawn in place of the mesh when it is small on the screen
+        self.lods = []
+
+        # incremented whenever the position, rotation or scale is set, so that
+        # the graphics pipeline can tell when the mesh has moved (see GraphicsPipeline.update)
+        # note: changing the arrays in place (eg, mesh.position[0] = 1) is not tracked
+        self.key = next(MESH_KEYS)
+        self.version = 0
+        self._world_matrix = None
 
         # position, rotation, scale of the mesh wrt the world
         self.position = np.array([0.0, 0.0, 0.0])
         self.rotation = np.array([0.0, 0.0, 0.0])
         self.scale = np.array([1.0, 1.0, 1.0])
 
-        # store reference to the mesh in each face
-        for face in faces:
-            face.mesh = self
+    # whether each of the faces has texture coordinates (F), or None
+    @property
+    def textured_faces(self):
+        if self.texture_indices is None:
+            return None
+        return np.all(self.texture_indices >= 0, axis=1)
 
+    # texture coordinates of each of the faces (F x 2 x 3), or None
+    # (meaningless for the faces without, see textured_faces)
+    @property
+    def texture_coordinates(self):
+        if self.texture_indices is None:
+            return None
+        return self.model_texture_coordinates[:, self.texture_indices].transpose(
+            1, 0, 2
+        )
+
+    # normals for smooth shading, the normals (N x 3) and the indices of each face's
+    # normals in them (F x 3), the obj file's normals if it has them, else (also at the
+    # corners without) the average of the (area weighted) normals of the faces around
+    # each vertex
+    # the normals face the same side as the faces' normals in the graphics pipeline
+    # computed once, assuming the model vertices don't change
+    @cached_property
+    def vertex_normals(self):
+        v0, v1, v2 = (
+            self.model_vertices[:3, self.vertex_indices[:, i]].T for i in range(3)
+        )
+        face_normals = np.cross(v2 - v0, v1 - v0)
+        averaged = np.zeros((self.model_vertices.shape[1], 3))
+        for i in range(3):
+            np.add.at(averaged, self.vertex_indices[:, i], face_normals)
+        averaged = normalize_vectors(averaged)
+        if self.normal_indices is None:
+            return averaged, self.vertex_indices
+
+        normals = normalize_vectors(self.model_normals.T)
+        has_normal = self.normal_indices >= 0
+        # the obj file's normals may be wound the other way
+        corner_normals = normals[self.normal_indices[has_normal]]
+        corner_face_normals = np.broadcast_to(
+            face_normals[:, np.newaxis], has_normal.shape + (3,)
+        )[has_normal]
+        if np.sum(corner_normals * corner_face_normals) < 0:
+            normals = -normals
+        if np.all(has_normal):
+            return normals, self.normal_indices
+        # the averaged normals (after the obj file's) at the corners without
+        normal_indices = np.where(
+            has_normal, self.normal_indices, len(normals) + self.vertex_indices
+        )
+        return np.concatenate([normals, averaged]), normal_indices
+
+    # sphere (center, radius) enclosing all the vertices in model space
+    # computed once, assuming the model vertices don't change
+    @cached_property
+    def bounding_sphere(self):
+        box_min, box_max = self.bounding_box
+        center = (box_min + box_max) / 2
+        if self.model_vertices[:3].size == 0:
+            return center, 0.0
+        radius = np.linalg.norm(self.model_vertices[:3].T - center, axis=1).max()
+        return center, radius
+
+    # axis aligned box (min corner, max corner) enclosing all the vertices in model space
+    # (a mesh without vertices has the box, and sphere, of just its origin)
+    @cached_property
+    def bounding_box(self):
+        vertices = self.model_vertices[:3]
+        if vertices.size == 0:
+            return np.zeros(3), np.zeros(3)
+        return vertices.min(axis=1), vertices.max(axis=1)
+
+    # bounding volume hierarchy over the faces, built once on first use
+    @cached_property
+    def bvh(self):
+        return FaceBVH(self.model_vertices, self.vertex_indices)
+
+    # views of each of the faces (see Face), created on every access
+    @property
+    def faces(self):
+        return [Face(self, index) for index in range(len(self.vertex_indices))]
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+        self.moved()
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self._rotation = rotation
+        self.moved()
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale = scale
+        self.moved()
+
+    # identifies the mesh and its transformations, for the results kept by the
+    # graphics pipeline (see GraphicsPipeline.scene_state)
+    @property
+    def token(self):
+        return (self.key, self.version)
+
+    def moved(self):
+        self.version += 1
+        self._world_matrix = None
+
+    # computed again only after the mesh has moved
     @property
     def world_matrix(self):
-        # transforms from model space to world space
-        return translate(*self.position) @ rotate(*self.rotation) @ scale(*self.scale)
+        if self._world_matrix is None:
+            # transforms from model space to world space
+            self._world_matrix = (
+                translate(*self.position) @ rotate(*self.rotation) @ scale(*self.scale)
+            )
+        return self._world_matrix
 
 
-def load_mesh_from_obj(filename) -> Mesh:
-    vertices = []
-    faces = []
-    texture_coordinates = []
-    normals = []  # not used in this implementation
+# the same mesh placed many times in the world (instanced rendering), all the instances
+# share the mesh (its geometry, texture and material), and only the position, rotation
+# and scale of each instance (I x 3 each) are stored, the graphics pipeline transforms
+# and culls all the instances at once
+class InstancedMesh:
+    def __init__(self, mesh, positions, rotations=None, scales=None):
+        self.mesh = mesh
+        # incremented whenever the transformations are set (see Mesh.version)
+        self.key = next(MESH_KEYS)
+        self.version = 0
+        self._world_matrices = None
 
-    with open(filename, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            splits = line.strip().split()
-            if not splits:
-                continue
-            if splits[0] == "v":
-                # x, y, z, (w=1.0)
-                vertex = list(map(float, splits[1:]))
-                if len(vertex) == 3:
-                    vertex.append(1.0)
-                vertices.append(vertex)
-            elif splits[0] == "vt":
-                # u, v
-                texture_coordinate = list(map(float, splits[1:]))
-                texture_coordinates.append(texture_coordinate)
-            elif splits[0] == "vn":
-                normals.append(list(map(float, splits[1:])))
-            elif splits[0] == "f":
-                # face can be in the following formats:
-                # f v1 v2 v3 ....
-                # f v1/vt1 v2/vt2 v3/vt3 ....
-                # f v1/vt1/vn1 v2/vt2/vn2 v3/vt3/vn3 ....
-                # f v1//vn1 v2//vn2 v3//vn3 ....
-                face = []
-                for vertex in splits[1:]:
-                    vertex = vertex.split("/")
-                    indices = {"v": None, "vt": None, "vn": None}
-                    indices["v"] = int(vertex[0]) - 1
-                    if len(vertex) > 1 and vertex[1] != "":
-                        indices["vt"] = int(vertex[1]) - 1
-                    if len(vertex) > 2:
-                        indices["vn"] = int(vertex[2]) - 1
-
-                    face.append(indices)
-
-                if len(face) == 3:
-                    faces.append(face)
-                elif len(face) > 3:
-                    # triangulate the face
-                    for i in range(1, len(face) - 1):
-                        faces.append([face[0], face[i], face[i + 1]])
-    mesh_faces = []
-    for face in faces:
-        face_vertex_indices = [v["v"] for v in face]
-        face_model_vertices = np.array([vertices[v["v"]] for v in face]).T
-        face_texture = None
-        if all(v["vt"] is not None for v in face):
-            face_texture = np.array([texture_coordinates[v["vt"]] for v in face]).T
-        mesh_faces.append(
-            Face(
-                model_vertices=face_model_vertices,
-                texture_coordinates=face_texture,
-                vertex_indices=face_vertex_indices,
+        positions = np.asarray(positions, dtype=float)
+        self.positions = positions
+        self.rotations = (
+            np.zeros_like(positions)
+            if rotations is None
+            else np.asarray(rotations, dtype=float)
+        )
+        self.scales = (
+            np.ones_like(positions)
+            if scales is None
+            else np.asarray(scales, dtype=float)
+        )
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @positions.setter
+    def positions(self, positions):
+        self._positions = positions
+        self.moved()
+
+    @property
+    def rotations(self):
+        return self._rotations
+
+    @rotations.setter
+    def rotations(self, rotations):
+        self._rotations = rotations
+        self.moved()
+
+    @property
+    def scales(self):
+        return self._scales
+
+    @scales.setter
+    def scales(self, scales):
+        self._scales = scales
+        self.moved()
+
+    # identifies the instanced mesh and its transformations, for the results kept by the
+    # graphics pipeline (see GraphicsPipeline.scene_state)
+    @property
+    def token(self):
+        return (self.key, self.version)
+
+    def moved(self):
+        self.version += 1
+        self._world_matrices = None
+
+    # transforms from model space to world space, for each instance (I x 4 x 4)
+    # computed again only after the instances have moved
+    @property
+    def world_matrices(self):
+        if self._world_matrices is None:
+            assert (
+                self.positions.shape == self.rotations.shape == self.scales.shape
+            ), "the instances need a position, rotation and scale each"
+            self._world_matrices = transformation_matrices(
+                self.positions, self.rotations, self.scales
             )
+        return self._world_matrices
+
+
+# parses the numbers on the lines (after the keyword) into an array with a row per line
+# only the first num_columns numbers of each line are kept, missing ones are filled with fill
+def parse_obj_numbers(lines, num_columns, fill=0.0, dtype=float):
+    if not lines:
+        return np.zeros((0, num_columns), dtype=dtype)
+    # fast path: all the lines have the same number of values,
+    # so all the numbers are parsed at once
+    values = [line.split()[1:] for line in lines]
+    line_size = len(values[0])
+    if all(len(line_values) == line_size for line_values in values):
+        rows = np.array(values, dtype=dtype).reshape(len(lines), line_size)
+    else:
+        rows = np.array(
+            [
+                (line_values + [fill] * num_columns)[:num_columns]
+                for line_values in values
+            ],
+            dtype=dtype,
         )
+    if rows.shape[1] < num_columns:
+        padding = np.full((len(lines), num_columns - rows.shape[1]), fill)
+        rows = np.hstack([rows, padding])
+    return rows[:, :num_columns]
+
+
+# parses the face lines into the (v, vt, vn) indices of each corner of each triangle
+# faces with more than 3 corners are triangulated (as a fan around the first corner)
+# the numbers of v, vt and vn (that negative indices are relative to) are those defined
+# before each of the lines (arrays, one for each line), or the same for all of them
+# returns an array (T x 3 x 3) of 0-based indices, with -1 for missing vt or vn
+def parse_obj_faces(lines, num_vertices, num_texture_coordinates, num_normals):
+    if not lines:
+        return np.zeros((0, 3, 3), dtype=int)
+
+    # face can be in the following formats:
+    # f v1 v2 v3 ....
+    # f v1/vt1 v2/vt2 v3/vt3 ....
+    # f v1/vt1/vn1 v2/vt2/vn2 v3/vt3/vn3 ....
+    # f v1//vn1 v2//vn2 v3//vn3 ....
+    faces = [line.split()[1:] for line in lines]
+    sizes = np.array([len(face) for face in faces])
+    corners = [corner for face in faces for corner in face]
+
+    # fast path: all the corners are in the same format (the same number of fields),
+    # so all the indices are parsed at once (missing indices are parsed as 0)
+    slashes = corners[0].count("/")
+    same_format = all(corner.count("/") == slashes for corner in corners)
+    num_fields = slashes + 1
+    fields = "/".join(corners).replace("//", "/0/").split("/") if same_format else []
+    if same_format and len(fields) == num_fields * len(corners):
+        indices = np.array(fields, dtype=int).reshape(-1, num_fields)
+    else:
+        indices = np.array(
+            [
+                [int(field or 0) for field in (corner.split("/") + ["", ""])[:3]]
+                for corner in corners
+            ]
+        )
+    if indices.shape[1] < 3:
+        padding = np.zeros((len(corners), 3 - indices.shape[1]), dtype=int)
+        indices = np.hstack([indices, padding])
+
+    # obj indices are 1-based, and negative indices are relative to the end
+    # (of those defined before the face), 0 marks a missing index, which becomes -1
+    counts = np.column_stack(
+        np.broadcast_arrays(
+            num_vertices, num_texture_coordinates, num_normals, np.empty(len(lines))
+        )[:3]
+    )
+    counts = np.repeat(counts, sizes, axis=0)
+    indices = np.where(indices < 0, indices + counts, indices - 1)
+
+    # triangulate the faces, each face gives (size - 2) triangles
+    # triangle i of the face is formed by the corners 0, i + 1, i + 2
+    num_triangles = sizes - 2
+    face_start = np.repeat(np.cumsum(sizes) - sizes, num_triangles)
+    triangle_start = np.cumsum(num_triangles) - num_triangles
+    i = np.arange(num_triangles.sum()) - np.repeat(triangle_start, num_triangles)
+    triangles = np.column_stack([face_start, face_start + i + 1, face_start + i + 2])
+    return indices[triangles]
+
 
-    mesh = Mesh(model_vertices=np.array(vertices).T, faces=mesh_faces)
+# the cached (binary) version of the obj file is stored next to it
+MESH_CACHE_VERSION = 5
+
+
+def mesh_cache_filename(filename):
+    return f"{filename}.npz"
+
+
+# the cache is valid only if it was created from the same version of the obj file
+def mesh_cache_key(filename):
+    stat = os.stat(filename)
+    return np.array([MESH_CACHE_VERSION, stat.st_mtime_ns, stat.st_size])
+
+
+def load_mesh_cache(filename):
+    try:
+        with np.load(mesh_cache_filename(filename)) as cache:
+            if not np.array_equal(cache["key"], mesh_cache_key(filename)):
+                return None
+            return {name: cache[name] for name in cache.files if name != "key"}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_mesh_cache(filename, arrays):
+    cache_filename = mesh_cache_filename(filename)
+    temporary_filename = f"{cache_filename}.{os.getpid()}.tmp.npz"
+    try:
+        np.savez(temporary_filename, key=mesh_cache_key(filename), **arrays)
+        os.replace(temporary_filename, cache_filename)
+    except OSError:
+        pass  # caching is optional (eg, the directory may be read only)
+
+
+def parse_obj(filename):
+    # group the lines by their keyword (other lines are ignored)
+    lines = {"v": [], "vt": [], "vn": [], "f": []}
+    vertex_lines, face_lines = lines["v"], lines["f"]
+    # the numbers of v, vt and vn defined before each face
+    # (negative indices of the face are relative to those)
+    face_counts = []
+    with open(filename, "r") as f:
+        for line in f:
+            splits = line.split(None, 1)
+            if splits and splits[0] in lines:
+                lines[splits[0]].append(line)
+                if splits[0] == "f":
+                    face_counts.append(
+                        (len(vertex_lines), len(lines["vt"]), len(lines["vn"]))
+                    )
+    face_counts = np.array(face_counts, dtype=int).reshape(-1, 3)
+
+    # x, y, z, (w=1.0), a line with more values is x, y, z and a color (r, g, b),
+    # not w (decided line by line, as the lines may differ)
+    values = parse_obj_numbers(vertex_lines, 6, fill=np.nan)
+    vertices = np.where(np.isnan(values[:, :4]), 1.0, values[:, :4])
+    vertices[~np.isnan(values[:, 5]), 3] = 1.0
+    # u, v
+    texture_coordinates = parse_obj_numbers(lines["vt"], 2)
+    normals = parse_obj_numbers(lines["vn"], 3)
+
+    triangles = parse_obj_faces(face_lines, *face_counts.T)
+    arrays = {
+        "model_vertices": vertices.T,
+        "vertex_indices": triangles[:, :, 0],
+    }
+    # texture coordinates and normals, if any of the faces have them
+    # (-1 at the corners without, see Mesh.texture_indices)
+    if np.any(triangles[:, :, 1] >= 0):
+        arrays["model_texture_coordinates"] = texture_coordinates.T
+        arrays["texture_indices"] = triangles[:, :, 1]
+    if np.any(triangles[:, :, 2] >= 0):
+        arrays["model_normals"] = normals.T
+        arrays["normal_indices"] = triangles[:, :, 2]
+    return arrays
+
+
+# loads the mesh from the wavefront obj file
+# the parsed mesh is cached in a binary file next to the obj file,
+# so that later loads (of the unchanged obj file) skip parsing entirely
+def load_mesh_from_obj(filename, use_cache=True) -> Mesh:
+    arrays = load_mesh_cache(filename) if use_cache else None
+    if arrays is None:
+        arrays = parse_obj(filename)
+        if use_cache:
+            save_mesh_cache(filename, arrays)
+
+    mesh = Mesh(
+        model_vertices=arrays["model_vertices"],
+        vertex_indices=arrays["vertex_indices"],
+        model_texture_coordinates=arrays.get("model_texture_coordinates"),
+        texture_indices=arrays.get("texture_indices"),
+        model_normals=arrays.get("model_normals"),
+        normal_indices=arrays.get("normal_indices"),
+    )
     return mesh
 
 
@@ -190,3 +607,104 @@ if __name__ == "__main__":
         print("model vertices:\n", face.model_vertices)
         print("texture coordinates:\n", face.texture_coordinates)
         print("vertex indices:", face.vertex_indices)
+
+    import tempfile
+
+    # lines in different formats (whose numbers of fields still add up to a multiple
+    # of those of the first line) are parsed line by line, not misaligned
+    faces = parse_obj_faces(["f 1/1 2 3/3/1", "f 2/2 4/1 3/3"], 4, 3, 1)
+    assert np.array_equal(faces[:, :, 1], [[0, -1, 2], [1, 0, 2]]), faces[:, :, 1]
+    assert np.array_equal(faces[:, :, 2], [[-1, -1, 0], [-1, -1, -1]]), faces
+    numbers = parse_obj_numbers(["v 1 2 3 4 5", "v 6 7", "v 8 9 10"], 4, fill=1.0)
+    assert np.array_equal(numbers, [[1, 2, 3, 4], [6, 7, 1, 1], [8, 9, 10, 1]])
+
+    # negative indices are relative to the v (vt, vn) defined before the face,
+    # and each vertex line is x, y, z (w) or x, y, z and a color by its own values
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "blocks.obj")
+        with open(filename, "w") as f:
+            f.write("v 0 0 0\nv 1 0 0 0.5\nv 0 1 0\nf -3 -2 -1\n")
+            f.write("v 2 0 0 0.7 0.2 0.3\nv 3 0 0 2\nv 2 1 0\nf -3 -2 -1\nf 1 2 -1\n")
+        arrays = parse_obj(filename)
+    assert np.array_equal(arrays["vertex_indices"], [[0, 1, 2], [3, 4, 5], [0, 1, 5]])
+    assert np.array_equal(arrays["model_vertices"][3], [1, 0.5, 1, 1, 2, 1])
+
+    # a mesh without vertices (like that of an empty obj file) has bounds,
+    # so that culling it (as the pipeline does by default) draws nothing
+    import pygame
+    from camera import Camera
+    from graphics_pipeline import GraphicsPipeline
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "empty.obj")
+        open(filename, "w").close()
+        empty = load_mesh_from_obj(filename, use_cache=False)
+    assert empty.bounding_sphere[1] == 0.0
+    for options in [{}, {"rasterizer": "vectorized", "deferred": True}]:
+        pipeline = GraphicsPipeline(
+            [empty],
+            Camera(np.deg2rad(60), 1.0, 0.1, 50.0, verbose=False),
+            pygame.Surface((32, 32)),
+            **options,
+        )
+        pipeline.update()
+        pipeline.draw()
+        assert sum(len(batch) for batch in pipeline.faces_to_draw) == 0
+    print("\nempty mesh: nothing drawn")
+
+    # the faces without texture coordinates (or normals) don't drop those of the others,
+    # they are drawn untextured (white), and the others textured, in every draw path
+    from shading import PixelShader
+    from texture import random_texture
+
+    with open("models/cube.obj") as f:
+        lines = f.read().splitlines()
+    face_lines = [line for line in lines if line.startswith("f ")]
+    mixed_lines = [line for line in lines if not line.startswith("f ")] + ["vn 0 0 1"]
+    for i, line in enumerate(face_lines):
+        if i % 2 == 0:
+            # only the vertex, and a normal
+            corners = [corner.split("/")[0] for corner in line.split()[1:]]
+            line = "f " + " ".join(f"{corner}//1" for corner in corners)
+        mixed_lines.append(line)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "mixed.obj")
+        with open(filename, "w") as f:
+            f.write("\n".join(mixed_lines) + "\n")
+        mixed = load_mesh_from_obj(filename, use_cache=False)
+    assert np.array_equal(mixed.textured_faces, np.arange(len(face_lines)) % 2 == 1)
+    assert mixed.faces[0].texture_coordinates is None
+    assert mixed.faces[1].texture_coordinates is not None
+    normals, normal_indices = mixed.vertex_normals
+    assert np.all(normal_indices >= 0) and len(normals) == 1 + 8
+
+    texture = random_texture(16, 16)
+    for options in [
+        {},
+        {"rasterizer": "vectorized"},
+        {"rasterizer": "fixed"},
+        {"rasterizer": "vectorized", "deferred": True, "shading": "gouraud"},
+        {"rasterizer": "vectorized", "depth_prepass": True},
+        {"rasterizer": "vectorized", "workers": 2},
+    ]:
+        images = []
+        for mesh in [load_mesh_from_obj("models/cube.obj"), mixed]:
+            mesh.texture = texture
+            mesh.position = np.array([0.3, 0.2, 2.0])
+            mesh.rotation = np.array([0.5, 0.6, 0.1])
+            pipeline = GraphicsPipeline(
+                [mesh],
+                Camera(np.deg2rad(60), 1.0, 0.1, 50.0, verbose=False),
+                pygame.Surface((64, 64)),
+                shader=PixelShader(light_direction=np.array([0, 1, 1])),
+                **options,
+            )
+            pipeline.update()
+            pipeline.draw_textured()
+            images.append(pygame.surfarray.array3d(pipeline.screen))
+            pipeline.close()
+        textured, untextured = images
+        different = (textured != untextured).any(axis=2)
+        assert 0 < np.count_nonzero(different) < np.count_nonzero(textured.any(axis=2))
+        assert np.all(untextured[different] == 255), options
+    print("faces without texture coordinates: drawn untextured")
@@ -1,8 +1,12 @@
 import numpy as np
+from kernels import JIT_AVAILABLE, draw_triangle_kernel, draw_textured_triangle_kernel
+from shading import PixelShader
 
 
 # draws the triangle defined by the vertices (and the color) onto the display buffer,
 # using the z-buffer for identifying the visible pixels
+# (all the rasterizers return the number of pixels drawn, and of pixels of the triangle
+# that failed the depth test, ie, hidden behind the previously drawn triangles)
 def draw_triangle(vertices, display_buffer, z_buffer, color):
     # assuming vertices are in screen space (ie, face.screen_vertices)
 
@@ -24,6 +28,7 @@ def draw_triangle(vertices, display_buffer, z_buffer, color):
     z02 = np.linspace(z0, z2, y2 - y0 + 1)
     z12 = np.linspace(z1, z2, y2 - y1 + 1)
 
+    drawn, rejected = 0, 0
     for y in range(y0, y2 + 1):
         if y < y1:
             # top half of the triangle
@@ -48,8 +53,15 @@ def draw_triangle(vertices, display_buffer, z_buffer, color):
                     # update the z-buffer and display buffer
                     z_buffer[x, y] = z
                     display_buffer[x, y] = color
+                    drawn += 1
+                else:
+                    rejected += 1
+    return drawn, rejected
 
 
+# derivatives: the derivatives the level of detail of a mipmapped texture is computed from
+# (see texture_lod_derivatives), computed from the vertices if not given (the tiled
+# renderer gives them, as it draws the triangles with their vertices truncated)
 def draw_textured_triangle(
     vertices,
     texture_coordinates,
@@ -58,16 +70,18 @@ def draw_textured_triangle(
     texture,
     light_intensity=(1.0, 0.0, 0.0),
     shader=None,
+    derivatives=None,
 ):
     # assuming vertices are in screen space (ie, face.screen_vertices)
     # and texture_coordinates are in texture space (ie, face.texture_coordinates)
 
     if texture_coordinates is None or texture is None:
         # no texture or texture coordinates, just draw the triangle
-        draw_triangle(vertices, display_buffer, z_buffer, (255, 255, 255))
-        return
+        return draw_triangle(vertices, display_buffer, z_buffer, (255, 255, 255))
 
     width, height, _ = display_buffer.shape
+    # the texture is sampled at the level of detail of the whole triangle
+    lod = triangle_level_of_detail(texture, vertices, texture_coordinates, derivatives)
 
     # sort vertices based on y-coordinate
     order = np.argsort(vertices[1])
@@ -98,6 +112,7 @@ def draw_textured_triangle(
     v02 = np.linspace(v0, v2, y2 - y0 + 1)
     v12 = np.linspace(v1, v2, y2 - y1 + 1)
 
+    drawn, rejected = 0, 0
     for y in range(y0, y2 + 1):
         if y < y1:
             # top half of the triangle
@@ -121,17 +136,626 @@ def draw_textured_triangle(
         z34 = np.linspace(z3, z4, x4 - x3 + 1)
         u34 = np.linspace(u3, u4, x4 - x3 + 1)
         v34 = np.linspace(v3, v4, x4 - x3 + 1)
+        # the pixels of the line (from x3) to texture, all at once after the depth test
+        span = []
         for x in range(x3, x4 + 1):
             z = z34[x - x3]
-            u = u34[x - x3]
-            v = v34[x - x3]
             # make sure x and y are within the screen
             if 0 <= x < width and 0 <= y < height:
                 # if the pixel is closer to the camera than the previous one
                 if z < z_buffer[x, y]:
-                    # update the z-buffer and display buffer
+                    # update the z-buffer, and texture the pixel
                     z_buffer[x, y] = z
-                    color = texture.sample(u, v)
-                    if shader is not None:
-                        color = shader.get_color(*light_intensity, color)
-                    display_buffer[x, y] = color
+                    span.append(x - x3)
+                    drawn += 1
+                else:
+                    rejected += 1
+        if span:
+            colors = texture.sample_many(u34[span], v34[span], lod)
+            if shader is not None:
+                colors = shader.get_color(*light_intensity, colors)
+            display_buffer[np.array(span) + x3, y] = colors
+    return drawn, rejected
+
+
+# same as draw_triangle (exactly the same pixels, depths and colors), but rasterized by
+# the jit compiled kernel (see kernels.py), used instead of draw_triangle if numba is installed
+def draw_triangle_jit(vertices, display_buffer, z_buffer, color):
+    order = np.argsort(vertices[1])
+    return draw_triangle_kernel(
+        vertices[:, order].astype(np.float64),
+        display_buffer,
+        z_buffer,
+        np.asarray(color).astype(display_buffer.dtype),
+    )
+
+
+# same as draw_textured_triangle, but rasterized by the jit compiled kernel (see kernels.py)
+# the kernel only samples the nearest texel, and lights like PixelShader.get_color,
+# the other textures and shaders are drawn by draw_textured_triangle
+def draw_textured_triangle_jit(
+    vertices,
+    texture_coordinates,
+    display_buffer,
+    z_buffer,
+    texture,
+    light_intensity=(1.0, 0.0, 0.0),
+    shader=None,
+    derivatives=None,
+):
+    if texture_coordinates is None or texture is None:
+        return draw_triangle_jit(vertices, display_buffer, z_buffer, (255, 255, 255))
+    if texture.filtering != "nearest" or (
+        shader is not None and type(shader).get_color is not PixelShader.get_color
+    ):
+        return draw_textured_triangle(
+            vertices,
+            texture_coordinates,
+            display_buffer,
+            z_buffer,
+            texture,
+            light_intensity,
+            shader,
+            derivatives,
+        )
+
+    # the color of each texel is lit as texel * scale + offset (see PixelShader.get_color)
+    scale, offset = 1.0, np.zeros(3)
+    if shader is not None:
+        ambient, diffuse, specular = light_intensity
+        scale = float(ambient + diffuse)
+        offset = np.array(shader.light_color) * specular
+    order = np.argsort(vertices[1])
+    return draw_textured_triangle_kernel(
+        vertices[:, order].astype(np.float64),
+        texture_coordinates[:, order].astype(np.float64),
+        display_buffer,
+        z_buffer,
+        texture.texture,
+        shader is not None,
+        scale,
+        offset.astype(np.float64),
+    )
+
+
+# the vertices are snapped to 1 / SUBPIXEL_STEPS of a pixel by the fixed point rasterizer
+SUBPIXEL_STEPS = 16
+
+
+# fixed point scanline rasterization, the spans of the pixels covered by the triangle,
+# row by row, found by stepping integer edge functions, with the vertices snapped to
+# sub-pixel precision, and pixels covered if their centers are inside the triangle
+# pixel centers exactly on an edge are covered only by a top or left edge (top-left rule)
+# so the pixels along an edge shared by two triangles are covered by exactly one of them
+# attributes: the values at the vertices to interpolate (each a row of 3, eg, the depths)
+# yields y, the first and last x of the span, the attributes at the first pixel
+# of the span, and the steps of the attributes from one pixel to the next
+# (the spans are clipped to the screen, of the given size)
+def triangle_spans(vertices, attributes, width, height):
+    # vertices in fixed point, as python integers (so the edge functions are exact)
+    xs = [round(x * SUBPIXEL_STEPS) for x in vertices[0].tolist()]
+    ys = [round(y * SUBPIXEL_STEPS) for y in vertices[1].tolist()]
+    attributes = [list(values) for values in np.asarray(attributes).tolist()]
+
+    # twice the signed area of the triangle, the vertices are ordered so that
+    # it is positive (clockwise on the screen, as y points down)
+    area = (xs[1] - xs[0]) * (ys[2] - ys[0]) - (xs[2] - xs[0]) * (ys[1] - ys[0])
+    if area == 0:
+        return  # degenerate triangle (covers no area)
+    if area < 0:
+        area = -area
+        xs[1], xs[2] = xs[2], xs[1]
+        ys[1], ys[2] = ys[2], ys[1]
+        for values in attributes:
+            values[1], values[2] = values[2], values[1]
+
+    # rows of the pixels whose centers may be inside the triangle
+    half = SUBPIXEL_STEPS // 2
+    y_start = max(min(ys) // SUBPIXEL_STEPS, 0)
+    y_end = min(max(ys) // SUBPIXEL_STEPS, height - 1)
+
+    # the edge function of each edge (of the vertex opposite to it), at the center of the
+    # first pixel of the row, and its steps from one pixel to the next along x and y
+    # the edge function is proportional to the barycentric weight of the opposite vertex
+    values, steps_x, steps_y, biases = [], [], [], []
+    for a, b in ((1, 2), (2, 0), (0, 1)):
+        dx, dy = xs[b] - xs[a], ys[b] - ys[a]
+        values.append(
+            dx * (y_start * SUBPIXEL_STEPS + half - ys[a]) - dy * (half - xs[a])
+        )
+        steps_x.append(-dy * SUBPIXEL_STEPS)
+        steps_y.append(dx * SUBPIXEL_STEPS)
+        # the centers on a top edge (horizontal, with the triangle below it) or
+        # a left edge (going up) are inside, those on the other edges are not
+        top_left = dy < 0 or (dy == 0 and dx > 0)
+        biases.append(0 if top_left else -1)
+
+    # the steps of the attributes along x (constant across the triangle)
+    deltas = [
+        sum(step * value for step, value in zip(steps_x, values_at_vertices)) / area
+        for values_at_vertices in attributes
+    ]
+
+    for y in range(y_start, y_end + 1):
+        # the range of x where all the (biased) edge functions are non negative
+        x_first, x_last = 0, width - 1
+        for value, step, bias in zip(values, steps_x, biases):
+            if step > 0:
+                x_first = max(x_first, -((value + bias) // step))
+            elif step < 0:
+                x_last = min(x_last, (value + bias) // -step)
+            elif value + bias < 0:
+                x_last = -1  # the row is outside the edge
+        if x_first <= x_last:
+            # the attributes at the first pixel, from the barycentric weights there
+            weights = [value + step * x_first for value, step in zip(values, steps_x)]
+            starts = [
+                sum(
+                    weight * value for weight, value in zip(weights, values_at_vertices)
+                )
+                / area
+                for values_at_vertices in attributes
+            ]
+            yield y, x_first, x_last, starts, deltas
+        values = [value + step for value, step in zip(values, steps_y)]
+
+
+# same as draw_triangle, but with fixed point edge stepping (see triangle_spans),
+# so that the triangles sharing an edge neither overlap nor leave gaps between them,
+# and the depth is stepped incrementally along each span (no arrays are allocated)
+# note: the pixels covered differ from draw_triangle along the edges, as the vertices
+# keep their sub-pixel positions (instead of being truncated to whole pixels)
+def draw_triangle_fixed(vertices, display_buffer, z_buffer, color):
+    width, height, _ = display_buffer.shape
+    drawn, rejected = 0, 0
+    for y, x_first, x_last, (z,), (dz,) in triangle_spans(
+        vertices, vertices[2:3], width, height
+    ):
+        for x in range(x_first, x_last + 1):
+            if z < z_buffer[x, y]:
+                z_buffer[x, y] = z
+                display_buffer[x, y] = color
+                drawn += 1
+            else:
+                rejected += 1
+            z += dz
+    return drawn, rejected
+
+
+# same as draw_textured_triangle, with fixed point edge stepping (see draw_triangle_fixed)
+# the depth and texture coordinates are stepped incrementally along each span
+# (the pixels of each span are textured at once, see draw_textured_triangle)
+def draw_textured_triangle_fixed(
+    vertices,
+    texture_coordinates,
+    display_buffer,
+    z_buffer,
+    texture,
+    light_intensity=(1.0, 0.0, 0.0),
+    shader=None,
+    derivatives=None,
+):
+    if texture_coordinates is None or texture is None:
+        # no texture or texture coordinates, just draw the triangle
+        return draw_triangle_fixed(vertices, display_buffer, z_buffer, (255, 255, 255))
+
+    width, height, _ = display_buffer.shape
+    lod = triangle_level_of_detail(texture, vertices, texture_coordinates, derivatives)
+    attributes = np.vstack([vertices[2:3], texture_coordinates])
+    drawn, rejected = 0, 0
+    for y, x_first, x_last, (z, u, v), (dz, du, dv) in triangle_spans(
+        vertices, attributes, width, height
+    ):
+        xs, us, vs = [], [], []
+        for x in range(x_first, x_last + 1):
+            if z < z_buffer[x, y]:
+                z_buffer[x, y] = z
+                xs.append(x)
+                us.append(u)
+                vs.append(v)
+                drawn += 1
+            else:
+                rejected += 1
+            z += dz
+            u += du
+            v += dv
+        if xs:
+            colors = texture.sample_many(np.array(us), np.array(vs), lod)
+            if shader is not None:
+                colors = shader.get_color(*light_intensity, colors)
+            display_buffer[xs, y] = colors
+    return drawn, rejected
+
+
+# computes the pixels covered by the triangle (in screen space) using edge functions,
+# evaluated over the triangle's bounding box (clipped to the screen) all at once
+# returns the bounding box region (as slices into the buffers), the mask of covered pixels
+# and the barycentric weights of every pixel in the region, or None if nothing is covered
+def triangle_coverage(vertices, width, height):
+    # vertices are truncated to integer pixels, same as the scanline rasterizer,
+    # so that both rasterizers agree on which pixels are covered
+    x0, x1, x2 = (int(x) for x in vertices[0])
+    y0, y1, y2 = (int(y) for y in vertices[1])
+
+    # bounding box of the triangle, clipped to the screen
+    x_min, x_max = max(min(x0, x1, x2), 0), min(max(x0, x1, x2), width - 1)
+    y_min, y_max = max(min(y0, y1, y2), 0), min(max(y0, y1, y2), height - 1)
+    if x_min > x_max or y_min > y_max:
+        return None  # triangle is completely off the screen
+
+    # twice the signed area of the triangle
+    area = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+    if area == 0:
+        return None  # degenerate triangle (covers no area)
+
+    # pixel coordinates of the bounding box, indexed as [x, y] like the buffers
+    px = np.arange(x_min, x_max + 1)[:, np.newaxis]
+    py = np.arange(y_min, y_max + 1)[np.newaxis, :]
+
+    # edge functions, each is proportional to the barycentric weight
+    # of the vertex opposite to the edge (and positive inside the triangle)
+    w0 = ((x2 - x1) * (py - y1) - (y2 - y1) * (px - x1)) / area
+    w1 = ((x0 - x2) * (py - y2) - (y0 - y2) * (px - x2)) / area
+    w2 = 1.0 - w0 - w1
+
+    inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+    region = (slice(x_min, x_max + 1), slice(y_min, y_max + 1))
+    return region, inside, np.stack([w0, w1, w2])
+
+
+# same as draw_triangle, but fills the whole triangle with numpy array operations
+# instead of visiting each pixel in python
+# with a shader, the color is lit at each pixel by the light intensities at the pixel,
+# interpolated from the intensities at each vertex (3 x 3, a column per vertex) across
+# the triangle (gouraud shading, lit like draw_textured_triangle_vectorized lights texels)
+# note: the covered pixels and depths match draw_triangle, except along the triangle's edges,
+# where the two may differ by a pixel (draw_triangle rounds the edges to pixels row by row),
+# and depths may differ by floating point error (at most ~1e-6)
+# the vertices can also have 1 / w of each vertex as a 4th row (4 x 3), for interpolating
+# the intensities (and the texture coordinates, ...) perspective correct
+# (see attribute_weights)
+def draw_triangle_vectorized(
+    vertices, display_buffer, z_buffer, color, light_intensity=None, shader=None
+):
+    width, height, _ = display_buffer.shape
+    coverage = triangle_coverage(vertices, width, height)
+    if coverage is None:
+        return 0, 0
+    region, inside, weights = coverage
+
+    # interpolate the depth at each pixel
+    z = np.tensordot(vertices[2], weights, axes=1)
+
+    # depth test, the pixels which are inside the triangle
+    # and closer to the camera than the previous ones
+    visible = inside & (z < z_buffer[region])
+
+    z_buffer[region][visible] = z[visible]
+    if shader is not None:
+        pixel_weights = attribute_weights(vertices, weights[:, visible])
+        color = shader.get_color(
+            *interpolate_light(light_intensity, pixel_weights), color
+        )
+    display_buffer[region][visible] = color
+    drawn = np.count_nonzero(visible)
+    return drawn, np.count_nonzero(inside) - drawn
+
+
+# the barycentric weights (3 x P) of the pixels for interpolating the vertices' attributes,
+# the screen space weights, unless the vertices have 1 / w (the 4th row), then they are
+# perspective correct: the attributes over w and 1 / w are linear on the screen
+# (the attributes are not), so the weights over w are normalized by the interpolated 1 / w
+# (the depths are linear on the screen, and are interpolated by the screen space weights)
+def attribute_weights(vertices, weights):
+    if len(vertices) < 4:
+        return weights
+    weights = weights * vertices[3][:, np.newaxis]
+    return weights / weights.sum(axis=0)
+
+
+# the light intensities (ambient, diffuse, specular) at the pixels (of the weights 3 x P),
+# the triangle's intensities if they are the same for the whole triangle (3),
+# else interpolated from the intensities at the vertices (3 x 3, a column per vertex,
+# or 3 x 3 x P, those of each pixel's triangle, see GraphicsPipeline.shade_gbuffer)
+# summed vertex by vertex (unlike a matrix product, whose order of summing may differ),
+# so that the forward and the deferred paths light the pixels exactly the same
+def interpolate_light(light_intensity, weights):
+    if np.ndim(light_intensity) == 1:
+        return light_intensity
+    if np.ndim(light_intensity) == 2:
+        light_intensity = light_intensity[:, :, np.newaxis]
+    return (
+        light_intensity[:, 0] * weights[0]
+        + light_intensity[:, 1] * weights[1]
+        + light_intensity[:, 2] * weights[2]
+    )[:, :, np.newaxis]
+
+
+# the derivatives of the texture coordinates along the screen's x and y (... x 2 x 2,
+# [u, v] x [x, y]) of the triangles (vertices ... x 3 x 3, texture coordinates ... x 2 x 3),
+# constant across each triangle, as the texture coordinates are interpolated linearly
+# (infinite or nan for the triangles with no area)
+def texture_derivatives(vertices, texture_coordinates):
+    # the edges from the first vertex, in screen space and in texture space (as columns)
+    screen_edges = vertices[..., :2, 1:] - vertices[..., :2, :1]
+    texture_edges = texture_coordinates[..., :, 1:] - texture_coordinates[..., :, :1]
+    # texture_edges = derivatives @ screen_edges, by the inverse of the 2 x 2 screen edges
+    a, b = screen_edges[..., 0, 0], screen_edges[..., 0, 1]
+    c, d = screen_edges[..., 1, 0], screen_edges[..., 1, 1]
+    adjugate = np.stack([np.stack([d, -b], -1), np.stack([-c, a], -1)], -2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return texture_edges @ adjugate / (a * d - b * c)[..., np.newaxis, np.newaxis]
+
+
+# the derivatives along the screen's x and y the level of detail of the triangles
+# (... x 3 x 3) is computed from (see sample_triangle_texture), of the texture coordinates
+# (... x 2 x 2), or with perspective correct vertices (... x 4 x 3, see attribute_weights)
+# of u / w, v / w and 1 / w (... x 3 x 2)
+def texture_lod_derivatives(vertices, texture_coordinates):
+    if vertices.shape[-2] < 4:
+        return texture_derivatives(vertices, texture_coordinates)
+    inverse_w = vertices[..., 3:4, :]
+    return texture_derivatives(
+        vertices,
+        np.concatenate([texture_coordinates * inverse_w, inverse_w], axis=-2),
+    )
+
+
+# the level of detail (see Texture.level_of_detail) of the whole triangle for sampling
+# the texture (0, unused, unless the texture is mipmapped)
+def triangle_level_of_detail(texture, vertices, texture_coordinates, derivatives=None):
+    if not texture.mipmapped:
+        return 0.0
+    if derivatives is None:
+        derivatives = texture_derivatives(vertices, texture_coordinates)
+    return texture.level_of_detail(derivatives)
+
+
+# samples the texture at the texture coordinates (u, v) of the triangle's pixels,
+# at the level of detail of the triangle, if the texture is mipmapped
+# weights: the screen space barycentric weights of the pixels (3 x P), with perspective
+# correct vertices (see attribute_weights) the level of detail is of each pixel instead
+# derivatives: see texture_lod_derivatives, computed from the vertices if not given
+def sample_triangle_texture(
+    texture, vertices, texture_coordinates, u, v, weights, derivatives=None
+):
+    lod = 0.0
+    if texture.mipmapped and derivatives is None:
+        derivatives = texture_lod_derivatives(vertices, texture_coordinates)
+    if texture.mipmapped and len(vertices) < 4:
+        lod = texture.level_of_detail(derivatives)
+    elif texture.mipmapped:
+        q = vertices[3] @ weights
+        lod = pixel_level_of_detail(texture, derivatives, u, v, q)
+    return texture.sample_many(u, v, lod)
+
+
+# the level of detail of each pixel (P) of perspective correct triangles, from the
+# derivatives of u / w, v / w and 1 / w (see texture_lod_derivatives, 3 x 2, or P x 3 x 2
+# those of each pixel's triangle) and the u, v and 1 / w (q) at the pixels (P each)
+def pixel_level_of_detail(texture, derivatives, u, v, q):
+    # u / w, v / w and 1 / w are linear on the screen, so u = (u / w) / q
+    # has the derivatives (d(u / w) - u dq) / q at each pixel
+    q = q[:, np.newaxis, np.newaxis]
+    uv = np.stack([u, v], axis=1)[:, :, np.newaxis]
+    return texture.level_of_detail(
+        (derivatives[..., :2, :] - uv * derivatives[..., 2:3, :]) / q
+    )
+
+
+# same as draw_textured_triangle, but interpolates the depth and texture coordinates,
+# samples the texture and applies the lighting for all the pixels of the triangle at once
+# note: besides the tolerance of draw_triangle_vectorized, the sampled texels may differ
+# from draw_textured_triangle by about a texel, as the texture coordinates are interpolated
+# from the vertices instead of along the (rounded) edges of each scanline
+# the light intensity can also be the intensities at each vertex (3 x 3, a column
+# per vertex), interpolated across the triangle (gouraud shading)
+# with 1 / w of each vertex (the 4th row of the vertices), the texture coordinates
+# and the intensities are interpolated perspective correct (see attribute_weights)
+def draw_textured_triangle_vectorized(
+    vertices,
+    texture_coordinates,
+    display_buffer,
+    z_buffer,
+    texture,
+    light_intensity=(1.0, 0.0, 0.0),
+    shader=None,
+    derivatives=None,
+):
+    if texture_coordinates is None or texture is None:
+        # no texture or texture coordinates, just draw the triangle
+        return draw_triangle_vectorized(
+            vertices, display_buffer, z_buffer, (255, 255, 255)
+        )
+
+    width, height, _ = display_buffer.shape
+    coverage = triangle_coverage(vertices, width, height)
+    if coverage is None:
+        return 0, 0
+    region, inside, weights = coverage
+
+    z = np.tensordot(vertices[2], weights, axes=1)
+    visible = inside & (z < z_buffer[region])
+    z_buffer[region][visible] = z[visible]
+
+    # interpolate the texture coordinates only for the visible pixels
+    weights = weights[:, visible]
+    pixel_weights = attribute_weights(vertices, weights)
+    u, v = texture_coordinates @ pixel_weights
+    colors = sample_triangle_texture(
+        texture, vertices, texture_coordinates, u, v, weights, derivatives
+    )
+    if shader is not None:
+        colors = shader.get_color(
+            *interpolate_light(light_intensity, pixel_weights), colors
+        )
+    display_buffer[region][visible] = colors
+    drawn = np.count_nonzero(visible)
+    return drawn, np.count_nonzero(inside) - drawn
+
+
+# depth pre-pass of the triangle, draws the triangle's id (instead of its color)
+# into the id buffer, at the pixels where it is nearer than the previous triangles
+# once all the triangles are drawn, the id buffer holds the visible triangle at each pixel
+def draw_triangle_id_vectorized(vertices, triangle_id, id_buffer, z_buffer):
+    width, height = id_buffer.shape
+    coverage = triangle_coverage(vertices, width, height)
+    if coverage is None:
+        return 0, 0
+    region, inside, weights = coverage
+
+    z = np.tensordot(vertices[2], weights, axes=1)
+    visible = inside & (z < z_buffer[region])
+    z_buffer[region][visible] = z[visible]
+    id_buffer[region][visible] = triangle_id
+    drawn = np.count_nonzero(visible)
+    return drawn, np.count_nonzero(inside) - drawn
+
+
+# geometry pass of deferred shading, same as draw_triangle_id_vectorized, but also
+# draws the interpolated texture coordinates (if any) into the uv buffer (W x H x 2),
+# and (if given) the barycentric weights into the weights buffer (W x H x 3),
+# so that the pixels can be textured and lit afterwards, all at once
+# with perspective correct vertices, also (if given) the 1 / w interpolated on the screen
+# into the inverse w buffer (W x H), for the level of detail of each pixel
+# (see pixel_level_of_detail)
+def draw_triangle_gbuffer_vectorized(
+    vertices,
+    texture_coordinates,
+    triangle_id,
+    id_buffer,
+    z_buffer,
+    uv_buffer,
+    weights_buffer=None,
+    inverse_w_buffer=None,
+):
+    width, height = id_buffer.shape
+    coverage = triangle_coverage(vertices, width, height)
+    if coverage is None:
+        return 0, 0
+    region, inside, weights = coverage
+
+    z = np.tensordot(vertices[2], weights, axes=1)
+    visible = inside & (z < z_buffer[region])
+    z_buffer[region][visible] = z[visible]
+    id_buffer[region][visible] = triangle_id
+    if inverse_w_buffer is not None and len(vertices) == 4:
+        inverse_w_buffer[region][visible] = vertices[3] @ weights[:, visible]
+    if texture_coordinates is not None or weights_buffer is not None:
+        weights = attribute_weights(vertices, weights[:, visible])
+    if texture_coordinates is not None:
+        uv_buffer[region][visible] = (texture_coordinates @ weights).T
+    if weights_buffer is not None:
+        weights_buffer[region][visible] = weights.T
+    drawn = np.count_nonzero(visible)
+    return drawn, np.count_nonzero(inside) - drawn
+
+
+# shading pass after the depth pre-pass (see draw_triangle_id_vectorized),
+# same as draw_textured_triangle_vectorized, but shades only the pixels where the triangle
+# is the visible one (so that every pixel is shaded once), returns the pixels shaded
+def shade_textured_triangle_vectorized(
+    vertices,
+    triangle_id,
+    id_buffer,
+    texture_coordinates,
+    display_buffer,
+    texture,
+    light_intensity=(1.0, 0.0, 0.0),
+    shader=None,
+):
+    width, height = id_buffer.shape
+    coverage = triangle_coverage(vertices, width, height)
+    if coverage is None:
+        return 0
+    region, inside, weights = coverage
+
+    visible = inside & (id_buffer[region] == triangle_id)
+    if texture_coordinates is None or texture is None:
+        # no texture or texture coordinates, just draw the triangle
+        display_buffer[region][visible] = (255, 255, 255)
+        return np.count_nonzero(visible)
+
+    weights = weights[:, visible]
+    pixel_weights = attribute_weights(vertices, weights)
+    u, v = texture_coordinates @ pixel_weights
+    colors = sample_triangle_texture(
+        texture, vertices, texture_coordinates, u, v, weights
+    )
+    if shader is not None:
+        colors = shader.get_color(
+            *interpolate_light(light_intensity, pixel_weights), colors
+        )
+    display_buffer[region][visible] = colors
+    return len(colors)
+
+
+# rasterization engines that can be selected in the graphics pipeline
+# scanline: visits every pixel of the triangle in python (reference implementation),
+# or in the jit compiled kernels, if numba is installed (same pixels, see kernels.py)
+# vectorized: computes the coverage of the whole triangle as numpy arrays
+# fixed: steps fixed point edge functions along the scanlines (watertight, top-left rule)
+RASTERIZERS = {
+    "scanline": draw_triangle_jit if JIT_AVAILABLE else draw_triangle,
+    "vectorized": draw_triangle_vectorized,
+    "fixed": draw_triangle_fixed,
+}
+
+# the textured variants of each of the rasterization engines
+TEXTURED_RASTERIZERS = {
+    "scanline": draw_textured_triangle_jit if JIT_AVAILABLE else draw_textured_triangle,
+    "vectorized": draw_textured_triangle_vectorized,
+    "fixed": draw_textured_triangle_fixed,
+}
+
+# the rasterization engines which keep the vertices' sub-pixel positions
+# (the others truncate the vertices to whole pixels)
+SUBPIXEL_RASTERIZERS = ["fixed"]
+
+
+# the triangles of a grid of cells (two per cell) covering a square of the given size,
+# with the inner vertices randomly moved by up to the jitter (as a fraction of a cell,
+# less than a quarter, so the triangles never fold over)
+def grid_triangles(size, cells, jitter, seed=0):
+    grid = np.linspace(0, size, cells + 1)
+    x, y = np.meshgrid(grid, grid, indexing="ij")
+    rng = np.random.default_rng(seed)
+    offsets = rng.uniform(-jitter, jitter, (2, cells - 1, cells - 1)) * size / cells
+    x[1:-1, 1:-1] += offsets[0]
+    y[1:-1, 1:-1] += offsets[1]
+    points = np.stack([x, y, np.full_like(x, 0.5)])
+
+    triangles = []
+    for i in range(cells):
+        for j in range(cells):
+            a, b = points[:, i, j], points[:, i + 1, j]
+            c, d = points[:, i + 1, j + 1], points[:, i, j + 1]
+            triangles += [np.column_stack([a, b, c]), np.column_stack([a, c, d])]
+    return triangles
+
+
+# checks that the fixed point rasterizer covers each pixel of meshes of triangles
+# (grids covering the whole screen, with the edges passing exactly through pixel centers,
+# and with the vertices jittered) exactly once, and reports the pixels covered
+# more than once, or never, by each rasterizer
+if __name__ == "__main__":
+    size = 96
+    for jitter in [0.0, 0.24]:
+        triangles = grid_triangles(size, 12, jitter)
+        for name, draw in RASTERIZERS.items():
+            # the number of times each pixel is covered (the z buffer is reset
+            # for each triangle, so each triangle draws all its pixels)
+            covered = np.zeros((size, size), dtype=int)
+            for vertices in triangles:
+                display_buffer = np.zeros((size, size, 3), dtype=np.uint8)
+                z_buffer = np.ones((size, size), dtype=np.float32)
+                draw(vertices, display_buffer, z_buffer, (255, 255, 255))
+                covered += z_buffer < 1
+            overlaps = np.count_nonzero(covered > 1)
+            holes = np.count_nonzero(covered == 0)
+            print(
+                f"jitter {jitter}, {name}: {overlaps} pixels covered more than once, "
+                f"{holes} never"
+            )
+            if name in SUBPIXEL_RASTERIZERS:
+                assert overlaps == 0 and holes == 0, f"{name} is not watertight"
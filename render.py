@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import os
+
+# the raw video is written to stdout, so pygame's greeting should not be
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pygame
+from mesh import InstancedMesh, load_mesh_from_obj
+from graphics_pipeline import GraphicsPipeline
+from camera import Camera
+from shading import (
+    Material,
+    PixelShader,
+    LightingShader,
+    DirectionalLight,
+    PointLight,
+)
+from texture import load_texture_from_image
+
+# the ways of drawing the frames (the pipeline's draw methods)
+MODES = ["draw", "draw_textured", "draw_depth", "draw_wireframe"]
+# the lights a scene can have, by their type (see load_scene)
+LIGHT_TYPES = {"directional": DirectionalLight, "point": PointLight}
+
+
+# a scene to render offline, the meshes with their transformations,
+# the lighting, and the path of the camera (keyframes)
+class Scene:
+    def __init__(self, meshs, shader, fov, near, far, keyframes):
+        self.meshs = meshs
+        self.shader = shader
+        self.fov = fov
+        self.near = near
+        self.far = far
+        # the camera's eye and target at some of the frames, sorted by frame
+        # each keyframe is a dict with frame (number), eye and target (positions)
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe["frame"])
+        assert self.keyframes, "the camera needs at least one keyframe"
+
+    # the camera's eye and target at the frame, linearly interpolated
+    # between the keyframes (and held before the first and after the last keyframe)
+    def camera_at(self, frame):
+        frames = [keyframe["frame"] for keyframe in self.keyframes]
+        eyes = np.array([keyframe["eye"] for keyframe in self.keyframes], dtype=float)
+        targets = np.array(
+            [keyframe["target"] for keyframe in self.keyframes], dtype=float
+        )
+        eye = np.array([np.interp(frame, frames, eyes[:, i]) for i in range(3)])
+        target = np.array([np.interp(frame, frames, targets[:, i]) for i in range(3)])
+        return eye, target
+
+
+# loads the scene from a json file, of the form
+# {
+#   "lighting": {"ambient": 0.4, "diffuse": 0.4, "specular": 0.2, "specular_exponent": 10},
+#   "light_direction": [0, 1, 1],
+#   "lights": [{"type": "directional", "direction": [0, 1, 1], "intensity": 1},
+#              {"type": "point", "position": [0, -2, 8], "intensity": 2, "attenuation": 0.1}],
+#   "meshes": [{"obj": "cottage.obj", "texture": "cottage.png", "filtering": "trilinear",
+#               "scale": [0.1, -0.1, 0.1], "rotation": [0, 0, 0], "position": [0, 0, 10]},
+#              {"obj": "tree.obj", "instances": {"positions": [[0, 0, 5], [2, 0, 7]],
+#               "rotations": [[0, 0, 0], [0, 1, 0]], "scales": [[1, -1, 1], [1, -1, 1]]}}],
+#   "camera": {"fov": 60, "near": 1, "far": 50,
+#              "keyframes": [{"frame": 0, "eye": [0, 0, 0], "target": [0, 0, 10]}]}
+# }
+# everything but the meshes' obj files and the camera's keyframes is optional,
+# the lighting is the material of the meshes (see shading.Material), and the scene
+# is lit by the lights (see shading.LightingShader) if any, else by a single light
+# shining in the light direction,
+# a mesh with instances is drawn once for each instance (see mesh.InstancedMesh),
+# the instances' rotations and scales are optional,
+# the fov is in degrees, and the files are relative to the scene file
+def load_scene(filename) -> Scene:
+    with open(filename) as f:
+        description = json.load(f)
+    directory = os.path.dirname(filename)
+
+    material = Material(**description.get("lighting", {}))
+    if description.get("lights"):
+        lights = []
+        for light in description["lights"]:
+            light = dict(light)
+            lights.append(LIGHT_TYPES[light.pop("type")](**light))
+        shader = LightingShader(lights, material=material)
+    else:
+        shader = PixelShader(
+            light_direction=np.array(
+                description.get("light_direction", [0.0, 0.0, 1.0])
+            ),
+            material=material,
+        )
+
+    meshs = []
+    for mesh_description in description["meshes"]:
+        mesh = load_mesh_from_obj(os.path.join(directory, mesh_description["obj"]))
+        if "texture" in mesh_description:
+            mesh.texture = load_texture_from_image(
+                os.path.join(directory, mesh_description["texture"]),
+                mesh_description.get("filtering", "nearest"),
+            )
+        for attribute in ["scale", "rotation", "position"]:
+            if attribute in mesh_description:
+                setattr(mesh, attribute, np.array(mesh_description[attribute], float))
+        if "instances" in mesh_description:
+            instances = mesh_description["instances"]
+            mesh = InstancedMesh(
+                mesh,
+                instances["positions"],
+                instances.get("rotations"),
+                instances.get("scales"),
+            )
+        meshs.append(mesh)
+
+    camera = description["camera"]
+    return Scene(
+        meshs,
+        shader,
+        fov=np.deg2rad(camera.get("fov", 60)),
+        near=camera.get("near", 1.0),
+        far=camera.get("far", 50.0),
+        keyframes=camera["keyframes"],
+    )
+
+
+# renders the frames of the scene into an off screen surface (no window, or display,
+# is needed), as fast as possible (there is no frame rate to keep up with)
+# yields the frame number and the surface, the surface is reused for the next frame
+def render_frames(scene, width, height, frames, mode="draw", **pipeline_options):
+    assert mode in MODES, f"unknown mode: {mode}"
+    surface = pygame.Surface((width, height))
+    camera = Camera(scene.fov, width / height, scene.near, scene.far, verbose=False)
+    pipeline = GraphicsPipeline(
+        scene.meshs, camera, surface, shader=scene.shader, **pipeline_options
+    )
+    try:
+        for frame in frames:
+            eye, target = scene.camera_at(frame)
+            camera.look_at(eye=eye, target=target)
+            pipeline.update()
+            surface.fill((0, 0, 0))
+            getattr(pipeline, mode)()
+            yield frame, surface
+    finally:
+        pipeline.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Renders the frames of a scene (see render.load_scene) without a window, to png images or to a raw video stream.",
+        prog="python3 render.py",
+    )
+    parser.add_argument("scene", help="scene json file")
+    parser.add_argument(
+        "--frames",
+        default="0:1",
+        help="range of frames to render, as start:stop[:step] (stop excluded)",
+    )
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--mode", choices=MODES, default="draw")
+    parser.add_argument("--rasterizer", default="vectorized")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes to rasterize the tiles of each frame with",
+    )
+    parser.add_argument(
+        "--output",
+        default="frame_{:04d}.png",
+        help="image file name pattern (formatted with the frame number), "
+        "or - to write the frames as raw rgb24 video to stdout "
+        "(eg, to pipe to ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -i -)",
+    )
+    args = parser.parse_args()
+
+    frame_range = range(*(int(frame) for frame in args.frames.split(":")))
+    scene = load_scene(args.scene)
+    frames = render_frames(
+        scene,
+        args.width,
+        args.height,
+        frame_range,
+        mode=args.mode,
+        rasterizer=args.rasterizer,
+        workers=args.workers,
+    )
+
+    begin = time.perf_counter()
+    for rendered, (frame, surface) in enumerate(frames, start=1):
+        if args.output == "-":
+            sys.stdout.buffer.write(pygame.image.tobytes(surface, "RGB"))
+        else:
+            pygame.image.save(surface, args.output.format(frame))
+        elapsed = time.perf_counter() - begin
+        print(
+            f"frame {frame} ({rendered}/{len(frame_range)}), "
+            f"{rendered / elapsed:.2f} fps",
+            file=sys.stderr,
+        )
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
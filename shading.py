@@ -1,24 +1,33 @@
+import warnings
 import numpy as np
-from transformations import normalize
+from transformations import normalize, normalize_vectors
 
-AMBIENT_LIGHT = 0.1
-DIFFUSE_LIGHT = 0.6
-SPECULAR_LIGHT = 0.3
-SPECULAR_EXPONENT = 10
 
+# the material of a mesh, how strongly it reflects the light
+# (the meshes without one have the shader's material, see PixelShader)
+class Material:
+    def __init__(self, ambient=0.1, diffuse=0.6, specular=0.3, specular_exponent=10):
+        assert 0 <= ambient <= 1
+        assert 0 <= diffuse <= 1
+        assert 0 <= specular <= 1
+        assert specular_exponent > 0
+        self.ambient = ambient
+        self.diffuse = diffuse
+        self.specular = specular
+        self.specular_exponent = specular_exponent
 
+
+# deprecated, the lighting is no longer global, pass the material to the shader instead
+# (see PixelShader), returns the material of the given lighting
 def init_lighting(ambient=0.1, diffuse=0.6, specular=0.3, specular_exponent=10):
-    global AMBIENT_LIGHT, DIFFUSE_LIGHT, SPECULAR_LIGHT, SPECULAR_EXPONENT
-    assert 0 <= ambient <= 1
-    assert 0 <= diffuse <= 1
-    assert 0 <= specular <= 1
-    assert specular_exponent > 0
+    warnings.warn(
+        "init_lighting is deprecated and has no effect, "
+        "pass PixelShader(material=Material(...)) instead",
+        DeprecationWarning,
+        stacklevel=2,
+    )
     assert ambient + diffuse + specular <= 1
-
-    AMBIENT_LIGHT = ambient
-    DIFFUSE_LIGHT = diffuse
-    SPECULAR_LIGHT = specular
-    SPECULAR_EXPONENT = specular_exponent
+    return Material(ambient, diffuse, specular, specular_exponent)
 
 
 # A pixel shader that calculates the color of the fragment (ie, pixel)
@@ -28,30 +37,56 @@ def init_lighting(ambient=0.1, diffuse=0.6, specular=0.3, specular_exponent=10):
 
 class PixelShader:
     def __init__(
-        self, light_direction=np.array([0.0, 0.0, 1.0]), light_color=(255, 255, 255)
+        self,
+        light_direction=np.array([0.0, 0.0, 1.0]),
+        light_color=(255, 255, 255),
+        material=None,
     ):
         # the direction of the light source
         self.light_direction = light_direction
         self.light_color = light_color
+        # the material of the meshes without one (see Material)
+        self.material = material or Material()
 
     # calculates the intensity of the lighting at the fragment,
     # given the normal, position of the object and the camera
     def light_intensity(self, normal, object_position, camera_position):
-        ambient = AMBIENT_LIGHT
-        diffuse = DIFFUSE_LIGHT * max(0, np.dot(normal, -self.light_direction))
+        material = self.material
+        ambient = material.ambient
+        diffuse = material.diffuse * max(0, np.dot(normal, -self.light_direction))
         point_to_camera = normalize(camera_position - object_position)
         specular = (
-            SPECULAR_LIGHT
+            material.specular
             * max(
                 0,
                 np.dot(normal, normalize(point_to_camera + -self.light_direction)),
             )
-            ** SPECULAR_EXPONENT
+            ** material.specular_exponent
         )
         return ambient, diffuse, specular
 
+    # same as light_intensity, but for many fragments at once,
+    # normals and object_positions are arrays of vectors (N x 3)
+    # material: the material of the fragments (see Material), by default the shader's
+    # returns the ambient, diffuse, specular intensities of each fragment (N x 3)
+    def light_intensities(
+        self, normals, object_positions, camera_position, material=None
+    ):
+        material = material or self.material
+        ambient = np.full(len(normals), material.ambient)
+        diffuse = material.diffuse * np.maximum(0, normals @ -self.light_direction)
+        points_to_camera = normalize_vectors(camera_position - object_positions)
+        halfway = normalize_vectors(points_to_camera + -self.light_direction)
+        specular = (
+            material.specular
+            * np.maximum(0, np.sum(normals * halfway, axis=-1))
+            ** material.specular_exponent
+        )
+        return np.column_stack([ambient, diffuse, specular])
+
     # calculates the actual color of the pixel after applying the lighting,
     # given the ambient, diffuse, specular intensities and the texture color of the fragment
+    # color can also be an array of colors (N x 3), to shade many fragments at once
     def get_color(self, ambient, diffuse, specular, color=(255, 255, 255)):
         pixel_color = (
             np.array(color) * (ambient + diffuse)
@@ -70,3 +105,118 @@ class PixelShader:
         )
 
         return self.get_color(ambient, diffuse, specular, texture_color)
+
+
+# a light infinitely far away, shining in the direction (on everything equally)
+class DirectionalLight:
+    def __init__(self, direction, intensity=1.0):
+        self.direction = normalize(np.asarray(direction, dtype=float))
+        self.intensity = intensity
+
+    # the directions from the points (N x 3) to the light, and the light's intensity
+    # at each of them (N)
+    def illuminate(self, points):
+        directions = np.broadcast_to(-self.direction, points.shape)
+        return directions, np.full(len(points), self.intensity)
+
+
+# a light at the position, shining in all the directions, and fading with the distance
+# the intensity at distance d is intensity / (1 + attenuation * d^2)
+class PointLight:
+    def __init__(self, position, intensity=1.0, attenuation=0.0):
+        self.position = np.asarray(position, dtype=float)
+        self.intensity = intensity
+        self.attenuation = attenuation
+
+    def illuminate(self, points):
+        to_light = self.position - points
+        distances_squared = np.sum(to_light**2, axis=-1)
+        intensities = self.intensity / (1 + self.attenuation * distances_squared)
+        return normalize_vectors(to_light), intensities
+
+
+# pixel shader with any number of directional and point lights (see PixelShader)
+# the diffuse and specular intensities are the sums over the lights, clipped to 1
+# all the lights are evaluated at once for all the fragments, as (L x N) arrays
+class LightingShader(PixelShader):
+    def __init__(self, lights, light_color=(255, 255, 255), material=None):
+        # (no light direction, the lights have their own)
+        self.lights = lights
+        self.light_color = light_color
+        self.material = material or Material()
+
+    def light_intensity(self, normal, object_position, camera_position):
+        return tuple(
+            self.light_intensities(
+                np.array([normal]), np.array([object_position]), camera_position
+            )[0]
+        )
+
+    def light_intensities(
+        self, normals, object_positions, camera_position, material=None
+    ):
+        material = material or self.material
+        ambient = np.full(len(normals), material.ambient)
+        if not self.lights:
+            return np.column_stack([ambient, np.zeros((len(normals), 2))])
+
+        # directions to the lights (L x N x 3), and the lights' intensities (L x N)
+        directions, intensities = zip(
+            *(light.illuminate(object_positions) for light in self.lights)
+        )
+        directions, intensities = np.stack(directions), np.stack(intensities)
+
+        diffuse = np.maximum(0, np.sum(normals * directions, axis=-1))
+        points_to_camera = normalize_vectors(camera_position - object_positions)
+        halfway = normalize_vectors(points_to_camera + directions)
+        specular = (
+            np.maximum(0, np.sum(normals * halfway, axis=-1))
+            ** material.specular_exponent
+        )
+        diffuse = material.diffuse * np.minimum(1, np.sum(intensities * diffuse, 0))
+        specular = material.specular * np.minimum(1, np.sum(intensities * specular, 0))
+        return np.column_stack([ambient, diffuse, specular])
+
+
+# checks that a single directional light lights the fragments like PixelShader does,
+# and that a point light fades with the distance
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    normals = normalize_vectors(rng.normal(size=(100, 3)))
+    positions = rng.uniform(-5, 5, (100, 3))
+    camera_position = np.array([0.0, 1.0, -10.0])
+    direction = normalize(np.array([0.0, 1.0, 1.0]))
+    material = Material(ambient=0.4, diffuse=0.4, specular=0.2, specular_exponent=10)
+    for mesh_material in [None, Material()]:
+        expected = PixelShader(direction, material=material).light_intensities(
+            normals, positions, camera_position, mesh_material
+        )
+        lit = LightingShader(
+            [DirectionalLight(direction)], material=material
+        ).light_intensities(normals, positions, camera_position, mesh_material)
+        assert np.allclose(lit, expected), "directional light differs from PixelShader"
+    print("directional light: same intensities as PixelShader")
+
+    # fragments facing a point light, at distances 1 to 10 from it
+    distances = np.arange(1.0, 11.0)
+    positions = np.column_stack([distances, np.zeros((10, 2))])
+    normals = np.tile([-1.0, 0.0, 0.0], (10, 1))
+    shader = LightingShader(
+        [PointLight([0, 0, 0], intensity=0.5, attenuation=0.2)], material=material
+    )
+    diffuse = shader.light_intensities(normals, positions, camera_position)[:, 1]
+    expected = material.diffuse * 0.5 / (1 + 0.2 * distances**2)
+    assert np.allclose(diffuse, expected), "point light doesn't fade as expected"
+    # the sum of the lights is clipped, so a bright light saturates the near fragments
+    shader.lights[0].intensity = 10.0
+    diffuse = shader.light_intensities(normals, positions, camera_position)[:, 1]
+    assert np.isclose(diffuse[0], material.diffuse) and diffuse[-1] < material.diffuse
+    print("point light: fades with the distance")
+
+    # the lighting isn't global anymore
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        init_lighting(ambient=0.5, diffuse=0.3, specular=0.2)
+    assert caught and issubclass(caught[0].category, DeprecationWarning)
+    assert PixelShader().material.ambient == Material().ambient
+    print("init_lighting: deprecated, the default material is Material()")
@@ -1,49 +1,227 @@
 #!/usr/bin/env python3
 
 import argparse
+import time
+import numpy as np
 from mesh import load_mesh_from_obj
 
+# number of vertices in the (simulated) post-transform vertex cache
+CACHE_SIZE = 16
+
+
+# removes the duplicate rows (eg, vertices) of the array, and unused ones along with them
+# indices: indices of the used rows (any shape, -1 for none), returns the unique rows
+# and the indices of the same rows in the unique rows (same shape as indices)
+def deduplicate(rows, indices):
+    used = indices >= 0
+    unique_rows, inverse = np.unique(rows[indices[used]], axis=0, return_inverse=True)
+    new_indices = np.full(indices.shape, -1)
+    new_indices[used] = inverse.ravel()
+    return unique_rows, new_indices
+
+
+# renumbers the rows in the order they are first used by the faces (in the face order),
+# so that the vertices of nearby faces are also nearby in memory
+def reorder_by_first_use(rows, indices):
+    used = indices >= 0
+    _, first_use = np.unique(indices[used], return_index=True)
+    order = np.argsort(first_use)
+    new_index = np.empty(len(rows), dtype=int)
+    new_index[order] = np.arange(len(rows))
+    return rows[order], np.where(used, new_index[indices], -1)
+
+
+# average number of vertices transformed per triangle (average cache miss ratio)
+# when the faces are drawn in order with a fifo vertex cache of the given size
+def cache_miss_ratio(vertex_indices, cache_size=CACHE_SIZE):
+    if len(vertex_indices) == 0:
+        return 0.0
+    cache, cached, misses = [], set(), 0
+    for vertex in vertex_indices.ravel().tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        cache.append(vertex)
+        cached.add(vertex)
+        if len(cache) > cache_size:
+            cached.discard(cache.pop(0))
+    return misses / len(vertex_indices)
+
+
+# reorders the faces so that they reuse the vertices in the vertex cache (tipsify)
+# reference: Sander, Nehab, Barczak - Fast Triangle Reordering for Vertex Locality
+# and Reduced Overdraw (2007)
+# returns the new order of the faces
+def optimize_face_order(vertex_indices, num_vertices, cache_size=CACHE_SIZE):
+    num_faces = len(vertex_indices)
+    # faces using each vertex (adjacency in compressed form)
+    corners = vertex_indices.ravel()
+    corner_order = np.argsort(corners, kind="stable")
+    adjacent_faces = (corner_order // 3).tolist()
+    offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(corners, minlength=num_vertices))]
+    )
+    offsets = offsets.tolist()
+    faces = vertex_indices.tolist()
+
+    live = np.bincount(corners, minlength=num_vertices).tolist()  # unemitted faces
+    cache_time = [0] * num_vertices  # time each vertex entered the cache
+    emitted = [False] * num_faces
+    dead_end = []  # recently used vertices, for when there are no good candidates
+    order = []
+    time_stamp = cache_size + 1
+    cursor = 0  # for scanning the vertices in order, once all else fails
+    fanning = 0  # vertex whose faces are emitted next
+
+    while fanning >= 0:
+        candidates = []
+        for face in adjacent_faces[offsets[fanning] : offsets[fanning + 1]]:
+            if emitted[face]:
+                continue
+            emitted[face] = True
+            order.append(face)
+            for vertex in faces[face]:
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time_stamp - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = time_stamp
+                    time_stamp += 1
+
+        # next fanning vertex is the candidate that stays in the cache the longest,
+        # while still having faces to emit
+        fanning, best_priority = -1, -1
+        for vertex in candidates:
+            if live[vertex] <= 0:
+                continue
+            priority = 0
+            if time_stamp - cache_time[vertex] + 2 * live[vertex] <= cache_size:
+                priority = time_stamp - cache_time[vertex]
+            if priority > best_priority:
+                fanning, best_priority = vertex, priority
+
+        if fanning == -1:
+            # no candidates, use the recently used vertices
+            while dead_end:
+                vertex = dead_end.pop()
+                if live[vertex] > 0:
+                    fanning = vertex
+                    break
+        if fanning == -1:
+            # no recently used vertices either, use the next vertex with faces left
+            while cursor < num_vertices:
+                if live[cursor] > 0:
+                    fanning = cursor
+                    break
+                cursor += 1
+
+    return np.array(order, dtype=int)
+
 
 # this function takes a model and outputs another model
 # with same geometry, ignores all properties, except vertices, and textures
-# removes unused vertices and textures
-def simplify_model(input_obj_file, output_obj_file):
+# removes duplicate and unused vertices and textures, and degenerate faces,
+# optionally quantizes the vertices and textures (rounding them to the given decimals),
+# and reorders the faces and vertices for the vertex cache and memory locality
+def simplify_model(input_obj_file, output_obj_file, decimals=None, optimize=True):
+    start = time.perf_counter()
     mesh = load_mesh_from_obj(input_obj_file)
-    vertices, textures = [], []
+    vertices = mesh.model_vertices[:3].T
+    vertex_indices = mesh.vertex_indices
+    textures, texture_indices = None, None
+    if mesh.texture_indices is not None:
+        textures = mesh.model_texture_coordinates.T
+        texture_indices = mesh.texture_indices
+    before = (len(vertices), len(textures) if textures is not None else 0)
+    before_faces = len(vertex_indices)
+    before_acmr = cache_miss_ratio(vertex_indices)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if decimals is not None:
+        vertices = np.round(vertices, decimals)
+        if textures is not None:
+            textures = np.round(textures, decimals)
+
+    vertices, vertex_indices = deduplicate(vertices, vertex_indices)
+    if textures is not None:
+        textures, texture_indices = deduplicate(textures, texture_indices)
+
+    # faces whose vertices got merged don't cover any area
+    a, b, c = vertex_indices.T
+    degenerate = (a == b) | (b == c) | (c == a)
+    vertex_indices = vertex_indices[~degenerate]
+    if textures is not None:
+        texture_indices = texture_indices[~degenerate]
+
+    if optimize:
+        order = optimize_face_order(vertex_indices, len(vertices))
+        vertex_indices = vertex_indices[order]
+        if textures is not None:
+            texture_indices = texture_indices[order]
+
+    # renumbering also drops the vertices only used by degenerate faces
+    vertices, vertex_indices = reorder_by_first_use(
+        *deduplicate(vertices, vertex_indices)
+    )
+    if textures is not None:
+        textures, texture_indices = reorder_by_first_use(
+            *deduplicate(textures, texture_indices)
+        )
+    simplify_time = time.perf_counter() - start
 
     with open(output_obj_file, "w") as f:
+        np.savetxt(f, vertices, fmt="v %s %s %s")
+        if textures is not None:
+            np.savetxt(f, textures, fmt="vt %s %s")
+            corners = np.stack([vertex_indices, texture_indices], axis=2) + 1
+            if np.all(texture_indices >= 0):
+                np.savetxt(f, corners.reshape(-1, 6), fmt="f %d/%d %d/%d %d/%d")
+            else:
+                # the corners without texture coordinates are written without
+                for face in corners.tolist():
+                    f.write(
+                        "f "
+                        + " ".join(f"{v}/{vt}" if vt else f"{v}" for v, vt in face)
+                        + "\n"
+                    )
+        else:
+            np.savetxt(f, vertex_indices + 1, fmt="f %d %d %d")
 
-        for face in mesh.faces:
-            for vertex in face.model_vertices.T:
-                vertex = tuple(vertex)
-                if vertex not in vertices:
-                    print("v", *vertex[:3], sep=" ", file=f)
-                    vertices.append(vertex)
-        for face in mesh.faces:
-            for texture in face.texture_coordinates.T:
-                texture = tuple(texture)
-                if texture not in textures:
-                    print("vt", *texture, sep=" ", file=f)
-                    textures.append(texture)
-
-        for face in mesh.faces:
-            texture_indices = [
-                textures.index(tuple(texture)) + 1
-                for texture in face.texture_coordinates.T
-            ]
-            vertex_indices = [
-                vertices.index(tuple(vertex)) + 1 for vertex in face.model_vertices.T
-            ]
-            zipped = zip(vertex_indices, texture_indices)
-            print("f", *(f"{v}/{t}" for v, t in zipped), sep=" ", file=f)
+    after = (len(vertices), len(textures) if textures is not None else 0)
+    print(f"vertices: {before[0]} -> {after[0]}")
+    print(f"texture coordinates: {before[1]} -> {after[1]}")
+    print(f"faces: {before_faces} -> {len(vertex_indices)}")
+    print(
+        f"average cache miss ratio: {before_acmr:.3f} -> "
+        f"{cache_miss_ratio(vertex_indices):.3f}"
+    )
+    print(f"load time: {load_time:.3f}s, simplify time: {simplify_time:.3f}s")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Takes a model and outputs another model with same geometry, ignores all properties, except vertices, and textures, removes unused vertices and textures.",
+        description="Takes a model and outputs another model with same geometry, ignores all properties, except vertices, and textures, removes duplicate and unused vertices and textures, and reorders the faces for the vertex cache.",
         prog="python3 simplify_model.py",
     )
     parser.add_argument("input_obj_file", help="input wavefront obj file to simplify")
     parser.add_argument("output_obj_file", help="output filename")
+    parser.add_argument(
+        "--decimals",
+        type=int,
+        default=None,
+        help="quantize vertices and textures by rounding them to these many decimals",
+    )
+    parser.add_argument(
+        "--no-optimize",
+        dest="optimize",
+        action="store_false",
+        help="keep the original order of the faces",
+    )
     args = parser.parse_args()
-    simplify_model(args.input_obj_file, args.output_obj_file)
+    simplify_model(
+        args.input_obj_file,
+        args.output_obj_file,
+        decimals=args.decimals,
+        optimize=args.optimize,
+    )
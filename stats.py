@@ -0,0 +1,87 @@
+import csv
+import json
+import time
+from contextlib import contextmanager
+import pygame
+
+# color and size of the overlay's text
+OVERLAY_COLOR = (255, 255, 0)
+OVERLAY_FONT_SIZE = 18
+
+
+# statistics of the frames drawn by the graphics pipeline, the time spent in each stage
+# and the number of triangles (or pixels) coming out of each stage of the current frame,
+# and (when recording) of all the previous frames, for dumping them as json or csv
+class PipelineStats:
+    def __init__(self, record=False):
+        self.record = record
+        # seconds spent in each stage (in the order the stages ran) of the current frame
+        self.times = {}
+        # counts of triangles, pixels, ... of the current frame
+        self.counts = {}
+        # stats of the previous frames (when recording), see as_dict
+        self.frames = []
+        self.frame = 0
+        self.font = None
+
+    # starts a new frame (the graphics pipeline does, on every update)
+    def new_frame(self):
+        if self.record and (self.times or self.counts):
+            self.frames.append(self.as_dict())
+        self.times, self.counts = {}, {}
+        self.frame += 1
+
+    # times the code in the with block as (a part of) the stage
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[stage] = self.times.get(stage, 0.0) + elapsed
+
+    def count(self, name, amount):
+        self.counts[name] = self.counts.get(name, 0) + int(amount)
+
+    # stats of the current frame, with the times in milliseconds
+    def as_dict(self):
+        return {
+            "frame": self.frame,
+            **{f"{stage}_ms": seconds * 1000 for stage, seconds in self.times.items()},
+            "total_ms": sum(self.times.values()) * 1000,
+            **self.counts,
+        }
+
+    # the recorded frames, and the current one
+    def all_frames(self):
+        if self.times or self.counts:
+            return [*self.frames, self.as_dict()]
+        return list(self.frames)
+
+    def dump_json(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.all_frames(), f, indent=2)
+
+    def dump_csv(self, filename):
+        frames = self.all_frames()
+        # the columns of all the frames (some stages may not run in every frame)
+        columns = list(dict.fromkeys(key for frame in frames for key in frame))
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(frames)
+
+    # draws the stats of the current frame onto the top left corner of the screen
+    def draw_overlay(self, screen):
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, OVERLAY_FONT_SIZE)
+        lines = [
+            f"{stage}: {seconds * 1000:.1f} ms" for stage, seconds in self.times.items()
+        ]
+        lines.append(f"total: {sum(self.times.values()) * 1000:.1f} ms")
+        lines.extend(f"{name}: {amount}" for name, amount in self.counts.items())
+        for i, line in enumerate(lines):
+            text = self.font.render(line, True, OVERLAY_COLOR)
+            screen.blit(text, (4, 4 + i * text.get_height()))
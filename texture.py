@@ -1,26 +1,159 @@
 import pygame
+import itertools
 import numpy as np
+from functools import cached_property
+
+# the ways of sampling the texture, nearest (the texel the coordinates fall in),
+# bilinear (blending the 4 nearest texels) and trilinear (blending the bilinear
+# samples of the two mip levels nearest to the level of detail, see level_of_detail)
+FILTERINGS = ["nearest", "bilinear", "trilinear"]
+
+# the keys of the textures (see Texture.token), unique for the life of the program
+# (unlike id(), which a new texture may reuse once the old one is freed)
+TEXTURE_KEYS = itertools.count()
+
+
+# the image (W x H x C) at half the resolution (each texel is the average of 2 x 2 texels)
+# a dimension of 1 texel is kept as is, and the last texel of an odd dimension is dropped
+def downsample(image):
+    width, height, channels = image.shape
+    fx, fy = (2 if width > 1 else 1), (2 if height > 1 else 1)
+    image = image[: width // fx * fx, : height // fy * fy].astype(np.float32)
+    image = image.reshape(width // fx, fx, height // fy, fy, channels)
+    return image.mean(axis=(1, 3))
 
 
 class Texture:
-    def __init__(self, texture: np.ndarray):
+    def __init__(self, texture: np.ndarray, filtering="nearest"):
         self.texture = texture
         self.width, self.height, _ = texture.shape
+        assert filtering in FILTERINGS, f"unknown filtering: {filtering}"
+        self.filtering = filtering
+        self.key = next(TEXTURE_KEYS)
+        # incremented whenever the texture's image is changed (see changed)
+        self.version = 0
+
+    # identifies the texture and its image, for the copies of it kept elsewhere
+    # (see tiled_rasterizer.TiledRenderer)
+    @property
+    def token(self):
+        return (self.key, self.version)
+
+    # to be called after changing the texture's image (in place, or setting a new one),
+    # so that the mip levels are computed again, and the copies of the texture updated
+    def changed(self):
+        self.width, self.height, _ = self.texture.shape
+        self.version += 1
+        self.__dict__.pop("mip_levels", None)
+
+    # whether sampling needs the level of detail (see level_of_detail)
+    @property
+    def mipmapped(self):
+        return self.filtering == "trilinear"
+
+    # the mip pyramid, the texture at full, half, quarter, ... resolution down to 1 x 1
+    # (each level as the texture's type), computed once, assuming the texture doesn't change
+    @cached_property
+    def mip_levels(self):
+        levels = [self.texture]
+        level = self.texture.astype(np.float32)
+        while level.shape[0] > 1 or level.shape[1] > 1:
+            level = downsample(level)
+            levels.append(np.rint(level).astype(self.texture.dtype))
+        return levels
 
-    def sample(self, u, v):
+    # lod: the level of detail (see level_of_detail), used only by trilinear filtering
+    def sample(self, u, v, lod=0.0):
+        if self.filtering != "nearest":
+            return self.sample_many(np.array([u]), np.array([v]), lod)[0]
         # u, v are texture coordinates
         # we'll clamp the texture coordinates to the range [0, 1]
         x = np.clip(int(u * self.width), 0, self.width - 1)
         y = np.clip(int(v * self.height), 0, self.height - 1)
         return self.texture[x, y]
 
+    # samples the texture at many texture coordinates at once,
+    # u, v are arrays of texture coordinates, returns an array of colors (N x 3)
+    # lod: the level of detail (see level_of_detail) of the samples, one for all of them
+    # or one for each of them (N), used only by trilinear filtering
+    def sample_many(self, u, v, lod=0.0):
+        if self.filtering == "nearest":
+            x = np.clip((u * self.width).astype(int), 0, self.width - 1)
+            y = np.clip((v * self.height).astype(int), 0, self.height - 1)
+            return self.texture[x, y]
+        if self.filtering == "bilinear":
+            return self.round(self.sample_level(0, u, v))
+
+        levels = len(self.mip_levels)
+        lod = np.clip(lod, 0, levels - 1)
+        if np.ndim(lod) == 0:
+            # all the samples are of the same pair of levels
+            level = int(lod)
+            return self.round(self.sample_levels(level, u, v, lod - level))
+
+        base = lod.astype(int)
+        blend = (lod - base)[:, np.newaxis]
+        # (in double precision, like the samples of a single level of detail,
+        # so the colors are rounded the same)
+        colors = np.empty((len(u), self.texture.shape[2]))
+        # the samples of each pair of levels at once
+        for level in np.unique(base).tolist():
+            samples = base == level
+            colors[samples] = self.sample_levels(
+                level, u[samples], v[samples], blend[samples]
+            )
+        return self.round(colors)
+
+    # the bilinear samples of the mip level blended with those of the next level
+    # (the blend of the next level is from 0 to 1)
+    def sample_levels(self, level, u, v, blend):
+        colors = self.sample_level(level, u, v)
+        if level + 1 < len(self.mip_levels) and np.any(blend):
+            colors += blend * (self.sample_level(level + 1, u, v) - colors)
+        return colors
+
+    # bilinear samples (N x 3, as floats) of the mip level at the texture coordinates,
+    # the texel centers are at (i + 0.5) / size, and the coordinates are clamped to the edges
+    def sample_level(self, level, u, v):
+        image = self.mip_levels[level]
+        width, height, _ = image.shape
+        x = np.clip(u * width - 0.5, 0, width - 1)
+        y = np.clip(v * height - 0.5, 0, height - 1)
+        x0, y0 = x.astype(int), y.astype(int)
+        x1, y1 = np.minimum(x0 + 1, width - 1), np.minimum(y0 + 1, height - 1)
+        fx, fy = (x - x0)[:, np.newaxis], (y - y0)[:, np.newaxis]
+        top = image[x0, y0] + fx * (image[x1, y0].astype(np.float32) - image[x0, y0])
+        bottom = image[x0, y1] + fx * (image[x1, y1].astype(np.float32) - image[x0, y1])
+        return top + fy * (bottom - top)
+
+    # the colors (as floats) as the texture's type
+    def round(self, colors):
+        return np.rint(colors).astype(self.texture.dtype)
+
+    # the mip level (fractional) whose texels are about the size of a pixel, from the
+    # derivatives of the texture coordinates along the screen's x and y (... x 2 x 2,
+    # [u, v] x [x, y], see rasterizer.texture_derivatives), 0 (the full resolution)
+    # where the texels are larger than a pixel
+    def level_of_detail(self, derivatives):
+        # the derivatives in texels
+        derivatives = derivatives * np.array([[self.width], [self.height]])
+        footprint = np.linalg.norm(derivatives, axis=-2).max(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lod = np.log2(footprint)
+        return np.nan_to_num(lod, nan=0.0, posinf=len(self.mip_levels) - 1.0)
+
 
-def load_texture_from_image(filename) -> Texture:
+# the mip pyramid is built here, once (see Texture.mip_levels), instead of
+# on the first frame drawn with the texture
+def load_texture_from_image(filename, filtering="nearest") -> Texture:
     texture = pygame.image.load(filename)
     # Note: flip the texture vertically, to align the coordinate systems
     texture = pygame.transform.flip(texture, False, True)
     texture = pygame.surfarray.array3d(texture)
-    return Texture(texture)
+    texture = Texture(texture, filtering)
+    if texture.mipmapped:
+        texture.mip_levels
+    return texture
 
 
 def random_texture(width, height):
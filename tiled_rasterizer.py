@@ -0,0 +1,414 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import weakref
+import numpy as np
+from rasterizer import (
+    RASTERIZERS,
+    TEXTURED_RASTERIZERS,
+    SUBPIXEL_RASTERIZERS,
+    texture_lod_derivatives,
+)
+from framebuffer import FrameBuffer, release
+
+# size (in pixels) of the square tiles the screen is split into
+TILE_SIZE = 64
+# number of tasks per worker, more tasks balance the load better across the workers
+TASKS_PER_WORKER = 4
+# alignment (in bytes) of the arrays packed into shared memory (see SharedArrays)
+ARRAY_ALIGNMENT = 64
+
+
+# bins the triangles (in screen space, N x 3 x 3) into the tiles their bounding boxes overlap
+# returns a dict from the tile (tile_x, tile_y) to the indices of the triangles in it,
+# the triangles of each tile are in the same order as the input
+def bin_triangles(screen_vertices, width, height, tile_size=TILE_SIZE):
+    num_tiles_x = (width + tile_size - 1) // tile_size
+    num_tiles_y = (height + tile_size - 1) // tile_size
+    if len(screen_vertices) == 0:
+        return {}
+
+    # range of tiles overlapped by the bounding box of each triangle
+    x = screen_vertices[:, 0].astype(int)
+    y = screen_vertices[:, 1].astype(int)
+    tile_x0 = np.clip(x.min(axis=1) // tile_size, 0, num_tiles_x - 1)
+    tile_x1 = np.clip(x.max(axis=1) // tile_size, 0, num_tiles_x - 1)
+    tile_y0 = np.clip(y.min(axis=1) // tile_size, 0, num_tiles_y - 1)
+    tile_y1 = np.clip(y.max(axis=1) // tile_size, 0, num_tiles_y - 1)
+
+    # one entry for each (triangle, tile) pair
+    columns = tile_x1 - tile_x0 + 1
+    counts = columns * (tile_y1 - tile_y0 + 1)
+    triangles = np.repeat(np.arange(len(screen_vertices)), counts)
+    i = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_x = np.repeat(tile_x0, counts) + i % np.repeat(columns, counts)
+    tile_y = np.repeat(tile_y0, counts) + i // np.repeat(columns, counts)
+
+    # group the triangles by tile (stable, so the triangles stay in order)
+    tiles = tile_y * num_tiles_x + tile_x
+    order = np.argsort(tiles, kind="stable")
+    tiles, triangles = tiles[order], triangles[order]
+    unique_tiles, starts = np.unique(tiles, return_index=True)
+    return {
+        (tile % num_tiles_x, tile // num_tiles_x): group
+        for tile, group in zip(unique_tiles.tolist(), np.split(triangles, starts[1:]))
+    }
+
+
+# state of each worker process, set up once by init_worker
+WORKER = {}
+
+
+def init_worker(width, height, names, textures):
+    WORKER["frame_buffer"] = FrameBuffer.attach(width, height, names)
+    WORKER["textures"] = textures
+    WORKER["arrays"] = None
+
+
+# the array at the layout (offset, dtype, shape, see SharedArrays.pack) in the buffer
+# (None for no array)
+def unpack(buffer, layout):
+    if layout is None:
+        return None
+    offset, dtype, shape = layout
+    return np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+
+
+# the buffer of the shared memory block with the given name (see SharedArrays),
+# attached to once, and again only after the block has been replaced
+def shared_arrays_buffer(name):
+    memory = WORKER["arrays"]
+    if memory is None or memory.name != name:
+        if memory is not None:
+            memory.close()
+        memory = WORKER["arrays"] = shared_memory.SharedMemory(name=name)
+    return memory.buf
+
+
+# rasterizes the triangles of the tiles into the shared frame buffer
+# the arrays of the frame are in shared memory (see TiledRenderer.render), name is
+# the memory block's name, batches are the texture token and the layouts of the screen
+# vertices, texture coordinates, textured, light intensity, colors and derivatives arrays
+# of each face batch (like the pipeline's face batches), and triangles the layout of the
+# triangles of all the tiles (indices into the batches' arrays, tile after tile)
+# each tile is (x0, y0, x1, y1, draw_calls), its pixel range and the triangles
+# overlapping it, as draw calls of (batch, start, stop), the range of the triangles
+# the derivatives (see rasterizer.texture_lod_derivatives) are of the vertices before
+# they are truncated, so mipmapped textures are sampled at the same levels as without tiles
+# returns the number of pixels drawn, and rejected by the depth test
+def render_tiles(name, batches, triangles, tiles, textured, rasterizer, shader):
+    draw_triangle = RASTERIZERS[rasterizer]
+    draw_textured_triangle = TEXTURED_RASTERIZERS[rasterizer]
+    textures = WORKER["textures"]
+    buffer = shared_arrays_buffer(name)
+    triangles = unpack(buffer, triangles)
+    batches = [
+        (texture_token, *(unpack(buffer, layout) for layout in layouts))
+        for texture_token, layouts in batches
+    ]
+    drawn, rejected = 0, 0
+    for x0, y0, x1, y1, draw_calls in tiles:
+        # the rasterizers only see the tile's part of the buffers,
+        # so the triangles are moved by the tile's offset (by whole pixels,
+        # after truncating them like most rasterizers do, so the edges don't change)
+        frame_buffer = WORKER["frame_buffer"]
+        display_buffer = frame_buffer.display_buffer[x0:x1, y0:y1]
+        z_buffer = frame_buffer.z_buffer[x0:x1, y0:y1]
+        offset = np.array([[x0], [y0]])
+        for b, start, stop in draw_calls:
+            (
+                texture_token,
+                vertices,
+                texture_coordinates,
+                textured_triangles,
+                light_intensity,
+                colors,
+                derivatives,
+            ) = batches[b]
+            tile_triangles = triangles[start:stop]
+            vertices = vertices[tile_triangles]
+            if rasterizer in SUBPIXEL_RASTERIZERS:
+                vertices[:, :2] -= offset
+            else:
+                vertices[:, :2] = np.trunc(vertices[:, :2]) - offset
+            for i, triangle in enumerate(tile_triangles):
+                if not textured and shader is not None:
+                    # lit at each pixel (gouraud shading, vectorized rasterizer only)
+                    result = draw_triangle(
+                        vertices[i],
+                        display_buffer,
+                        z_buffer,
+                        colors[triangle],
+                        light_intensity[triangle],
+                        shader,
+                    )
+                elif not textured:
+                    result = draw_triangle(
+                        vertices[i], display_buffer, z_buffer, colors[triangle]
+                    )
+                else:
+                    result = draw_textured_triangle(
+                        vertices[i],
+                        (
+                            texture_coordinates[triangle]
+                            if texture_coordinates is not None
+                            and (
+                                textured_triangles is None
+                                or textured_triangles[triangle]
+                            )
+                            else None
+                        ),
+                        display_buffer,
+                        z_buffer,
+                        textures.get(texture_token),
+                        light_intensity[triangle],
+                        shader,
+                        derivatives[triangle] if derivatives is not None else None,
+                    )
+                drawn += result[0]
+                rejected += result[1]
+    return drawn, rejected
+
+
+# arrays packed into one block of shared memory, so that the arrays of a frame reach the
+# workers without being pickled (see TiledRenderer.render), the block is kept for the
+# next frames, and replaced by one twice as large when the arrays don't fit in it
+class SharedArrays:
+    def __init__(self):
+        self.memory = ()
+        self.finalizer = None
+
+    # copies the arrays (None for no array) into the shared memory
+    # returns the block's name, and the layout (offset, dtype, shape) of each array
+    # (None for no array, see unpack)
+    def pack(self, arrays):
+        arrays = [array if array is None else np.asarray(array) for array in arrays]
+        layouts, size = [], 0
+        for array in arrays:
+            if array is None:
+                layouts.append(None)
+                continue
+            # aligned, so that the workers' views of the arrays are aligned
+            size = (size + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+            layouts.append((size, array.dtype.str, array.shape))
+            size += array.nbytes
+
+        if not self.memory or self.memory[0].size < size:
+            old_size = self.memory[0].size if self.memory else 0
+            self.close()
+            self.memory = (
+                shared_memory.SharedMemory(
+                    create=True, size=max(size, 2 * old_size, ARRAY_ALIGNMENT)
+                ),
+            )
+            # release the shared memory even if close is never called
+            self.finalizer = weakref.finalize(self, release, self.memory, True)
+
+        buffer = self.memory[0].buf
+        for array, layout in zip(arrays, layouts):
+            if array is not None:
+                unpack(buffer, layout)[...] = array
+        return self.memory[0].name, layouts
+
+    def close(self):
+        if self.finalizer is not None:
+            self.finalizer()
+        self.memory, self.finalizer = (), None
+
+
+# renders the triangles by splitting the screen into tiles, and rasterizing the tiles
+# in parallel across a pool of processes, all drawing into a frame buffer in shared memory
+# (the tiles don't overlap, so the workers never write the same pixels)
+class TiledRenderer:
+    def __init__(self, rasterizer="vectorized", workers=None, tile_size=TILE_SIZE):
+        self.rasterizer = rasterizer
+        self.workers = workers or os.cpu_count()
+        self.tile_size = tile_size
+        self.names = None  # names of the frame buffer the workers are attached to
+        self.textures = {}  # textures the workers have, by token (see Texture.token)
+        self.executor = None
+        # the arrays of the frame being rendered, read by the workers
+        self.arrays = SharedArrays()
+
+    # (re)starts the pool of workers, attached to the frame buffer, with the textures
+    # (the workers get a copy of the textures when they start)
+    def start(self, frame_buffer, textures):
+        self.close()
+        self.names = frame_buffer.names
+        self.textures = textures
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_worker,
+            initargs=(*frame_buffer.size, frame_buffer.names, textures),
+        )
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.executor, self.names = None, None
+        self.arrays.close()
+
+    # renders the face batches (see GraphicsPipeline.faces_to_draw) into the buffers
+    # textured: whether to draw the textures, else each triangle is filled with its color
+    # colors: the color of each triangle of each batch (for untextured drawing, lit
+    # at each pixel by the shader, if given, else already lit)
+    # the frame buffer is expected to be shared (see FrameBuffer) and cleared
+    # returns the number of pixels drawn, and rejected by the depth test
+    def render(self, frame_buffer, batches, textured, shader=None, colors=None):
+        assert frame_buffer.names is not None, "frame buffer is not shared"
+        width, height = frame_buffer.size
+        # the textures by their tokens, so that the workers get the changed textures
+        # (and the new ones) as new textures
+        textures = {}
+        if textured:
+            for batch in batches:
+                if batch.mesh.texture is not None:
+                    textures[batch.mesh.texture.token] = batch.mesh.texture
+        if (
+            self.names != frame_buffer.names
+            or not textures.keys() <= self.textures.keys()
+        ):
+            self.start(frame_buffer, textures)
+
+        # the arrays of the batches, which the workers index by the tiles' triangles
+        arrays, tokens = [], []
+        for b, batch in enumerate(batches):
+            texture = batch.mesh.texture if textured else None
+            derivatives = None
+            if (
+                texture is not None
+                and batch.texture_coordinates is not None
+                and texture.mipmapped
+            ):
+                derivatives = texture_lod_derivatives(
+                    batch.screen_vertices, batch.texture_coordinates
+                )
+            tokens.append(texture.token if texture is not None else None)
+            arrays += [
+                batch.screen_vertices,
+                batch.texture_coordinates,
+                batch.textured,
+                batch.light_intensity,
+                colors[b] if colors is not None else None,
+                derivatives,
+            ]
+
+        # bin the triangles of all the batches
+        tiles = {}
+        for b, batch in enumerate(batches):
+            binned = bin_triangles(batch.screen_vertices, width, height, self.tile_size)
+            for tile, triangles in binned.items():
+                tiles.setdefault(tile, []).append((b, triangles))
+
+        # the work for each tile, with only the ranges of the triangles overlapping it
+        # (of the triangles of all the tiles, one after another)
+        work, triangles, start = [], [], 0
+        for (tile_x, tile_y), binned in sorted(tiles.items()):
+            x0, y0 = tile_x * self.tile_size, tile_y * self.tile_size
+            x1, y1 = min(x0 + self.tile_size, width), min(y0 + self.tile_size, height)
+            draw_calls = []
+            for b, tile_triangles in binned:
+                triangles.append(tile_triangles)
+                draw_calls.append((b, start, start + len(tile_triangles)))
+                start += len(tile_triangles)
+            work.append((x0, y0, x1, y1, draw_calls))
+        if not work:
+            return (0, 0)
+
+        # only the layouts of the arrays in the shared memory are sent to the workers
+        name, layouts = self.arrays.pack([np.concatenate(triangles), *arrays])
+        triangles_layout = layouts[0]
+        batch_layouts = [
+            (token, layouts[1 + 6 * b : 7 + 6 * b]) for b, token in enumerate(tokens)
+        ]
+
+        # neighbouring tiles tend to have similar amount of work,
+        # so the tiles are dealt to the tasks in turns
+        num_tasks = min(len(work), self.workers * TASKS_PER_WORKER)
+        futures = [
+            self.executor.submit(
+                render_tiles,
+                name,
+                batch_layouts,
+                triangles_layout,
+                work[task::num_tasks],
+                textured,
+                self.rasterizer,
+                shader,
+            )
+            for task in range(num_tasks)
+        ]
+        results = [future.result() for future in futures]
+        return tuple(map(sum, zip(*results)))
+
+
+# checks that the tiled renderer draws the same images as drawing the triangles one
+# after another, with trilinear filtering (whose level of detail depends on the vertices'
+# sub-pixel positions, see render_tiles), on some of the benchmark's scenes
+if __name__ == "__main__":
+    import pygame
+    from benchmark import create_pipeline, checkerboard_texture
+    from graphics_pipeline import GraphicsPipeline
+
+    size = 128
+    for scene in ["cube", "cottage", "sphere_2k", "overdraw", "instanced"]:
+        for options in [
+            dict(rasterizer="vectorized"),
+            dict(rasterizer="vectorized", perspective_correct=True),
+            dict(rasterizer="fixed"),
+        ]:
+            images = []
+            for workers in [None, 2]:
+                pipeline = create_pipeline(
+                    scene, size, size, "trilinear", workers=workers, **options
+                )
+                pipeline.update()
+                pipeline.draw_textured()
+                images.append(pygame.surfarray.array3d(pipeline.screen))
+                pipeline.close()
+            different = np.count_nonzero((images[0] != images[1]).any(axis=2))
+            print(f"{scene} {options}: {different} pixels differ")
+            assert different == 0, f"{scene}: tiled image differs from serial"
+
+    # a texture replaced by a new one, or changed in place (see Texture.changed),
+    # is drawn as it is now, not as the copy of it the workers got before
+    pipeline = create_pipeline("cube", size, size, rasterizer="vectorized", workers=2)
+    mesh = pipeline.meshs[0]
+    for change in ["replaced", "changed"]:
+        if change == "replaced":
+            mesh.texture = checkerboard_texture(squares=4)
+        else:
+            mesh.texture.texture = 255 - mesh.texture.texture
+            mesh.texture.changed()
+        serial = GraphicsPipeline(
+            pipeline.meshs,
+            pipeline.camera,
+            pygame.Surface((size, size)),
+            shader=pipeline.shader,
+            rasterizer="vectorized",
+        )
+        images = []
+        for renderer in [serial, pipeline]:
+            renderer.update()
+            renderer.draw_textured()
+            images.append(pygame.surfarray.array3d(renderer.screen))
+        serial.close()
+        different = np.count_nonzero((images[0] != images[1]).any(axis=2))
+        print(f"texture {change}: {different} pixels differ")
+        assert different == 0, f"tiled image differs from serial, texture {change}"
+    pipeline.close()
+
+    # the time of a frame with more and more workers (they can only be faster than
+    # drawing the triangles one after another with as many cores)
+    import time
+
+    for workers in [None, 1, 2, 4]:
+        pipeline = create_pipeline("overdraw", 512, 512, workers=workers)
+        pipeline.update()
+        pipeline.draw_textured()
+        start = time.perf_counter()
+        for _ in range(10):
+            pipeline.draw_textured()
+        elapsed = (time.perf_counter() - start) / 10
+        pipeline.close()
+        print(f"overdraw 512x512, workers {workers}: {elapsed * 1000:.2f} ms")
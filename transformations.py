@@ -12,6 +12,13 @@ def normalize(v):
     return v / norm
 
 
+# normalizes each vector along the last axis of the array
+# (ie, the array is a stack of vectors), zero vectors are left as is
+def normalize_vectors(v):
+    norm = np.linalg.norm(v, axis=-1, keepdims=True)
+    return v / np.where(norm < EPSILON, 1.0, norm)
+
+
 def translate(tx, ty, tz):
     return np.array(
         [
@@ -104,3 +111,29 @@ def viewport(width, height):
             [0.0, 0.0, 0.0, 1.0],
         ],
     )
+
+
+# the transformations translate @ rotate @ scale (see Mesh.world_matrix) of many objects
+# at once (N x 4 x 4), given their positions, rotations and scales (N x 3)
+def transformation_matrices(positions, rotations, scales):
+    cos, sin = np.cos(rotations), np.sin(rotations)
+    ones, zeros = np.ones(len(rotations)), np.zeros(len(rotations))
+    (cx, cy, cz), (sx, sy, sz) = cos.T, sin.T
+    # same as rotate_x, rotate_y, rotate_z (the upper left 3 x 3), for each object
+    rotations_x = np.stack(
+        [ones, zeros, zeros, zeros, cx, -sx, zeros, sx, cx], axis=-1
+    ).reshape(-1, 3, 3)
+    rotations_y = np.stack(
+        [cy, zeros, sy, zeros, ones, zeros, -sy, zeros, cy], axis=-1
+    ).reshape(-1, 3, 3)
+    rotations_z = np.stack(
+        [cz, -sz, zeros, sz, cz, zeros, zeros, zeros, ones], axis=-1
+    ).reshape(-1, 3, 3)
+
+    matrices = np.zeros((len(positions), 4, 4))
+    # same order as rotate, and scaling the columns is the same as scaling first
+    rotation_matrices = rotations_z @ rotations_x @ rotations_y
+    matrices[:, :3, :3] = rotation_matrices * scales[:, np.newaxis, :]
+    matrices[:, :3, 3] = positions
+    matrices[:, 3, 3] = 1.0
+    return matrices